@@ -14,7 +14,7 @@ class ForumCategoryAdmin(admin.ModelAdmin):
 @admin.register(ForumThread)
 class ForumThreadAdmin(admin.ModelAdmin):
     list_display = ["title", "category", "user", "is_pinned", "is_locked", 
-                    "view_count", "created_at"]
+                    "view_count", "post_count", "last_post_at", "created_at"]
     list_filter = ["category", "is_pinned", "is_locked"]
     search_fields = ["title", "user__username"]
 
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def backfill_thread_counters(apps, schema_editor):
+    """Fill post_count and the last post for threads created before this migration"""
+    ForumThread = apps.get_model("forums", "ForumThread")
+    ForumPost = apps.get_model("forums", "ForumPost")
+    latest = ForumPost.objects.filter(thread=OuterRef("pk")).order_by(
+        "-created_at", "-post_id"
+    )
+    threads = ForumThread.objects.annotate(
+        n=Count("posts"),
+        latest_id=Subquery(latest.values("post_id")[:1]),
+        latest_user=Subquery(latest.values("user_id")[:1]),
+        latest_at=Subquery(latest.values("created_at")[:1]),
+    ).filter(n__gt=0)
+
+    updated = []
+    for thread in threads.iterator():
+        thread.post_count = thread.n
+        thread.last_post_id = thread.latest_id
+        thread.last_post_user_id = thread.latest_user
+        thread.last_post_at = thread.latest_at
+        updated.append(thread)
+    ForumThread.objects.bulk_update(
+        updated,
+        ["post_count", "last_post", "last_post_user", "last_post_at"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forums", "0004_forumpost_image_url"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumthread",
+            name="last_post",
+            field=models.ForeignKey(
+                blank=True,
+                db_column="last_post_id",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="forums.forumpost",
+            ),
+        ),
+        migrations.AddField(
+            model_name="forumthread",
+            name="last_post_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="forumthread",
+            name="last_post_user",
+            field=models.ForeignKey(
+                blank=True,
+                db_column="last_post_user_id",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="forumthread",
+            name="post_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_thread_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forums", "0005_thread_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="forumpost",
+            index=models.Index(
+                fields=["thread", "created_at", "post_id"],
+                name="forum_posts_thread_idx",
+            ),
+        ),
+    ]
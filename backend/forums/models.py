@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery
 from django.conf import settings
 from django.utils import timezone
 
@@ -46,6 +47,26 @@ class ForumThread(models.Model):
     is_pinned = models.BooleanField(default=False)
     is_locked = models.BooleanField(default=False)
     view_count = models.IntegerField(default=0)
+    # Kept up to date as posts are created and deleted, so thread lists
+    # don't have to read the posts
+    post_count = models.IntegerField(default=0)
+    last_post = models.ForeignKey(
+        "ForumPost",
+        null = True,
+        blank = True,
+        on_delete = models.SET_NULL,
+        db_column = "last_post_id",
+        related_name = "+",
+    )
+    last_post_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null = True,
+        blank = True,
+        on_delete = models.SET_NULL,
+        db_column = "last_post_user_id",
+        related_name = "+",
+    )
+    last_post_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -58,12 +79,23 @@ class ForumThread(models.Model):
         
     def get_post_count(self):
         """ Get the number of posts in this thread."""
-        return self.posts.count()
+        return self.post_count
+
+    @classmethod
+    def refresh_last_post(cls, thread_id):
+        """Point a thread at its newest post again if its last post was deleted"""
+        latest = ForumPost.objects.filter(thread=OuterRef("pk")).order_by("-created_at", "-post_id")
+        cls.objects.filter(pk=thread_id, last_post__isnull=True).update(
+            last_post=Subquery(latest.values("post_id")[:1]),
+            last_post_user=Subquery(latest.values("user_id")[:1]),
+            last_post_at=Subquery(latest.values("created_at")[:1]),
+        )
         
     def increment_views(self):
         """Increment views of thred when viewed. """
+        # In the database, so concurrent views aren't lost
+        ForumThread.objects.filter(pk=self.pk).update(view_count=F("view_count") + 1)
         self.view_count += 1
-        self.save(update_fields=["view_count"])
 
     def get_first_post(self):
         """ Get the first post in the thread."""
@@ -71,7 +103,7 @@ class ForumThread(models.Model):
         
     def get_last_post(self):
         """Get the most recent post in the thread"""
-        return self.posts.order_by("-created_at").first()
+        return self.last_post
         
 
 class ForumPost(models.Model):
@@ -112,6 +144,11 @@ class ForumPost(models.Model):
     class Meta:
         db_table = "forum_posts"
         ordering = ["created_at"]
+        indexes = [
+            # Paging through a thread's posts (forums/pagination.py)
+            models.Index(fields=["thread", "created_at", "post_id"],
+                         name="forum_posts_thread_idx"),
+        ]
 
     def __str__(self):
         return f"Post by {self.user.username} in {self.thread.title}"
@@ -119,16 +156,23 @@ class ForumPost(models.Model):
     def save(self, *args, **kwargs):
         """Mark the post as edited when updated by user."""
 
-        if self.pk: 
+        created = self.pk is None
+        if not created: 
             original = ForumPost.objects.get(pk=self.pk)
             if original.contents != self.contents:
                 self.is_edited = True
                 self.edited_at = timezone.now()
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
-        # Updates the time stamp
-        self.thread.save(update_fields=["updated_at"])
+            # Updates the time stamp, and the counters for a new post.
+            # One UPDATE, so concurrent posts can't lose a count
+            changes = {"updated_at": timezone.now()}
+            if created:
+                changes.update(post_count=F("post_count") + 1, last_post=self.pk,
+                               last_post_user=self.user_id, last_post_at=self.created_at)
+            ForumThread.objects.filter(pk=self.thread_id).update(**changes)
 
 
     def get_replies(self):
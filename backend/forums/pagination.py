@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PostCursorPagination(CursorPagination):
+    """
+        Posts of a thread, oldest first, by cursor. Pages stay stable while
+        new posts arrive and deep pages cost the same as the first.
+    """
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("created_at", "post_id")
@@ -29,7 +29,7 @@ class ForumPostPhotoUploadSerializer(serializers.Serializer):
 class ForumPostSerializer(serializers.ModelSerializer):
     """Serialize individual posts"""
     user = UserSerializer(read_only=True)
-    reply_count = serializers.IntegerField(read_only=True, source="replies.count")
+    reply_count = serializers.SerializerMethodField()
     photos = ForumPostPhotoSerializer(many=True, read_only=True)
 
     class Meta:
@@ -50,6 +50,11 @@ class ForumPostSerializer(serializers.ModelSerializer):
         
         return super().create(validated_data)
 
+    def get_reply_count(self, obj):
+        """Annotated by the views as num_replies, counted otherwise"""
+        num_replies = getattr(obj, "num_replies", None)
+        return obj.replies.count() if num_replies is None else num_replies
+
 class ForumCategorySerializer(serializers.ModelSerializer):
     """Serialize the forum categories."""
     thread_count = serializers.IntegerField(read_only=True)
@@ -72,13 +77,15 @@ class ForumThreadListSerializer(serializers.ModelSerializer):
         fields = ["thread_id", "title", "user", "category", "category_name", 
                   "is_pinned", "is_locked", "view_count", "post_count",
                   "latest_post", "created_at", "updated_at"]
-        read_only_fields = ["thread_id", "user", "view_count", "created_at", "updated_at"]
+        read_only_fields = ["thread_id", "user", "view_count", "post_count", 
+                            "created_at", "updated_at"]
 
     def get_latest_post(self, obj):
-        """Get info about latest post in thread"""
-        latest = obj.get_last_post()
-        if latest:
-            return {"user": latest.user.username, "created_at": latest.created_at}
+        """Get info about latest post in thread, from the thread's own columns"""
+        if obj.last_post_id:
+            return {"post_id": obj.last_post_id,
+                    "user": obj.last_post_user.username if obj.last_post_user else None,
+                    "created_at": obj.last_post_at}
         return None
     
 class CreateThreadSerializer(serializers.ModelSerializer):
@@ -105,18 +112,14 @@ class CreateThreadSerializer(serializers.ModelSerializer):
         return thread
     
 class ForumThreadDetailSerializer(serializers.ModelSerializer):
-    """Detailed thread serializer with all posts"""
+    """Detailed thread serializer. The views add the first page of posts"""
     user = UserSerializer(read_only=True)
     category = ForumCategorySerializer(read_only=True)
-    posts = ForumPostSerializer(many=True, read_only=True)
-    post_count = serializers.SerializerMethodField()
     
     class Meta:
         model = ForumThread
         fields = ["thread_id", "title", "user", "category", "is_pinned", 
-                  "is_locked", "view_count", "post_count", "posts", 
+                  "is_locked", "view_count", "post_count", 
                   "created_at", "updated_at"]
-        read_only_fields = ["thread_id", "user", "view_count", "created_at", "updated_at"]
-    
-    def get_post_count(self, obj):
-        return obj.posts.count()
\ No newline at end of file
+        read_only_fields = ["thread_id", "user", "view_count", "post_count", 
+                            "created_at", "updated_at"]
\ No newline at end of file
@@ -0,0 +1,22 @@
+"""
+Signals for forums app. Keep a thread's post_count and last post in step
+when its posts are deleted (new posts update them in ForumPost.save).
+"""
+from django.db.models import F, QuerySet
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import ForumThread, ForumPost
+
+
+@receiver(post_delete, sender=ForumPost)
+def update_thread_counters(sender, instance, origin=None, **kwargs):
+    """Runs in the delete's transaction, once per deleted post and reply"""
+    # Nothing to keep up to date when the whole thread goes
+    if isinstance(origin, ForumThread) or (isinstance(origin, QuerySet) 
+                                           and origin.model is ForumThread):
+        return
+    ForumThread.objects.filter(pk=instance.thread_id).update(
+        post_count=Greatest(F("post_count") - 1, 0))
+    # Deleting the thread's last post set its last_post to NULL
+    ForumThread.refresh_last_post(instance.thread_id)
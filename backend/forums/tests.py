@@ -1,3 +1,210 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import ForumCategory, ForumThread, ForumPost
+from .viewcounts import flush_views, pending_views
+
+
+class ThreadCounterTests(TestCase):
+    """post_count and the last post are kept on the thread"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.author = User.objects.create_user(username="author", email="author@example.com",
+                                              password="pass")
+        cls.replier = User.objects.create_user(username="replier", email="replier@example.com",
+                                               password="pass")
+        cls.category = ForumCategory.objects.create(name="Trip Reports", description="Trips")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def create_thread(self, title="Rainier"):
+        response = self.client.post("/api/forums/threads/", {
+            "title": title, "category": self.category.pk, "first_post_content": "Went up"})
+        self.assertEqual(response.status_code, 201)
+        return ForumThread.objects.get(title=title)
+
+    def test_counters_follow_posts(self):
+        thread = self.create_thread()
+        first = ForumPost.objects.get(thread=thread)
+        self.assertEqual((thread.post_count, thread.last_post_id), (1, first.pk))
+
+        reply = ForumPost.objects.create(thread=thread, user=self.replier, contents="Nice",
+                                         parent_post=first)
+        nested = ForumPost.objects.create(thread=thread, user=self.author, contents="Thanks",
+                                          parent_post=reply)
+        thread.refresh_from_db()
+        self.assertEqual(thread.post_count, 3)
+        self.assertEqual((thread.last_post_id, thread.last_post_user_id), (nested.pk, self.author.pk))
+        self.assertEqual(thread.last_post_at, nested.created_at)
+
+        # Editing doesn't count as a new post
+        reply.contents = "Very nice"
+        reply.save()
+        thread.refresh_from_db()
+        self.assertEqual((thread.post_count, thread.last_post_id), (3, nested.pk))
+
+        # Deleting a post deletes its replies too
+        reply.delete()
+        thread.refresh_from_db()
+        self.assertEqual(thread.post_count, 1)
+        self.assertEqual((thread.last_post_id, thread.last_post_user_id), (first.pk, self.author.pk))
+
+        first.delete()
+        thread.refresh_from_db()
+        self.assertEqual((thread.post_count, thread.last_post_id, thread.last_post_at), (0, None, None))
+
+    def test_list_query_count(self):
+        for i in range(10):
+            thread = self.create_thread(f"Thread {i}")
+            ForumPost.objects.create(thread=thread, user=self.replier, contents="Reply")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/forums/threads/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        self.assertLessEqual(len(queries), 2)
+        self.assertEqual(response.data[0]["post_count"], 2)
+        self.assertEqual(response.data[0]["latest_post"]["user"], "replier")
+
+
+class ViewCountTests(TestCase):
+    """Views are deduplicated per viewer and written in batches"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(username=f"reader{i}", email=f"reader{i}@example.com",
+                                              password="pass") for i in range(3)]
+        category = ForumCategory.objects.create(name="Gear", description="Gear")
+        cls.thread = ForumThread.objects.create(category=category, user=cls.users[0], title="Boots")
+        cls.other = ForumThread.objects.create(category=category, user=cls.users[0], title="Tents")
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(flush_views)
+
+    def view(self, thread, user=None):
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+        return client.get(f"/api/forums/threads/{thread.pk}/")
+
+    def test_repeat_views_count_once(self):
+        for _ in range(3):
+            response = self.view(self.thread, self.users[1])
+        self.assertEqual(response.data["view_count"], 1)
+        self.view(self.thread, self.users[2])
+        self.view(self.thread)
+        self.view(self.other, self.users[1])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(flush_views(), 2)
+        self.assertEqual(len(queries), 1)
+        self.thread.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.thread.view_count, self.other.view_count), (3, 1))
+        self.assertEqual(flush_views(), 0)
+
+    def test_views_flushed_in_batches(self):
+        with mock.patch("forums.viewcounts.FLUSH_VIEWS", 2):
+            self.view(self.thread, self.users[1])
+            self.thread.refresh_from_db()
+            self.assertEqual(self.thread.view_count, 0)
+            self.view(self.thread, self.users[2])
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.view_count, 2)
+
+    def test_failed_flush_keeps_views(self):
+        with mock.patch("forums.viewcounts.FLUSH_VIEWS", 1), \
+                mock.patch("django.db.models.query.QuerySet.update", side_effect=DatabaseError):
+            with self.assertLogs("forums.viewcounts", "ERROR"):
+                response = self.view(self.thread, self.users[1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["view_count"], 1)
+        self.assertEqual(pending_views(self.thread.pk), 1)
+
+        self.assertEqual(flush_views(), 1)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.view_count, 1)
+
+
+class ThreadDetailTests(TestCase):
+    """Thread detail pages through its posts with a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username="talker", email="talker@example.com",
+                                            password="pass")
+        category = ForumCategory.objects.create(name="Routes", description="Routes")
+        cls.thread = ForumThread.objects.create(category=category, user=cls.user, title="JMT")
+        start = timezone.now() - timedelta(days=30)
+        ForumPost.objects.bulk_create(
+            ForumPost(thread=cls.thread, user=cls.user, contents=f"Post {i}")
+            for i in range(5000))
+        # bulk_create sets the same created_at on every post; spread them out
+        for i, post in enumerate(ForumPost.objects.filter(thread=cls.thread).order_by("post_id")[:60]):
+            ForumPost.objects.filter(pk=post.pk).update(created_at=start + timedelta(minutes=i),
+                                                        updated_at=start + timedelta(minutes=i))
+        cls.first = ForumPost.objects.filter(thread=cls.thread).order_by("created_at", "post_id").first()
+        ForumPost.objects.bulk_create(
+            ForumPost(thread=cls.thread, user=cls.user, contents="Reply", parent_post=cls.first)
+            for _ in range(3))
+
+    def setUp(self):
+        cache.clear()
+        # Write the counted views before the test's rows are rolled back
+        self.addCleanup(flush_views)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_first_page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/forums/threads/{self.thread.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 4)
+        self.assertEqual(len(response.data["posts"]), 50)
+        self.assertEqual(response.data["posts"][0]["post_id"], self.first.pk)
+        self.assertEqual(response.data["posts"][0]["reply_count"], 3)
+        self.assertIsNotNone(response.data["posts_next"])
+
+        next_page = self.client.get(response.data["posts_next"])
+        self.assertEqual(next_page.status_code, 200)
+        self.assertEqual(len(next_page.data["results"]), 50)
+        seen = {post["post_id"] for post in response.data["posts"]}
+        self.assertFalse(seen & {post["post_id"] for post in next_page.data["results"]})
+
+    def test_since(self):
+        since = timezone.now()
+        post = ForumPost.objects.create(thread=self.thread, user=self.user, contents="New")
+        response = self.client.get(f"/api/forums/threads/{self.thread.pk}/posts/",
+                                   {"since": (since - timedelta(days=40)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 50)
+
+        response = self.client.get(f"/api/forums/threads/{self.thread.pk}/posts/",
+                                   {"since": since.isoformat()})
+        self.assertEqual([result["post_id"] for result in response.data["results"]], [post.pk])
+
+        # Without an offset it's in the site's time zone
+        naive = timezone.localtime(since).replace(tzinfo=None)
+        response = self.client.get(f"/api/forums/threads/{self.thread.pk}/posts/",
+                                   {"since": naive.isoformat()})
+        self.assertEqual([result["post_id"] for result in response.data["results"]], [post.pk])
 
-# Create your tests here.
+        for bad in ["yesterday", "2025-02-30T00:00:00"]:
+            response = self.client.get(f"/api/forums/threads/{self.thread.pk}/posts/",
+                                       {"since": bad})
+            self.assertEqual(response.status_code, 400)
@@ -0,0 +1,108 @@
+"""
+Buffered thread view counting. Saving view_count on every page view makes
+hot threads queue on one row lock, and read-modify-write saves lose counts
+when two requests overlap. Instead each worker process counts views in
+memory and writes them back once FLUSH_SECONDS have passed (or FLUSH_VIEWS
+are pending) with a single UPDATE adding each thread's count with F().
+
+A viewer (user, or session / address for anonymous readers) counts once
+per thread every DEDUPE_SECONDS; the marker lives in the Django cache, so
+workers share it only when the cache is shared (Redis). With the local
+memory cache each worker process dedupes on its own.
+
+There is no timer: due views are written by the worker's next counted
+view, or when it shuts down cleanly. A worker that goes idle keeps its
+pending views until then, however long that is, and loses them if it is
+killed. A failed write is logged and the views are kept for the next
+one, so the page still loads.
+"""
+
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import ForumThread
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = 10
+FLUSH_VIEWS = 1000
+# Reloading or coming back to a thread within this window isn't a new view
+DEDUPE_SECONDS = 30 * 60
+
+_lock = threading.Lock()
+_pending = Counter()
+_last_flush = time.monotonic()
+
+
+def viewer_key(request):
+    """Who is viewing: the user, else the session, else address and browser"""
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    session_key = getattr(getattr(request, "session", None), "session_key", None)
+    if session_key:
+        return f"session:{session_key}"
+    anonymous = f"{request.META.get('REMOTE_ADDR', '')}|{request.META.get('HTTP_USER_AGENT', '')}"
+    return "anon:" + hashlib.sha1(anonymous.encode()).hexdigest()
+
+
+def record_view(thread_id, viewer):
+    """
+        Count a view of a thread unless this viewer saw it recently. Returns
+        whether it was counted.
+    """
+    # cache.add only sets the key if it isn't there yet
+    if not cache.add(f"forums:viewed:{thread_id}:{viewer}", 1, DEDUPE_SECONDS):
+        return False
+    with _lock:
+        _pending[thread_id] += 1
+        due = (sum(_pending.values()) >= FLUSH_VIEWS
+               or time.monotonic() - _last_flush >= FLUSH_SECONDS)
+    if due:
+        try:
+            flush_views()
+        except Exception:
+            # The counts are still pending; don't fail the page view
+            logger.exception("Could not write thread view counts")
+    return True
+
+
+def pending_views(thread_id):
+    """Views of a thread counted by this process but not written yet"""
+    with _lock:
+        return _pending.get(thread_id, 0)
+
+
+def flush_views():
+    """
+        Write the pending view counts in one UPDATE. Returns the number of
+        threads. If the UPDATE fails the counts stay pending and the error
+        is raised.
+    """
+    global _last_flush
+    with _lock:
+        counts = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not counts:
+        return 0
+    try:
+        ForumThread.objects.filter(pk__in=counts).update(view_count=F("view_count") + Case(
+            *[When(pk=thread_id, then=Value(count)) for thread_id, count in counts.items()],
+            default=Value(0), output_field=IntegerField()))
+    except Exception:
+        # Keep the counts for the next flush
+        with _lock:
+            _pending.update(counts)
+        raise
+    return len(counts)
+
+
+atexit.register(flush_views)
@@ -3,6 +3,10 @@ from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.shortcuts import get_object_or_404
+from django.db.models import Count
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import ForumCategory, ForumThread, ForumPost, ForumPostPhoto
 from .serializers import (
     ForumCategorySerializer,
@@ -13,6 +17,8 @@ from .serializers import (
     ForumPostPhotoSerializer,
     ForumPostPhotoUploadSerializer, # used in upload_photo method
 )
+from .pagination import PostCursorPagination
+from .viewcounts import pending_views, record_view, viewer_key
 import cloudinary.uploader
 
 
@@ -35,7 +41,7 @@ class ForumThreadViewSet(viewsets.ModelViewSet):
         - Update/delete threads
     """
 
-    queryset = ForumThread.objects.select_related("user", "category").prefetch_related("posts")
+    queryset = ForumThread.objects.select_related("user", "category")
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def get_serializer_class(self):
@@ -55,15 +61,71 @@ class ForumThreadViewSet(viewsets.ModelViewSet):
 
         if category_id:
             queryset = queryset.filter(category_id=category_id)
+
+        if self.action == "list":
+            # Counters and the last post are columns on the thread
+            queryset = queryset.select_related("last_post_user")
         
         return queryset
+
+    def page_posts(self, thread):
+        """
+            One page of the thread's posts, with authors, photos and reply
+            counts loaded in two queries. Returns (paginator, posts, error)
+        """
+        posts = (ForumPost.objects.filter(thread=thread)
+                 .select_related("user")
+                 .prefetch_related("photos")
+                 .annotate(num_replies=Count("replies")))
+
+        since = self.request.query_params.get("since")
+        if since:
+            try:
+                since_time = parse_datetime(since)
+            except ValueError:
+                # Well formed but not a real date, e.g. February 30th
+                since_time = None
+            if since_time is None:
+                return None, None, Response({"ERROR": "since must be an ISO 8601 date and time."},
+                                            status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since_time):
+                since_time = timezone.make_aware(since_time)
+            # New and edited posts only, for refreshing an open thread
+            posts = posts.filter(updated_at__gt=since_time)
+
+        paginator = PostCursorPagination()
+        page = paginator.paginate_queryset(posts, self.request, view=self)
+        # Later pages come from the posts action, which doesn't count views
+        url = reverse("thread-posts", args=[thread.pk])
+        query = self.request.META.get("QUERY_STRING")
+        paginator.base_url = self.request.build_absolute_uri(f"{url}?{query}" if query else url)
+        return paginator, ForumPostSerializer(page, many=True).data, None
     
     def retrieve(self, request, *args, **kwargs):
-        """Increment viewcount when thread is viewed"""
+        """
+            Count the view (buffered, see forums/viewcounts.py) when thread
+            is viewed. Returns the first page of posts, posts_next loads more
+        """
+        thread = self.get_object()
+        paginator, posts, error = self.page_posts(thread)
+        if error:
+            return error
+        record_view(thread.pk, viewer_key(request))
+        # Include views this worker hasn't written yet
+        thread.view_count += pending_views(thread.pk)
+        data = self.get_serializer(thread).data
+        data["posts"] = posts
+        data["posts_next"] = paginator.get_next_link()
+        return Response(data)
+
+    @action(detail=True, methods=["get"])
+    def posts(self, request, pk=None):
+        """Page through a thread's posts (?cursor=, ?since=) without counting a view"""
         thread = self.get_object()
-        thread.increment_views()
-        serializer = self.get_serializer(thread)
-        return Response(serializer.data)
+        paginator, posts, error = self.page_posts(thread)
+        if error:
+            return error
+        return paginator.get_paginated_response(posts)
     
     def perform_update(self, serializer):
         """Only allows users to edit their own threads"""
@@ -117,7 +179,8 @@ class ForumPostViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Filter post by thread"""
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().prefetch_related("photos").annotate(
+            num_replies=Count("replies"))
         thread_id = self.request.query_params.get("thread")
 
         if thread_id:
@@ -2,6 +2,8 @@
 ASGI config for hiking_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django as usual; WebSocket connections (live tracking)
+are routed by Channels.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hiking_app.settings")
 
-application = get_asgi_application()
+# Django has to be set up before importing anything that uses models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from tracking.routing import websocket_urlpatterns  # noqa: E402
+from users.middleware import TokenAuthMiddlewareStack  # noqa: E402
+
+application = ProtocolTypeRouter({
+    "http": django_asgi_app,
+    "websocket": AllowedHostsOriginValidator(
+        TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
+})
@@ -37,6 +37,8 @@ ALLOWED_HOSTS = ["*"]
 # Application definition
 
 INSTALLED_APPS = [
+    # Must come first so runserver serves WebSockets through ASGI
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -45,6 +47,7 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "rest_framework",
     "rest_framework.authtoken",
+    "channels",
     "users",
     "corsheaders",
     "forums", 
@@ -92,6 +95,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "hiking_app.wsgi.application"
+ASGI_APPLICATION = "hiking_app.asgi.application"
 
 
 # Database
@@ -119,6 +123,61 @@ else:
         }
     }
 
+# Cache configuration
+# Set REDIS_URL so every worker shares one cache, otherwise each process
+# keeps its own in memory
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Rendered trail/park responses are only cached when the cache is shared:
+# a per-process cache can't be invalidated by other workers or by the
+# sync_parks_trails / compute_trail_popularity commands (trails/caching.py)
+TRAILS_RESPONSE_CACHE = bool(os.environ.get("REDIS_URL"))
+
+# Channel layer for live tracking WebSockets. Redis is needed when more than
+# one ASGI worker runs; the in-memory layer only reaches the same process
+if os.environ.get("REDIS_URL"):
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [os.environ.get("REDIS_URL")]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
+    }
+
+# Write-behind buffer for GPS points (tracking/buffer.py). When set, the
+# REST point endpoints spool points to files in this directory and insert
+# them in batches. Nodes serving the endpoints need to see the same directory
+GPS_POINT_BUFFER_DIR = os.environ.get("GPS_POINT_BUFFER_DIR")
+GPS_POINT_BUFFER_FLUSH_BYTES = 256 * 1024
+GPS_POINT_BUFFER_FLUSH_SEC = 10
+
+# Completed tracks older than this are moved to cold storage by the
+# archive_gps_tracks command (tracking/archive.py)
+GPS_TRACK_ARCHIVE_AFTER_DAYS = 30
+
+# Heatmap tiles of all stopped tracks (tracking/heatmap.py), written by the
+# update_heatmap_tiles command and served by /api/tracking/heatmap/. Nodes
+# serving tiles need to see the same directory
+HEATMAP_TILE_DIR = os.environ.get("HEATMAP_TILE_DIR", str(BASE_DIR / "heatmap_tiles"))
+HEATMAP_MAX_ZOOM = 16
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Hike, GPSTrack, GPSPoint
+from .models import Hike, GPSTrack, GPSPoint, HikerStats, SyncTombstone
 
 
 @admin.register(Hike)
@@ -11,8 +11,9 @@ class HikeAdmin(admin.ModelAdmin):
 
 @admin.register(GPSTrack)
 class GPSTrackAdmin(admin.ModelAdmin):
-    list_display = ["hike", "user", "started_at", "ended_at", "total_distance_miles"]
-    list_filter = ["started_at"]
+    list_display = ["hike", "user", "started_at", "ended_at", "total_distance_miles", 
+                    "archived_at"]
+    list_filter = ["started_at", "archived_at"]
     search_fields = ["user__username", "hike__trail__name"]
 
 @admin.register(GPSPoint)
@@ -20,3 +21,15 @@ class GPSPointAdmin(admin.ModelAdmin):
     list_display = ["track", "point_order", "latitude", "longitude", "recorded_at"]
     list_filter = ["track"]
     search_fields = ["track__hike__trail__name"]
+
+@admin.register(HikerStats)
+class HikerStatsAdmin(admin.ModelAdmin):
+    list_display = ["user", "total_hikes", "total_distance_miles", "total_duration_min", 
+                    "updated_at"]
+    search_fields = ["user__username"]
+
+@admin.register(SyncTombstone)
+class SyncTombstoneAdmin(admin.ModelAdmin):
+    list_display = ["user", "kind", "object_id", "deleted_at"]
+    list_filter = ["kind"]
+    search_fields = ["user__username"]
@@ -0,0 +1,169 @@
+"""
+Track statistics computed from a track's GPS points with NumPy. Everything
+works on whole arrays, so a 100k point track takes milliseconds instead of a
+Python loop per point.
+"""
+
+import math
+
+import numpy as np
+
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_MILE = 1609.344
+
+# Altitude has to move this far from the last turning point to count as
+# climbing or descending, so GPS altitude jitter doesn't add fake gain
+ELEVATION_HYSTERESIS_FT = 10.0
+
+# Slower than this between two fixes counts as stopped
+STOPPED_SPEED_MPS = 0.5
+
+# Max speed is measured over this many consecutive segments to ignore
+# single-fix jumps
+MAX_SPEED_WINDOW = 5
+
+
+def _optional(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+def point_arrays(points):
+    """
+        Arrays from GPSPoint values in point order: an iterable of
+        (latitude, longitude, altitude_feet, recorded_at) tuples, e.g.
+        track.gps_points.values_list(...), optionally followed by
+        accuracy_feet and speed_mps. Missing values become NaN.
+    """
+    rows = list(points)
+    if not rows:
+        empty = np.array([], dtype=float)
+        return {"latitude": empty, "longitude": empty, "altitude_feet": empty, "time": empty,
+                "accuracy_feet": empty, "speed_mps": empty}
+    latitudes, longitudes, altitudes, recorded, *extra = zip(*rows)
+    arrays = {
+        "latitude": np.array(latitudes, dtype=float),
+        "longitude": np.array(longitudes, dtype=float),
+        "altitude_feet": _optional(altitudes),
+        "time": np.array([r.timestamp() for r in recorded], dtype=float),
+    }
+    if extra:
+        arrays["accuracy_feet"], arrays["speed_mps"] = _optional(extra[0]), _optional(extra[1])
+    return arrays
+
+
+def haversine_m(latitudes, longitudes):
+    """Distance in meters between each consecutive pair of points"""
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def distance_between_m(lat1, lon1, lat2, lon2):
+    """Haversine distance in meters between two points (scalar version)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(max(a, 0.0), 1.0)))
+
+
+def elevation_change(altitudes, threshold=ELEVATION_HYSTERESIS_FT):
+    """
+        (gain, loss) in feet with hysteresis. The series is first reduced to
+        its turning points with NumPy; only those are walked in Python, and
+        a move smaller than threshold never flips the direction.
+    """
+    altitudes = altitudes[~np.isnan(altitudes)]
+    if len(altitudes) < 2:
+        return 0.0, 0.0
+
+    # Drop flat runs, then keep only local extrema and the end points
+    altitudes = altitudes[np.insert(np.diff(altitudes) != 0, 0, True)]
+    if len(altitudes) < 3:
+        extrema = altitudes
+    else:
+        slope = np.sign(np.diff(altitudes))
+        turns = np.flatnonzero(slope[1:] != slope[:-1]) + 1
+        extrema = altitudes[np.concatenate(([0], turns, [len(altitudes) - 1]))]
+
+    gain = loss = 0.0
+    # turn: last confirmed turning point, extreme: furthest point since then
+    turn = extreme = extrema[0]
+    direction = 0
+    for altitude in extrema[1:]:
+        if direction == 0:
+            if abs(altitude - turn) >= threshold:
+                direction = 1 if altitude > turn else -1
+                extreme = altitude
+        elif direction * (altitude - extreme) > 0:
+            extreme = altitude
+        elif abs(altitude - extreme) >= threshold:
+            if direction > 0:
+                gain += extreme - turn
+            else:
+                loss += turn - extreme
+            turn, extreme, direction = extreme, altitude, -direction
+    if direction > 0:
+        gain += extreme - turn
+    elif direction < 0:
+        loss += turn - extreme
+    return gain, loss
+
+
+def pace_splits(cumulative_miles, times):
+    """Seconds taken for each complete mile"""
+    whole_miles = int(cumulative_miles[-1]) if len(cumulative_miles) else 0
+    if whole_miles == 0:
+        return []
+    marks = np.arange(0, whole_miles + 1)
+    # cumulative distance never decreases, so it can be interpolated over
+    split_times = np.interp(marks, cumulative_miles, times)
+    return [int(round(seconds)) for seconds in np.diff(split_times)]
+
+
+def compute_track_stats(arrays):
+    """Distance, elevation, moving/stopped time, pace splits and max speed"""
+    latitudes, longitudes = arrays["latitude"], arrays["longitude"]
+    times = arrays["time"]
+
+    if len(latitudes) < 2:
+        bounding_box = ((float(latitudes[0]), float(longitudes[0])) * 2 
+                        if len(latitudes) else None)
+        return {"point_count": len(latitudes), "distance_m": 0.0, 
+                "bounding_box": bounding_box, "distance_miles": 0.0, 
+                "elevation_gain_ft": 0, "elevation_loss_ft": 0,
+                "moving_time_sec": 0, "stopped_time_sec": 0, "max_speed_mps": 0.0,
+                "pace_splits": []}
+
+    segment_m = haversine_m(latitudes, longitudes)
+    segment_sec = np.diff(times)
+    cumulative_m = np.concatenate(([0.0], np.cumsum(segment_m)))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speeds = np.where(segment_sec > 0, segment_m / segment_sec, 0.0)
+        moving = speeds >= STOPPED_SPEED_MPS
+        window = min(MAX_SPEED_WINDOW, len(segment_m))
+        window_m = cumulative_m[window:] - cumulative_m[:-window]
+        window_sec = times[window:] - times[:-window]
+        window_speeds = np.where(window_sec > 0, window_m / window_sec, 0.0)
+
+    moving_sec = float(segment_sec[moving].sum())
+    total_sec = float(times[-1] - times[0])
+    gain, loss = elevation_change(arrays["altitude_feet"])
+
+    return {
+        "point_count": len(latitudes),
+        "distance_m": float(cumulative_m[-1]),
+        "bounding_box": (float(latitudes.min()), float(longitudes.min()),
+                         float(latitudes.max()), float(longitudes.max())),
+        "distance_miles": float(cumulative_m[-1] / METERS_PER_MILE),
+        "elevation_gain_ft": int(round(gain)),
+        "elevation_loss_ft": int(round(loss)),
+        "moving_time_sec": int(round(moving_sec)),
+        "stopped_time_sec": int(round(max(total_sec - moving_sec, 0))),
+        "max_speed_mps": float(window_speeds.max()) if len(window_speeds) else 0.0,
+        "pace_splits": pace_splits(cumulative_m / METERS_PER_MILE, times),
+    }
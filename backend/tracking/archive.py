@@ -0,0 +1,91 @@
+"""
+Cold storage for finished tracks. Once a track is stopped and its hike
+completed, its points are only read whole (track detail, exports, maps), so
+archive_track() packs them into GPSTrack.packed_points (tracking/encoding.py)
+and deletes the GPSPoint rows. Reads go through GPSTrack.get_points() and
+point_values(), which rebuild the points from the blob, so API responses
+don't change.
+
+The blob stays on the track row rather than on disk, where every app node
+would need the same directory. Querysets that don't read the geometry
+defer it with GPSTrack.BLOB_FIELDS, since selecting the column still
+fetches the whole blob.
+
+archive_due() is run by the archive_gps_tracks command and archives tracks
+that ended more than GPS_TRACK_ARCHIVE_AFTER_DAYS days ago.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .encoding import decode_points
+from .models import GPSTrack, GPSPoint
+
+
+ARCHIVE_BATCH_SIZE = 5000
+
+
+class ArchiveError(Exception):
+    """Raised when a track can't be archived or restored"""
+
+
+def archivable_tracks(days=None):
+    """Stopped tracks of completed hikes that ended more than days ago"""
+    if days is None:
+        days = settings.GPS_TRACK_ARCHIVE_AFTER_DAYS
+    return GPSTrack.objects.filter(archived_at__isnull=True, ended_at__isnull=False,
+                                   hike__completed=True,
+                                   ended_at__lt=timezone.now() - timedelta(days=days))
+
+
+def archive_track(track_id):
+    """
+        Pack a track's points and delete the rows. Returns the number of
+        points archived.
+    """
+    with transaction.atomic():
+        track = GPSTrack.objects.select_for_update().get(pk=track_id)
+        if track.archived_at:
+            return 0
+        if not track.ended_at:
+            raise ArchiveError(f"Track {track_id} is still recording")
+
+        count = track.pack_points(save=False)
+        # Never delete rows the blob can't give back
+        if len(decode_points(track.packed_points)) != count:
+            raise ArchiveError(f"Packed points of track {track_id} don't match its rows")
+        track.archived_at = timezone.now()
+        track.point_count = count
+        track.save(update_fields=["packed_points", "archived_at", "point_count",
+                                   "updated_at"])
+        GPSPoint.objects.filter(track=track).delete()
+    return count
+
+
+def restore_track(track_id):
+    """Put an archived track's points back into gps_points"""
+    with transaction.atomic():
+        track = GPSTrack.objects.select_for_update().get(pk=track_id)
+        if not track.archived_at:
+            raise ArchiveError(f"Track {track_id} is not archived")
+
+        GPSPoint.objects.bulk_create(track.unpack_points(), batch_size=ARCHIVE_BATCH_SIZE)
+        track.archived_at = None
+        track.save(update_fields=["archived_at", "updated_at"])
+    return track.point_count
+
+
+def archive_due(days=None, limit=None):
+    """Archive tracks that are due, returns (tracks, points) archived"""
+    track_ids = archivable_tracks(days).order_by("ended_at").values_list("pk", flat=True)
+    if limit:
+        track_ids = track_ids[:limit]
+
+    tracks = points = 0
+    for track_id in list(track_ids):
+        points += archive_track(track_id)
+        tracks += 1
+    return tracks, points
@@ -0,0 +1,229 @@
+"""
+Write-behind buffer for GPS points. With GPS_POINT_BUFFER_DIR set, the REST
+point endpoints append validated points to a per-track spool file instead of
+inserting them, and the spools are written to gps_points in large batches by
+store_points(). An append is one fsync'd write under a file lock and no
+database query, so a request only has to reach the disk, and gps_points
+sees a few big inserts per track instead of a steady stream of small ones.
+
+Spool layout, one set of files per track:
+    <track_id>.jsonl                pending points, one JSON object per line
+                                    (the first line records when it started)
+    <track_id>.<random>.flushing    a batch being written to the database
+    <track_id>.stopped              the track was stopped, appends are refused
+    <track_id>.lock                 flock held while appending, swapping or
+                                    stopping
+
+A track's pending file is flushed once it reaches GPS_POINT_BUFFER_FLUSH_BYTES,
+when it is older than GPS_POINT_BUFFER_FLUSH_SEC (checked on append and by the
+flush_point_buffer command), and always before the track is stopped:
+stop_track() holds the track's lock while it writes every batch, sets
+ended_at and leaves the .stopped marker, so no accepted point is missed by
+the final stats. Every node serving the point endpoints has to use the same
+directory, like HEATMAP_TILE_DIR, or a stop only sees its own node's points.
+
+Batches are renamed before they're read, so appends never race a flush, and
+a batch left behind by a crash is picked up again by the next flush.
+store_points() skips points that are already stored, so replaying a batch
+is safe.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from glob import glob
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from .ingest import store_points, TrackStoppedError
+from .models import GPSTrack
+
+
+logger = logging.getLogger(__name__)
+
+DECIMAL_FIELDS = ["latitude", "longitude", "altitude_feet", "accuracy_feet", "speed_mps"]
+# Markers and locks of tracks stopped this long ago are removed
+STALE_SEC = 24 * 60 * 60
+
+
+def is_enabled():
+    """Whether the REST endpoints buffer points instead of storing them"""
+    return bool(getattr(settings, "GPS_POINT_BUFFER_DIR", None))
+
+
+def _buffer_dir():
+    path = settings.GPS_POINT_BUFFER_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _track_path(track_id, suffix):
+    return os.path.join(_buffer_dir(), f"{track_id}.{suffix}")
+
+
+@contextmanager
+def _track_lock(track_id):
+    """Exclusive lock on a track's spool, shared by every process using the directory"""
+    with open(_track_path(track_id, "lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _encode_point(point):
+    return json.dumps(point, cls=DjangoJSONEncoder) + "\n"
+
+
+def _decode_point(line):
+    point = json.loads(line)
+    for name in DECIMAL_FIELDS:
+        if point.get(name) is not None:
+            point[name] = Decimal(point[name])
+    point["recorded_at"] = parse_datetime(point["recorded_at"])
+    return point
+
+
+def _pending_age(track_id):
+    """Seconds since the first point in a track's pending file was queued"""
+    try:
+        with open(_track_path(track_id, "jsonl")) as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return 0
+    return time.time() - header.get("queued_at", time.time())
+
+
+def append_points(track_id, points):
+    """
+        Queue validated points for a track. Raises TrackStoppedError if the
+        track was stopped. Flushes the track when its batch is due; a failed
+        flush is logged and the points stay queued.
+    """
+    with _track_lock(track_id):
+        # stop_track() leaves the marker while holding the lock
+        if os.path.exists(_track_path(track_id, "stopped")):
+            raise TrackStoppedError("Cannot add points to a stopped track")
+        with open(_track_path(track_id, "jsonl"), "a") as f:
+            if f.tell() == 0:
+                f.write(json.dumps({"queued_at": time.time()}) + "\n")
+            f.write("".join(_encode_point(point) for point in points))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+    if (size >= settings.GPS_POINT_BUFFER_FLUSH_BYTES
+            or _pending_age(track_id) >= settings.GPS_POINT_BUFFER_FLUSH_SEC):
+        try:
+            flush_track(track_id)
+        except Exception:
+            logger.exception("Flushing buffered points of track %s failed", track_id)
+
+
+def _swap_pending(track_id):
+    """Move the pending file aside as a batch (caller holds the track lock)"""
+    path = _track_path(track_id, "jsonl")
+    if os.path.exists(path):
+        os.rename(path, _track_path(track_id, f"{uuid.uuid4().hex}.flushing"))
+
+
+def _write_batches(track_id):
+    """Store every batch waiting for a track, returns the points created"""
+    created = 0
+    for path in sorted(glob(_track_path(track_id, "*.flushing"))):
+        try:
+            with open(path) as f:
+                f.readline()  # header
+                points = [_decode_point(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            # Another process finished this batch
+            continue
+        try:
+            created += store_points(track_id, points)
+        except GPSTrack.DoesNotExist:
+            logger.warning("Dropping %s buffered points of deleted track %s",
+                           len(points), track_id)
+        except TrackStoppedError:
+            # Queued after the marker was cleaned up, or the track was
+            # stopped without stop_track() (e.g. edited in the admin)
+            logger.error("Dropping %s buffered points of stopped track %s",
+                         len(points), track_id)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return created
+
+
+def flush_track(track_id):
+    """Write all of a track's buffered points to the database"""
+    with _track_lock(track_id):
+        _swap_pending(track_id)
+    return _write_batches(track_id)
+
+
+@contextmanager
+def track_drained(track_id):
+    """
+        Flushes the track and keeps new points out until the block ends, so
+        stop() can compute final stats knowing every accepted point is stored.
+        Once the block has run, appends to the track are refused.
+    """
+    if not is_enabled():
+        yield
+        return
+    with _track_lock(track_id):
+        _swap_pending(track_id)
+        _write_batches(track_id)
+        yield
+        open(_track_path(track_id, "stopped"), "a").close()
+
+
+def buffered_track_ids():
+    """Tracks that have pending points or unfinished batches"""
+    names = (os.path.basename(path) for path in
+             glob(os.path.join(_buffer_dir(), "*.jsonl"))
+             + glob(os.path.join(_buffer_dir(), "*.flushing")))
+    return sorted({int(name.split(".")[0]) for name in names})
+
+
+def flush_due(force=False):
+    """
+        Flush tracks whose pending points are older than the flush interval,
+        or every track with force. Returns the number of points created.
+    """
+    interval = settings.GPS_POINT_BUFFER_FLUSH_SEC
+    created = 0
+    for track_id in buffered_track_ids():
+        if (force or _pending_age(track_id) >= interval
+                or glob(_track_path(track_id, "*.flushing"))):
+            created += flush_track(track_id)
+    _remove_stale_files()
+    return created
+
+
+def _remove_stale_files():
+    """
+        Delete the markers and lock files of tracks stopped (or deleted) a
+        day ago. Points that still arrive for them are dropped by the flush.
+    """
+    pending = set(buffered_track_ids())
+    stale = {}
+    for path in glob(os.path.join(_buffer_dir(), "*.stopped")):
+        track_id = int(os.path.basename(path).split(".")[0])
+        if track_id not in pending and time.time() - os.path.getmtime(path) > STALE_SEC:
+            stale[track_id] = path
+    for track_id, path in stale.items():
+        for stale_path in (path, _track_path(track_id, "lock")):
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,205 @@
+"""
+Live tracking over WebSockets. The hiker recording a track streams points
+over one connection instead of a POST per point, and the hiker's followers
+can watch the same track and get the points as they arrive.
+
+Points are kept in memory per connection and written to gps_points through
+store_points() every FLUSH_INTERVAL_SEC seconds, once FLUSH_POINTS are
+waiting, when the client asks and when the socket closes, so a hiker
+streaming a point a second costs a few inserts a minute instead of one
+per message. Viewers get the points as soon as they arrive. The recorder
+is only acked once its points are written, so unacked points are the
+client's to resend; it should flush before stopping the track, since
+points still waiting when the track stops are dropped. A failed write
+keeps the points for the next one.
+
+Messages from the recorder:
+    {"type": "points", "points": [point, ...]}  -> {"type": "ack", "received": n}
+                                                   once they are written
+    {"type": "flush"}                           -> ack, then {"type": "flushed", "created": n}
+Messages to everyone watching the track:
+    {"type": "points", "track": id, "points": [point, ...]}
+    {"type": "stopped", "track": id}
+"""
+
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+
+from users.models import UserFollow
+from .ingest import store_points, TrackStoppedError
+from .models import GPSTrack
+from .serializers import BatchTrackPointsSerializer
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SEC = 5
+FLUSH_POINTS = 500
+
+# WebSocket close codes
+CLOSE_UNAUTHENTICATED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_GONE = 4404
+
+
+def track_group(track_id):
+    """Channel layer group of everyone connected to a track"""
+    return f"track_{track_id}"
+
+
+def broadcast_track_stopped(track_id):
+    """Tell live viewers that a track was stopped (callable from sync code)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(
+            track_group(track_id), {"type": "track.stopped", "track": track_id})
+
+
+class LiveTrackConsumer(AsyncJsonWebsocketConsumer):
+    """WebSocket for recording (track owner) or watching (followers) a track"""
+
+    async def connect(self):
+        self.track_id = self.scope["url_route"]["kwargs"]["track_id"]
+        self.group_name = track_group(self.track_id)
+        self.is_recorder = False
+        self.flush_task = None
+        # Points received but not written yet, oldest first
+        self.pending = []
+        self.write_lock = asyncio.Lock()
+        self.closing = False
+
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close(code=CLOSE_UNAUTHENTICATED)
+            return
+
+        role = await self.get_role(user)
+        if role is None:
+            await self.close(code=CLOSE_FORBIDDEN)
+            return
+
+        self.is_recorder = role == "recorder"
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        if self.is_recorder:
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+
+    @database_sync_to_async
+    def get_role(self, user):
+        """"recorder" for the owner of a running track, "viewer" for followers"""
+        track = GPSTrack.objects.filter(pk=self.track_id).only("user_id", "ended_at").first()
+        if track is None:
+            return None
+        if track.user_id == user.pk:
+            return "viewer" if track.ended_at else "recorder"
+        if UserFollow.objects.filter(follower=user, following_id=track.user_id).exists():
+            return "viewer"
+        return None
+
+    async def disconnect(self, code):
+        self.closing = True
+        if self.flush_task:
+            self.flush_task.cancel()
+        if self.is_recorder:
+            await self.write_quietly()
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        if not self.is_recorder:
+            await self.send_json({"type": "error", "error": "Only the hiker can send points."})
+            return
+
+        message_type = content.get("type")
+        if message_type == "points":
+            await self.receive_points(content)
+        elif message_type == "flush":
+            try:
+                created = await self.write_pending()
+            except Exception:
+                logger.exception("Writing points of live track %s failed", self.track_id)
+                await self.send_json({"type": "error",
+                                      "error": "Points could not be stored yet, they will be retried."})
+                return
+            await self.send_json({"type": "flushed", "created": created})
+        else:
+            await self.send_json({"type": "error", "error": f"Unknown message type {message_type!r}."})
+
+    async def receive_points(self, content):
+        serializer = BatchTrackPointsSerializer(data={"points": content.get("points")})
+        if not serializer.is_valid():
+            await self.send_json({"type": "error", "errors": serializer.errors})
+            return
+
+        self.pending.extend(serializer.validated_data["points"])
+        await self.channel_layer.group_send(self.group_name, {
+            "type": "track.points",
+            "track": self.track_id,
+            # JSON-safe copy (decimals and datetimes as strings) for the layer
+            "points": serializer.data["points"],
+            "sender": self.channel_name,
+        })
+        if len(self.pending) >= FLUSH_POINTS:
+            await self.write_quietly()
+
+    async def write_pending(self):
+        """
+            Store the waiting points and ack them, returns how many were
+            created. Points that arrive during the write wait for the next one.
+        """
+        async with self.write_lock:
+            count = len(self.pending)
+            if not count:
+                return 0
+            try:
+                created = await database_sync_to_async(store_points)(
+                    self.track_id, self.pending[:count])
+            except TrackStoppedError as e:
+                del self.pending[:count]
+                if not self.closing:
+                    await self.send_json({"type": "error", "error": str(e)})
+                return 0
+            except GPSTrack.DoesNotExist:
+                self.pending = []
+                self.is_recorder = False
+                if not self.closing:
+                    await self.close(code=CLOSE_GONE)
+                return 0
+            del self.pending[:count]
+            if not self.closing:
+                await self.send_json({"type": "ack", "received": count})
+            return created
+
+    async def write_quietly(self):
+        """Write, keeping the points for the next write if it fails"""
+        try:
+            await self.write_pending()
+        except Exception:
+            logger.exception("Writing points of live track %s failed", self.track_id)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SEC)
+            await self.write_quietly()
+
+    async def track_points(self, event):
+        # The recorder already has its own points
+        if event["sender"] != self.channel_name:
+            await self.send_json({"type": "points", "track": event["track"],
+                                  "points": event["points"]})
+
+    async def track_stopped(self, event):
+        await self.send_json({"type": "stopped", "track": event["track"]})
+        if self.is_recorder:
+            self.is_recorder = False
+            if self.flush_task:
+                self.flush_task.cancel()
+            # The track's stats are final, store_points() would refuse them
+            if self.pending:
+                logger.warning("Dropping %s unwritten points of stopped track %s",
+                               len(self.pending), self.track_id)
+                self.pending = []
@@ -0,0 +1,209 @@
+"""
+Encodings for GPS tracks: a compact columnar format for storage, and the
+Google encoded polyline format for map clients.
+
+Packed tracks store all of a track's points as one zlib-compressed blob
+instead of one database row per point. Layout (before zlib):
+    magic "GT", version byte, point count (varint)
+    then one block per column in COLUMNS order:
+        null bitmap (nullable columns only, 1 bit per point, LSB first)
+        zigzag varint deltas of the non-null values, scaled to integers
+
+Every column is an integer after scaling (e.g. latitude * 10^7, which is
+exactly the precision of the DecimalField), so decoding gives back the same
+values that were stored.
+"""
+
+import zlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+
+MAGIC = b"GT"
+VERSION = 1
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# (field name, scale, nullable)
+COLUMNS = [
+    ("point_order", None, False),
+    ("recorded_at", None, False),     # microseconds since epoch
+    ("latitude", 7, False),
+    ("longitude", 7, False),
+    ("altitude_feet", 2, True),
+    ("accuracy_feet", 2, True),
+    ("speed_mps", 2, True),
+]
+
+
+class TrackEncodingError(ValueError):
+    """Raised when a packed track blob can't be decoded"""
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        if pos >= len(data):
+            raise TrackEncodingError("Truncated track data")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _to_int(value, name, scale):
+    """Scale a point value to the integer stored in the blob"""
+    if name == "recorded_at":
+        # Exact integer arithmetic, float timestamps lose microseconds
+        elapsed = value - EPOCH
+        return (elapsed.days * 86400 + elapsed.seconds) * 1000000 + elapsed.microseconds
+    if scale is None:
+        return int(value)
+    return int((Decimal(str(value)) * (10 ** scale)).to_integral_value())
+
+
+def _from_int(value, name, scale):
+    if name == "recorded_at":
+        return EPOCH + timedelta(microseconds=value)
+    if scale is None:
+        return value
+    return Decimal(value).scaleb(-scale)
+
+
+def encode_points(points):
+    """
+        Pack a sequence of points into bytes. Each point may be a GPSPoint or
+        a dict with the GPSPoint field names; they should already be sorted
+        by point_order.
+    """
+    rows = [point if isinstance(point, dict) else
+            {name: getattr(point, name) for name, _, _ in COLUMNS}
+            for point in points]
+
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    _write_varint(out, len(rows))
+
+    for name, scale, nullable in COLUMNS:
+        values = [row.get(name) for row in rows]
+        if nullable:
+            bitmap = bytearray((len(values) + 7) // 8)
+            for i, value in enumerate(values):
+                if value is not None:
+                    bitmap[i >> 3] |= 1 << (i & 7)
+            out += bitmap
+            values = [value for value in values if value is not None]
+        elif any(value is None for value in values):
+            raise TrackEncodingError(f"{name} is required for every point")
+
+        previous = 0
+        for value in values:
+            current = _to_int(value, name, scale)
+            _write_varint(out, _zigzag(current - previous))
+            previous = current
+
+    return zlib.compress(bytes(out), 6)
+
+
+def decode_points(blob):
+    """Unpack bytes from encode_points() into a list of dicts, one per point"""
+    try:
+        data = zlib.decompress(bytes(blob))
+    except zlib.error as e:
+        raise TrackEncodingError(f"Corrupt track data: {e}")
+
+    if len(data) < 3 or data[:2] != MAGIC:
+        raise TrackEncodingError("Not a packed GPS track")
+    if data[2] != VERSION:
+        raise TrackEncodingError(f"Unsupported track encoding version {data[2]}")
+
+    count, pos = _read_varint(data, 3)
+    # Every point takes at least one byte per required column
+    if count > len(data) - pos:
+        raise TrackEncodingError("Truncated track data")
+    rows = [{} for _ in range(count)]
+
+    for name, scale, nullable in COLUMNS:
+        if nullable:
+            bitmap = data[pos:pos + (count + 7) // 8]
+            if len(bitmap) < (count + 7) // 8:
+                raise TrackEncodingError("Truncated track data")
+            pos += (count + 7) // 8
+            present = [i for i in range(count) if bitmap[i >> 3] & (1 << (i & 7))]
+            for i in range(count):
+                rows[i][name] = None
+        else:
+            present = range(count)
+
+        previous = 0
+        for i in present:
+            delta, pos = _read_varint(data, pos)
+            previous += _unzigzag(delta)
+            try:
+                rows[i][name] = _from_int(previous, name, scale)
+            except OverflowError:
+                raise TrackEncodingError(f"{name} out of range")
+
+    if pos != len(data):
+        raise TrackEncodingError("Unexpected data after the last column")
+    return rows
+
+
+def encode_polyline(coordinates, precision=5):
+    """
+        Google encoded polyline for a sequence of (latitude, longitude) pairs,
+        as used by map clients to draw a track from a short string.
+    """
+    factor = 10 ** precision
+    out = []
+    previous_lat = previous_lon = 0
+    for latitude, longitude in coordinates:
+        lat = int(round(latitude * factor))
+        lon = int(round(longitude * factor))
+        for delta in (lat - previous_lat, lon - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        previous_lat, previous_lon = lat, lon
+    return "".join(out)
+
+
+def decode_polyline(polyline, precision=5):
+    """(latitude, longitude) pairs from a Google encoded polyline"""
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lon = 0
+    while index < len(polyline):
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(polyline[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coordinates.append((lat / factor, lon / factor))
+    return coordinates
@@ -0,0 +1,131 @@
+"""
+Cleaning raw phone GPS fixes before stats and simplification. Phones report
+fixes with large errors (accuracy_feet) and the odd jump hundreds of meters
+away and back, which add fake distance and elevation. clean_track() runs on
+whole arrays with NumPy:
+
+    1. drop fixes whose reported accuracy is worse than MAX_ACCURACY_FT
+    2. drop spikes: fixes reached and left faster than a hiker moves
+       (MAX_SPEED_MPS, or twice the speed the phone itself reported)
+    3. smooth position and altitude with a moving average weighted by
+       1 / accuracy^2, so precise fixes count more than poor ones
+
+The raw points stay in gps_points; the cleaned series is packed into
+GPSTrack.filtered_points when the track is stopped.
+"""
+
+import numpy as np
+
+from .analytics import EARTH_RADIUS_M
+
+
+# Fixes less accurate than this (about 50 m) are dropped
+MAX_ACCURACY_FT = 165.0
+# Used for fixes without a reported accuracy
+DEFAULT_ACCURACY_FT = 33.0
+# Faster than any hiker or trail runner, slower than a GPS jump
+MAX_SPEED_MPS = 8.0
+# Points in the smoothing window (centered)
+SMOOTHING_POINTS = 5
+# Spike removal passes; each pass can uncover a spike next to a removed one
+SPIKE_PASSES = 3
+# A point this long after the last accepted one is always accepted by
+# is_outlier(), so one bad fix can't block the running stats
+OUTLIER_RESET_SEC = 60
+
+
+def _speed_limit(speeds):
+    """Per-point speed limit: MAX_SPEED_MPS unless the phone measured faster"""
+    return np.fmax(MAX_SPEED_MPS, 2 * np.nan_to_num(speeds, nan=0.0))
+
+
+def _speeds(arrays, start, end):
+    """Speed in m/s from each point in start to the point at the same position in end"""
+    lat1, lat2 = np.radians(arrays["latitude"][start]), np.radians(arrays["latitude"][end])
+    dlon = np.radians(arrays["longitude"][end] - arrays["longitude"][start])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    meters = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    seconds = arrays["time"][end] - arrays["time"][start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(seconds > 0, meters / seconds, np.where(meters > 0, np.inf, 0.0))
+
+
+def _spikes(arrays, index):
+    """Positions in index of fixes reached and left too fast"""
+    if len(index) < 3:
+        return np.array([], dtype=int)
+    limit = _speed_limit(arrays["speed_mps"][index])
+    too_fast = _speeds(arrays, index[:-1], index[1:]) > limit[1:]
+    # Interior point: both neighbouring segments too fast, but skipping it
+    # gives a believable speed
+    skip_ok = _speeds(arrays, index[:-2], index[2:]) <= limit[2:]
+    spikes = np.flatnonzero(too_fast[:-1] & too_fast[1:] & skip_ok) + 1
+    # End points only have one neighbour
+    if too_fast[0] and not too_fast[1]:
+        spikes = np.concatenate(([0], spikes))
+    if too_fast[-1] and not too_fast[-2]:
+        spikes = np.concatenate((spikes, [len(index) - 1]))
+    return spikes
+
+
+def _weighted_average(values, weights):
+    """Centered moving average over SMOOTHING_POINTS, NaNs weigh nothing"""
+    present = ~np.isnan(values)
+    weights = np.where(present, weights, 0.0)
+    window = np.ones(min(SMOOTHING_POINTS, len(values)))
+    total = np.convolve(np.where(present, values, 0.0) * weights, window, mode="same")
+    weight = np.convolve(weights, window, mode="same")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(weight > 0, total / weight, np.nan)
+
+
+def clean_track(arrays):
+    """
+        Cleaned copy of a track's arrays (see analytics.point_arrays; needs
+        accuracy_feet and speed_mps too, NaN when missing). Every array is
+        cut down to the kept points, "kept" holds their raw positions and
+        "rejected" how many were dropped.
+    """
+    count = len(arrays["latitude"])
+    index = np.arange(count)
+    if count >= 2:
+        accuracy = arrays["accuracy_feet"]
+        precise = ~(accuracy > MAX_ACCURACY_FT)
+        # A track of only poor fixes is still better than no track
+        if precise.sum() >= 2:
+            index = index[precise]
+        for _ in range(SPIKE_PASSES):
+            spikes = _spikes(arrays, index)
+            if not len(spikes):
+                break
+            index = np.delete(index, spikes)
+
+    cleaned = {name: values[index] for name, values in arrays.items()}
+    if len(index) >= 3:
+        accuracy = np.nan_to_num(cleaned["accuracy_feet"], nan=DEFAULT_ACCURACY_FT)
+        weights = 1.0 / np.maximum(accuracy, 1.0) ** 2
+        for name in ("latitude", "longitude", "altitude_feet"):
+            smoothed = _weighted_average(cleaned[name], weights)
+            # Keep the real start and end of the track
+            smoothed[0], smoothed[-1] = cleaned[name][0], cleaned[name][-1]
+            cleaned[name] = smoothed
+    cleaned["kept"] = index
+    cleaned["rejected"] = count - len(index)
+    return cleaned
+
+
+def is_outlier(point, elapsed_sec=None, distance_m=None):
+    """
+        Scalar check for points arriving a batch at a time: True if point is
+        too inaccurate, or too far from the last accepted point for the
+        elapsed_sec between them (None when there's no previous point)
+    """
+    accuracy = point.accuracy_feet
+    if accuracy is not None and float(accuracy) > MAX_ACCURACY_FT:
+        return True
+    if elapsed_sec is None or elapsed_sec >= OUTLIER_RESET_SEC:
+        return False
+    speed = float(point.speed_mps or 0)
+    if elapsed_sec <= 0:
+        return distance_m > 0
+    return distance_m / elapsed_sec > max(MAX_SPEED_MPS, 2 * speed)
@@ -0,0 +1,363 @@
+"""
+Heatmap tiles of where people hike, built from every stopped track. Each
+map tile (z/x/y, 256 x 256 pixels, Web Mercator like the base map) keeps a
+count per pixel of how many tracks crossed it, so a long stop or a phone
+that records every second doesn't count more than a quick pass.
+
+update_tiles() adds the tracks stopped since the last run: it draws each
+track's filtered points into pixel coordinates for every zoom level at once
+with NumPy (segments filled in pixel by pixel, gaps in the recording left
+out) and adds them to the tiles. It is run by the update_heatmap_tiles
+command. A batch keeps only the pixels its tracks crossed; each tile's grid
+is built when it is written.
+
+A batch is crash safe: its updated tiles are written to a staging
+directory first, then its tracks are marked with heatmap_at in one UPDATE,
+and only then are the staged tiles moved into place. The next run finishes
+moving a batch whose tracks were marked and throws away one whose weren't,
+so no track is counted twice or lost.
+
+The first and last TRIM_END_M of every track (often someone's home or car)
+are left out, and pixels crossed by fewer than MIN_USERS different hikers
+are drawn transparent, so no single hiker's routes can be picked out of
+the map. Each tile keeps up to MIN_USERS user ids per pixel for that.
+
+Tile layout under HEATMAP_TILE_DIR:
+    <z>/<x>/<y>.npz     uint32 track counts and user ids, replaced
+                        atomically on update
+    .staging/           tiles of the batch being added, and its
+                        batch.json (tracks and heatmap_at) once complete
+    .lock               flock held while tiles are updated
+
+render_tile() turns the counts into a transparent PNG on a log scale. The
+tile endpoint caches the PNGs per tile file version, so a map view reads
+a handful of small files instead of millions of points.
+"""
+
+import fcntl
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from PIL import Image
+
+from .analytics import haversine_m
+from .models import GPSTrack
+
+
+TILE_SIZE = 256
+MIN_ZOOM = 0
+# Web Mercator stops here
+MAX_LATITUDE = 85.0511287798
+# Longer segments are gaps in the recording (GPS off, tunnel), not drawn
+MAX_SEGMENT_M = 250
+# Tracks counted per batch; tiles are written and tracks marked per batch
+TRACK_BATCH_SIZE = 100
+# Pixels crossed by this many tracks get the full color
+SATURATION_TRACKS = 100
+# Pixels crossed by fewer hikers aren't shown
+MIN_USERS = 3
+# Left out at each end of a track
+TRIM_END_M = 200
+TILE_CACHE_TIMEOUT = 60 * 60 * 24
+# Browsers and map clients reuse a tile this long before asking again
+TILE_MAX_AGE = 5 * 60
+
+
+class HeatmapError(Exception):
+    """Raised when the tiles can't be updated"""
+
+
+def max_zoom():
+    return settings.HEATMAP_MAX_ZOOM
+
+
+def _tile_dir():
+    path = settings.HEATMAP_TILE_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def tile_path(z, x, y, root=None):
+    return os.path.join(root or settings.HEATMAP_TILE_DIR, str(z), str(x), f"{y}.npz")
+
+
+def _staging_dir():
+    return os.path.join(_tile_dir(), ".staging")
+
+
+def is_valid_tile(z, x, y):
+    return MIN_ZOOM <= z <= max_zoom() and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+@contextmanager
+def _update_lock():
+    with open(os.path.join(_tile_dir(), ".lock"), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise HeatmapError("Heatmap tiles are already being updated")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def world_pixels(latitudes, longitudes, zoom):
+    """Web Mercator pixel coordinates (floats) of positions at a zoom level"""
+    size = TILE_SIZE * 2 ** zoom
+    latitude = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes) + 180.0) / 360.0 * size
+    y = (1.0 - np.log(np.tan(latitude) + 1.0 / np.cos(latitude)) / math.pi) / 2.0 * size
+    # The east and south edges belong to the last pixel
+    return np.clip(x, 0, size - 1e-6), np.clip(y, 0, size - 1e-6)
+
+
+def track_pixels(x, y, drawn):
+    """
+        Integer pixels covered by a track at one zoom: every point, plus
+        every pixel along the segments marked in drawn. Each pixel once,
+        as an (n, 2) array of x, y.
+    """
+    if len(x) >= 2:
+        dx, dy = np.diff(x), np.diff(y)
+        # One sample per pixel along drawn segments, the start point otherwise
+        steps = np.where(drawn, np.ceil(np.maximum(np.abs(dx), np.abs(dy))), 1).astype(np.int64)
+        steps = np.maximum(steps, 1)
+        segment = np.repeat(np.arange(len(dx)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+        x = np.append(x[segment] + dx[segment] * t, x[-1])
+        y = np.append(y[segment] + dy[segment] * t, y[-1])
+    # One integer key per pixel; the world is at most 2^24 pixels wide
+    keys = np.unique((x.astype(np.int64) << 32) | y.astype(np.int64))
+    return np.stack((keys >> 32, keys & 0xFFFFFFFF), axis=1)
+
+
+def add_track(pixels, user_id, coordinates, zooms):
+    """
+        Add one track's pixels to pixels, {(z, x, y): [(user id, array of
+        pixel indices in the tile)]}. A dense grid per tile would take
+        gigabytes for a batch of long tracks.
+    """
+    if len(coordinates) < 2:
+        return
+    latitudes, longitudes = (np.array(values, dtype=float) for values in zip(*coordinates))
+    segments = haversine_m(latitudes, longitudes)
+    along = np.concatenate(([0.0], np.cumsum(segments)))
+    kept = np.flatnonzero((along >= TRIM_END_M) & (along <= along[-1] - TRIM_END_M))
+    if not len(kept):
+        return
+    start, end = kept[0], kept[-1] + 1
+    latitudes, longitudes = latitudes[start:end], longitudes[start:end]
+    drawn = segments[start:end - 1] <= MAX_SEGMENT_M
+    for zoom in zooms:
+        covered = track_pixels(*world_pixels(latitudes, longitudes, zoom), drawn)
+        tiles = covered // TILE_SIZE
+        local = covered % TILE_SIZE
+        # Group the pixels by tile with one sort
+        tile_keys = (tiles[:, 0] << 32) | tiles[:, 1]
+        # Rows are y, columns x, like the image
+        indices = local[:, 1] * TILE_SIZE + local[:, 0]
+        order = np.argsort(tile_keys, kind="stable")
+        tile_ids, starts = np.unique(tile_keys[order], return_index=True)
+        for tile_key, group in zip(tile_ids.tolist(), np.split(order, starts[1:])):
+            key = (zoom, tile_key >> 32, tile_key & 0xFFFFFFFF)
+            pixels.setdefault(key, []).append((user_id, indices[group]))
+
+
+def read_tile(z, x, y, root=None):
+    """
+        (counts, users) of a tile, None if no track crossed it. users holds
+        up to MIN_USERS ids of hikers per pixel, 0 for a free slot.
+    """
+    try:
+        with np.load(tile_path(z, x, y, root)) as data:
+            return data["counts"], data["users"]
+    except FileNotFoundError:
+        return None
+
+
+def _add_users(users, user_pixels):
+    """Put each user in a free slot of the pixels they crossed, unless already there"""
+    slots = users.reshape(MIN_USERS, -1)
+    for user_id, indices in user_pixels.items():
+        current = slots[:, indices]
+        free = current == 0
+        new = free.any(axis=0) & ~(current == user_id).any(axis=0)
+        slots[free.argmax(axis=0)[new], indices[new]] = user_id
+
+
+def _stage_tile(staging, z, x, y, pixels):
+    """Write a tile with pixels added to the staging directory"""
+    counts = np.bincount(np.concatenate([indices for _, indices in pixels]),
+                         minlength=TILE_SIZE * TILE_SIZE)
+    counts = counts.astype(np.uint32).reshape(TILE_SIZE, TILE_SIZE)
+    users = np.zeros((MIN_USERS, TILE_SIZE, TILE_SIZE), dtype=np.uint32)
+    existing = read_tile(z, x, y)
+    if existing is not None:
+        counts = counts + existing[0]
+        users = existing[1].copy()
+    user_pixels = {}
+    for user_id, indices in pixels:
+        user_pixels.setdefault(user_id, []).append(indices)
+    _add_users(users, {user_id: np.unique(np.concatenate(groups))
+                       for user_id, groups in user_pixels.items()})
+
+    path = tile_path(z, x, y, staging)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez_compressed(f, counts=counts, users=users)
+        # On disk before the batch's tracks are marked
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_json(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _apply_staged():
+    """Move the staged tiles into place; readers never see a half-written tile"""
+    staging = _staging_dir()
+    for directory, _, files in os.walk(staging):
+        for name in files:
+            if name.endswith(".npz"):
+                path = os.path.join(directory, name)
+                target = os.path.join(_tile_dir(), os.path.relpath(path, staging))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+    shutil.rmtree(staging)
+
+
+def _recover():
+    """Finish a batch whose tracks were marked, drop any other staged tiles"""
+    manifest = os.path.join(_staging_dir(), "batch.json")
+    try:
+        with open(manifest) as f:
+            batch = json.load(f)
+    except FileNotFoundError:
+        batch = None
+    if batch and GPSTrack.objects.filter(pk__in=batch["tracks"],
+                                         heatmap_at=parse_datetime(batch["stamp"])).exists():
+        _apply_staged()
+    else:
+        shutil.rmtree(_staging_dir(), ignore_errors=True)
+
+
+def pending_tracks():
+    """Stopped tracks not in the heatmap yet"""
+    return GPSTrack.objects.filter(ended_at__isnull=False, heatmap_at__isnull=True)
+
+
+def update_tiles(limit=None):
+    """
+        Add tracks stopped since the last update to the tiles. Returns the
+        number of tracks and tiles written.
+    """
+    zooms = range(MIN_ZOOM, max_zoom() + 1)
+    track_count, tiles = 0, set()
+    with _update_lock():
+        _recover()
+        while limit is None or track_count < limit:
+            batch = TRACK_BATCH_SIZE if limit is None else min(TRACK_BATCH_SIZE, limit - track_count)
+            tracks = list(pending_tracks().order_by("track_id")[:batch])
+            if not tracks:
+                break
+            pixels = {}
+            for track in tracks:
+                add_track(pixels, track.user_id, track.get_coordinates(cleaned=True), zooms)
+
+            staging = _staging_dir()
+            os.makedirs(staging)
+            for (z, x, y), tile_pixels in pixels.items():
+                _stage_tile(staging, z, x, y, tile_pixels)
+            stamp = timezone.now()
+            track_ids = [track.pk for track in tracks]
+            _write_json(os.path.join(staging, "batch.json"),
+                        {"stamp": stamp.isoformat(), "tracks": track_ids})
+            # The batch counts from here on; a crash before the tiles are in
+            # place is finished by _recover()
+            GPSTrack.objects.filter(pk__in=track_ids).update(heatmap_at=stamp)
+            _apply_staged()
+
+            track_count += len(tracks)
+            tiles |= pixels.keys()
+    return track_count, len(tiles)
+
+
+def reset_tiles():
+    """Delete every tile and mark all tracks to be counted again"""
+    with _update_lock():
+        shutil.rmtree(_staging_dir(), ignore_errors=True)
+        root = _tile_dir()
+        for z in os.listdir(root):
+            if z.isdigit():
+                for directory, _, files in os.walk(os.path.join(root, z), topdown=False):
+                    for name in files:
+                        os.unlink(os.path.join(directory, name))
+                    os.rmdir(directory)
+        GPSTrack.objects.filter(heatmap_at__isnull=False).update(heatmap_at=None)
+
+
+def _colormap():
+    """RGBA for intensities 0..255: transparent, then blue, red and yellow"""
+    level = np.linspace(0, 1, 256)
+    stops = np.array([0, 0.25, 0.6, 1.0])
+    colors = np.array([[0, 0, 255, 0], [0, 80, 255, 170], [255, 40, 0, 220],
+                       [255, 230, 0, 255]], dtype=float)
+    return np.stack([np.interp(level, stops, colors[:, channel]) for channel in range(4)],
+                    axis=1).astype(np.uint8)
+
+
+COLORMAP = _colormap()
+
+
+def render_tile(tile):
+    """PNG bytes for a tile's (counts, users) (None gives a blank tile)"""
+    if tile is None:
+        tile = (np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint32),
+                np.zeros((MIN_USERS, TILE_SIZE, TILE_SIZE), dtype=np.uint32))
+    counts, users = tile
+    intensity = np.log1p(counts) / math.log1p(SATURATION_TRACKS)
+    rgba = COLORMAP[(np.clip(intensity, 0, 1) * 255).astype(np.uint8)]
+    # Every pixel that is shown at all can be seen
+    shown = (users != 0).sum(axis=0) >= MIN_USERS
+    rgba[shown & (rgba[:, :, 3] < 60), 3] = 60
+    rgba[~shown, 3] = 0
+    output = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(output, "PNG")
+    return output.getvalue()
+
+
+def tile_version(z, x, y):
+    """Changes whenever the tile file is rewritten; "0" for a blank tile"""
+    try:
+        return str(os.stat(tile_path(z, x, y)).st_mtime_ns)
+    except FileNotFoundError:
+        return "0"
+
+
+def get_tile_png(z, x, y, version=None):
+    """render_tile() of a tile, cached per tile version"""
+    version = version or tile_version(z, x, y)
+    # Blank tiles are all the same
+    key = f"tracking:heatmap:{z}:{x}:{y}:{version}" if version != "0" else "tracking:heatmap:blank"
+    png = cache.get(key)
+    if png is None:
+        png = render_tile(read_tile(z, x, y) if version != "0" else None)
+        cache.set(key, png, TILE_CACHE_TIMEOUT)
+    return png
@@ -0,0 +1,43 @@
+"""
+Storing incoming GPS points. Shared by the REST batch endpoint and the live
+tracking WebSocket, which both hand over already validated point dicts.
+"""
+
+from django.db import transaction
+
+from .models import GPSTrack, GPSPoint
+
+
+class TrackStoppedError(Exception):
+    """Raised when points arrive for a track that has already been stopped"""
+
+
+def store_points(track_id, points):
+    """
+        Insert points into a track in one transaction and update its running
+        stats. Points whose point_order is already stored (or repeated in the
+        batch) are skipped, so resending a batch is safe. Returns the number
+        of points created.
+    """
+    # First copy wins if the batch repeats a point_order
+    by_order = {}
+    for point in points:
+        by_order.setdefault(point["point_order"], point)
+    if not by_order:
+        return 0
+
+    with transaction.atomic():
+        # Row lock serialises concurrent writers of the same track
+        track = GPSTrack.objects.select_for_update().defer(*GPSTrack.BLOB_FIELDS).get(pk=track_id)
+        if track.ended_at:
+            raise TrackStoppedError("Cannot add points to a stopped track")
+        # Under the lock this is what keeps point_order unique on PostgreSQL,
+        # where the constraint has to include recorded_at
+        existing = set(GPSPoint.objects.filter(track=track, point_order__in=by_order.keys())
+                       .values_list("point_order", flat=True))
+        new_points = [GPSPoint(track=track, **point)
+                      for order, point in by_order.items() if order not in existing]
+        GPSPoint.objects.bulk_create(new_points, batch_size=1000)
+        track.add_running_stats(new_points)
+        track.save(update_fields=GPSTrack.RUNNING_STAT_FIELDS)
+    return len(new_points)
@@ -0,0 +1,72 @@
+"""
+Stopping tracks and completing hikes. Shared by the REST actions and the
+offline sync endpoint (tracking/sync.py), which finish tracks and hikes
+that were recorded while the phone had no signal.
+"""
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import buffer as point_buffer
+from .consumers import broadcast_track_stopped
+from .matching import match_hike, use_matched_trail
+from .models import Hike, GPSTrack
+from .stats import rebuild_hiker_stats, record_completed_hike
+
+
+def stop_track(track_id, ended_at=None):
+    """
+        Stop a track and compute its final stats. Returns the track, or None
+        if it was already stopped.
+    """
+    # Buffered points are written first and no new ones are accepted
+    # until the track is stopped
+    with point_buffer.track_drained(track_id), transaction.atomic():
+        # Wait for in-flight point inserts so the final stats include them
+        track = GPSTrack.objects.select_for_update().get(pk=track_id)
+        if track.ended_at:
+            return None
+        track.ended_at = ended_at or timezone.now()
+        track.compute_stats(save=False)
+        track.simplify_points(save=False)
+        track.save()
+        if track.hike.completed:
+            # Late track on a completed hike changes its elevation gain
+            rebuild_hiker_stats(track.user_id)
+        transaction.on_commit(lambda: broadcast_track_stopped(track.pk))
+    return track
+
+
+def complete_hike(hike_id, changes, use_match=False):
+    """
+        Mark a hike completed with changes (end_time, distance_miles, notes,
+        ...), match it to a trail and count it in the stats. use_match
+        switches it to the matched trail. Returns the hike, or None if it was
+        already completed.
+    """
+    with transaction.atomic():
+        # Lock so a retried request can't count the hike twice in the stats
+        hike = Hike.objects.select_for_update().get(pk=hike_id)
+        if hike.completed:
+            return None
+        changes = dict(changes)
+        if changes.get("distance_miles") is None:
+            changes.pop("distance_miles", None)
+            # Use the distance measured by the hike's stopped tracks
+            measured = hike.gps_tracks.filter(ended_at__isnull=False).aggregate(
+                total=Sum("total_distance_miles"))["total"]
+            if measured is not None:
+                changes["distance_miles"] = round(measured, 2)
+        for field, value in changes.items():
+            setattr(hike, field, value)
+        hike.completed = True
+        # Check the trail against the tracks before it's counted in the stats
+        matches = match_hike(hike, save=False)
+        if use_match:
+            use_matched_trail(hike, matches)
+        hike.save()
+        if hike.end_time:
+            hike.calculate_duration()
+        record_completed_hike(hike)
+    return hike
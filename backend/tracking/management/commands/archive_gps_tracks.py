@@ -0,0 +1,35 @@
+"""
+Management command to move the points of finished tracks to cold storage
+Usage: python manage.py archive_gps_tracks [--days 30] [--limit N]
+       python manage.py archive_gps_tracks --restore TRACK_ID
+Meant to be run periodically (e.g. nightly); archived tracks still return
+all their points from the API
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from tracking.archive import archive_due, restore_track, ArchiveError
+from tracking.models import GPSTrack
+
+
+class Command(BaseCommand):
+    help = "Pack the GPS points of old completed tracks and delete the rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.GPS_TRACK_ARCHIVE_AFTER_DAYS,
+                            help="Archive tracks that ended more than DAYS ago")
+        parser.add_argument("--limit", type=int, help="Archive at most this many tracks")
+        parser.add_argument("--restore", type=int, metavar="TRACK_ID",
+                            help="Put an archived track's points back in gps_points")
+
+    def handle(self, *args, **options):
+        if options["restore"]:
+            try:
+                count = restore_track(options["restore"])
+            except (ArchiveError, GPSTrack.DoesNotExist) as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Restored {count} points"))
+            return
+
+        tracks, points = archive_due(options["days"], options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {points} points from {tracks} tracks"))
@@ -0,0 +1,27 @@
+"""
+Management command to create the monthly gps_points partitions ahead of time
+Usage: python manage.py create_gps_point_partitions [--months 3]
+Meant to be run periodically (e.g. daily cron job on Railway); points for a
+month without a partition go to gps_points_default and are moved when the
+partition is created
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from tracking.partitions import create_month_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = "Create gps_points partitions for the current and coming months"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months", type=int, default=3,
+                            help="Months after the current one to create (default 3)")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("gps_points is not partitioned (PostgreSQL only)")
+
+        created = create_month_partitions(options["months"])
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions created"))
@@ -0,0 +1,30 @@
+"""
+Management command to write buffered GPS points to the database
+Usage: python manage.py flush_point_buffer [--all] [--loop SECONDS]
+Points are flushed on append and on stop too; run this with --loop 5 on
+a node that sees GPS_POINT_BUFFER_DIR so points of quiet tracks get written
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from tracking import buffer as point_buffer
+
+
+class Command(BaseCommand):
+    help = "Flush the GPS point write-behind buffer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", 
+                            help="Flush every track, not only those that are due")
+        parser.add_argument("--loop", type=float, metavar="SECONDS",
+                            help="Keep running, flushing every SECONDS")
+
+    def handle(self, *args, **options):
+        while True:
+            created = point_buffer.flush_due(force=options["all"])
+            if created or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Stored {created} buffered points"))
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
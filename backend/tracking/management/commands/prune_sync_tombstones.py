@@ -0,0 +1,20 @@
+"""
+Management command to delete sync tombstones older than the retention window
+Usage: python manage.py prune_sync_tombstones
+Phones that last synced before that get a full snapshot instead of a delta
+(see tracking/sync.py)
+"""
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from tracking.models import SyncTombstone
+from tracking.sync import TOMBSTONE_RETENTION
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than the retention window"
+
+    def handle(self, *args, **options):
+        deleted, _ = SyncTombstone.objects.filter(
+            deleted_at__lt=timezone.now() - TOMBSTONE_RETENTION).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstones"))
@@ -0,0 +1,29 @@
+"""
+Management command to rebuild per-user hiking stats from their hikes
+Usage: python manage.py rebuild_hiker_stats [--user USER_ID]
+Only needed after bulk edits to hikes; completing a hike updates stats itself
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from tracking.stats import rebuild_hiker_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute hiking totals, breakdowns and personal records for users"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="Only rebuild this user's stats")
+
+    def handle(self, *args, **options):
+        if options["user"]:
+            user_ids = [options["user"]]
+        else:
+            user_ids = (get_user_model().objects.filter(hikes__completed=True)
+                        .values_list("pk", flat=True).distinct())
+
+        count = 0
+        for user_id in user_ids:
+            rebuild_hiker_stats(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} users"))
@@ -0,0 +1,28 @@
+"""
+Management command to add newly stopped tracks to the heatmap tiles
+Usage: python manage.py update_heatmap_tiles [--limit N]
+       python manage.py update_heatmap_tiles --rebuild
+Meant to be run periodically (e.g. every few minutes); --rebuild deletes
+the tiles and counts every stopped track again (after deleting tracks)
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from tracking.heatmap import update_tiles, reset_tiles, HeatmapError
+
+
+class Command(BaseCommand):
+    help = "Add stopped GPS tracks to the heatmap tiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Add at most this many tracks")
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Delete all tiles and build them again from every track")
+
+    def handle(self, *args, **options):
+        try:
+            if options["rebuild"]:
+                reset_tiles()
+            tracks, tiles = update_tiles(options["limit"])
+        except HeatmapError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Added {tracks} tracks to {tiles} tiles"))
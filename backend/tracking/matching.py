@@ -0,0 +1,182 @@
+"""
+Map matching: which trail did a hike actually follow? Trails have no line
+geometry here, only a trailhead position and TrailFeature points (summits,
+lakes, junctions...), so each trail is scored on how many of those anchor
+points the hike's tracks pass close to, and how well the distance walked
+fits the trail's length.
+
+Candidates come from bounding box queries on the indexed latitude/longitude
+columns of trails and trail_features, plus the hike's own trail. Distances
+from every anchor to every track segment are computed at once with NumPy on
+the 10 m simplified tracks, so a match takes a few queries and milliseconds
+and runs inline when a hike is completed.
+"""
+
+from collections import namedtuple
+from decimal import Decimal
+import math
+
+import numpy as np
+from django.db.models import Q
+
+from trails.models import Trail, TrailFeature
+from .analytics import EARTH_RADIUS_M, METERS_PER_MILE
+from .simplify import project
+
+
+# An anchor counts as visited when a track passes within this distance
+VISIT_RADIUS_M = 150
+# How far outside the track's bounding box trailheads and features are searched
+SEARCH_MARGIN_M = 1000
+# Simplified copy of the tracks used for matching (see tracking/simplify.py)
+MATCH_TOLERANCE_M = 10
+# The best trail must score at least this to be used
+MIN_MATCH_SCORE = 0.5
+# Anchors per block of the distance matrix, bounds memory on big parks
+ANCHOR_BLOCK = 256
+
+TrailMatch = namedtuple("TrailMatch", ["trail_id", "score", "anchors", "visited",
+                                       "percent_completed"])
+
+
+def hike_coordinates(hike):
+    """Simplified (lat, lon) lists of the hike's tracks, one per track"""
+    tracks = []
+    for track in hike.gps_tracks.order_by("started_at"):
+        _, coordinates = track.get_simplified_coordinates(MATCH_TOLERANCE_M)
+        if coordinates:
+            tracks.append(coordinates)
+    return tracks
+
+
+def _search_box(tracks):
+    points = np.array([point for coordinates in tracks for point in coordinates])
+    margin_lat = math.degrees(SEARCH_MARGIN_M / EARTH_RADIUS_M)
+    margin_lon = margin_lat / max(math.cos(math.radians(points[:, 0].mean())), 0.01)
+    return (points[:, 0].min() - margin_lat, points[:, 1].min() - margin_lon,
+            points[:, 0].max() + margin_lat, points[:, 1].max() + margin_lon)
+
+
+def _in_box(box):
+    min_lat, min_lon, max_lat, max_lon = (Decimal(f"{value:.7f}") for value in box)
+    return Q(decimal_latitude__range=(min_lat, max_lat),
+             decimal_longitude__range=(min_lon, max_lon))
+
+
+def candidate_anchors(box, include_trail_id=None):
+    """
+        ({trail_id: length in meters}, [(trail_id, lat, lon), ...]) for the
+        active trails with a trailhead or feature inside box
+    """
+    trail_ids = set(Trail.objects.filter(_in_box(box), is_active=True)
+                    .values_list("trail_id", flat=True))
+    trail_ids |= set(TrailFeature.objects.filter(_in_box(box), trail__is_active=True)
+                     .values_list("trail_id", flat=True))
+    if include_trail_id:
+        trail_ids.add(include_trail_id)
+
+    lengths, anchors = {}, []
+    for trail_id, latitude, longitude, miles in Trail.objects.filter(
+            trail_id__in=trail_ids).values_list("trail_id", "decimal_latitude",
+                                                "decimal_longitude", "decimal_length_miles"):
+        lengths[trail_id] = float(miles or 0) * METERS_PER_MILE
+        if latitude is not None and longitude is not None:
+            anchors.append((trail_id, float(latitude), float(longitude)))
+    anchors += [(trail_id, float(latitude), float(longitude)) for trail_id, latitude, longitude in
+                TrailFeature.objects.filter(trail_id__in=trail_ids, decimal_latitude__isnull=False,
+                                            decimal_longitude__isnull=False)
+                .values_list("trail_id", "decimal_latitude", "decimal_longitude")]
+    return lengths, anchors
+
+
+def anchor_distances(anchor_xy, tracks_xy):
+    """Distance in meters from each anchor to the closest track segment"""
+    starts = np.concatenate([xy[:-1] if len(xy) > 1 else xy for xy in tracks_xy])
+    ends = np.concatenate([xy[1:] if len(xy) > 1 else xy for xy in tracks_xy])
+    segment = ends - starts
+    length_sq = np.maximum((segment ** 2).sum(axis=1), 1e-9)
+
+    closest = np.empty(len(anchor_xy))
+    for block in range(0, len(anchor_xy), ANCHOR_BLOCK):
+        points = anchor_xy[block:block + ANCHOR_BLOCK, None, :]
+        # Position of the closest point along each segment, 0..1
+        t = np.clip(((points - starts) * segment).sum(axis=2) / length_sq, 0, 1)
+        nearest = starts + t[:, :, None] * segment
+        closest[block:block + ANCHOR_BLOCK] = np.sqrt(((nearest - points) ** 2).sum(axis=2)).min(axis=1)
+    return closest
+
+
+def score_trails(tracks, lengths, anchors):
+    """TrailMatch for every trail with anchors, best first"""
+    if not tracks or not anchors:
+        return []
+
+    trail_ids = np.array([trail_id for trail_id, _, _ in anchors])
+    # Project the tracks and anchors together so they share one plane
+    xy = project([point for coordinates in tracks for point in coordinates]
+                 + [(latitude, longitude) for _, latitude, longitude in anchors])
+    tracks_xy, offset = [], 0
+    for coordinates in tracks:
+        tracks_xy.append(xy[offset:offset + len(coordinates)])
+        offset += len(coordinates)
+    walked_m = float(sum(np.sqrt((np.diff(track_xy, axis=0) ** 2).sum(axis=1)).sum()
+                         for track_xy in tracks_xy))
+
+    visited = anchor_distances(xy[offset:], tracks_xy) <= VISIT_RADIUS_M
+    unique_ids, index = np.unique(trail_ids, return_inverse=True)
+    anchor_counts = np.bincount(index)
+    visited_counts = np.bincount(index, weights=visited).astype(int)
+
+    matches = []
+    for trail_id, total, seen in zip(unique_ids.tolist(), anchor_counts.tolist(),
+                                     visited_counts.tolist()):
+        coverage = seen / total
+        length = lengths.get(trail_id) or 0
+        if length:
+            length_fit = min(walked_m, length) / max(walked_m, length, 1)
+            distance_ratio = min(walked_m / length, 1)
+        else:
+            length_fit, distance_ratio = 0, coverage
+        matches.append(TrailMatch(trail_id=trail_id,
+                                  score=round(0.8 * coverage + 0.2 * length_fit, 3),
+                                  anchors=total, visited=seen,
+                                  percent_completed=round(100 * min(coverage, distance_ratio), 1)))
+    return sorted(matches, key=lambda match: (-match.score, -match.visited, match.trail_id))
+
+
+def match_hike(hike, save=True):
+    """
+        Match the hike's tracks to trails and record the result on the hike:
+        matched_trail (best trail scoring MIN_MATCH_SCORE or more),
+        trail_match_score, trail_verified (whether the hike's trail is the
+        match) and percent_completed of the hike's trail. Returns the
+        matches, best first.
+    """
+    tracks = hike_coordinates(hike)
+    matches = []
+    if tracks:
+        lengths, anchors = candidate_anchors(_search_box(tracks), hike.trail_id)
+        matches = score_trails(tracks, lengths, anchors)
+
+    best = matches[0] if matches and matches[0].score >= MIN_MATCH_SCORE else None
+    own = next((match for match in matches if match.trail_id == hike.trail_id), None)
+    hike.matched_trail_id = best.trail_id if best else None
+    hike.trail_match_score = best.score if best else None
+    hike.trail_verified = (best.trail_id == hike.trail_id) if best else None
+    hike.percent_completed = (Decimal(f"{own.percent_completed:.1f}")
+                              if own else None)
+    if save:
+        hike.save(update_fields=["matched_trail", "trail_match_score", "trail_verified",
+                                 "percent_completed", "updated_at"])
+    return matches
+
+
+def use_matched_trail(hike, matches):
+    """Switch the hike to its matched trail, updating percent_completed"""
+    if not hike.matched_trail_id or hike.matched_trail_id == hike.trail_id:
+        return False
+    hike.trail_id = hike.matched_trail_id
+    hike.trail_verified = True
+    match = next(match for match in matches if match.trail_id == hike.trail_id)
+    hike.percent_completed = Decimal(f"{match.percent_completed:.1f}")
+    return True
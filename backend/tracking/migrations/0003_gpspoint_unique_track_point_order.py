@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:50
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_points(apps, schema_editor):
+    """Keep the first stored copy of each (track, point_order) so the constraint can be added"""
+    GPSPoint = apps.get_model("tracking", "GPSPoint")
+    duplicates = (
+        GPSPoint.objects.values("track_id", "point_order")
+        .annotate(copies=Count("point_id"), keep=Min("point_id"))
+        .filter(copies__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        GPSPoint.objects.filter(
+            track_id=duplicate["track_id"], point_order=duplicate["point_order"]
+        ).exclude(point_id=duplicate["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_points, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="gpspoint",
+            constraint=models.UniqueConstraint(
+                fields=("track", "point_order"), name="unique_track_point_order"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0003_gpspoint_unique_track_point_order"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gpstrack",
+            name="packed_points",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
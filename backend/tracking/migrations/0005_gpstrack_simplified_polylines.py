@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0004_gpstrack_packed_points"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gpstrack",
+            name="simplified_polylines",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
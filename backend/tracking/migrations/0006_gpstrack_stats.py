@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0005_gpstrack_simplified_polylines"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gpstrack",
+            name="elevation_gain_ft",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="elevation_loss_ft",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="max_speed_mps",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="moving_time_sec",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="pace_splits",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="stopped_time_sec",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,134 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:55
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+
+
+def backfill_running_stats(apps, schema_editor):
+    """Fill counters and last point for tracks recorded before this migration"""
+    GPSTrack = apps.get_model("tracking", "GPSTrack")
+    GPSPoint = apps.get_model("tracking", "GPSPoint")
+    last_point = GPSPoint.objects.filter(track=OuterRef("pk")).order_by("-point_order")
+    tracks = GPSTrack.objects.annotate(
+        n=Count("gps_points"),
+        min_lat=Min("gps_points__latitude"),
+        max_lat=Max("gps_points__latitude"),
+        min_lon=Min("gps_points__longitude"),
+        max_lon=Max("gps_points__longitude"),
+        last_order=Subquery(last_point.values("point_order")[:1]),
+        last_lat=Subquery(last_point.values("latitude")[:1]),
+        last_lon=Subquery(last_point.values("longitude")[:1]),
+        last_alt=Subquery(last_point.values("altitude_feet")[:1]),
+        last_at=Subquery(last_point.values("recorded_at")[:1]),
+    ).filter(n__gt=0)
+
+    updated = []
+    for track in tracks.iterator():
+        track.point_count = track.n
+        track.min_latitude, track.max_latitude = track.min_lat, track.max_lat
+        track.min_longitude, track.max_longitude = track.min_lon, track.max_lon
+        track.last_point_order = track.last_order
+        track.last_latitude, track.last_longitude = track.last_lat, track.last_lon
+        track.last_altitude_feet, track.last_recorded_at = track.last_alt, track.last_at
+        updated.append(track)
+    GPSTrack.objects.bulk_update(
+        updated,
+        [
+            "point_count",
+            "min_latitude",
+            "max_latitude",
+            "min_longitude",
+            "max_longitude",
+            "last_point_order",
+            "last_latitude",
+            "last_longitude",
+            "last_altitude_feet",
+            "last_recorded_at",
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0006_gpstrack_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gpstrack",
+            name="distance_m",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="elevation_anchor_ft",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="last_altitude_feet",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=6, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="last_latitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=7, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="last_longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=7, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="last_point_order",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="last_recorded_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="max_latitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=7, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="max_longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=7, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="min_latitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=7, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="min_longitude",
+            field=models.DecimalField(
+                blank=True, decimal_places=7, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="point_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_running_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,170 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0007_gpstrack_running_stats"),
+        ("trails", "0005_park_summary"),
+        ("users", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HikerStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        db_column="user_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="hiker_stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("total_hikes", models.IntegerField(default=0)),
+                (
+                    "total_distance_miles",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("total_duration_min", models.IntegerField(default=0)),
+                ("total_elevation_gain_ft", models.IntegerField(default=0)),
+                (
+                    "longest_distance_miles",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=6, null=True
+                    ),
+                ),
+                ("fastest_pace_min_per_mile", models.FloatField(blank=True, null=True)),
+                ("most_elevation_gain_ft", models.IntegerField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "fastest_hike",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="tracking.hike",
+                    ),
+                ),
+                (
+                    "longest_hike",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="tracking.hike",
+                    ),
+                ),
+                (
+                    "most_elevation_hike",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="tracking.hike",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "hiker_stats",
+            },
+        ),
+        migrations.CreateModel(
+            name="HikerMonthStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("hikes", models.IntegerField(default=0)),
+                (
+                    "distance_miles",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("duration_min", models.IntegerField(default=0)),
+                ("elevation_gain_ft", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_column="user_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hiker_month_stats",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "hiker_month_stats",
+                "ordering": ["month"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "month"), name="unique_user_month_stats"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="HikerTrailStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hikes", models.IntegerField(default=0)),
+                (
+                    "distance_miles",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("duration_min", models.IntegerField(default=0)),
+                ("last_hiked_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "trail",
+                    models.ForeignKey(
+                        db_column="trail_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hiker_stats",
+                        to="trails.trail",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_column="user_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hiker_trail_stats",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "hiker_trail_stats",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "trail"), name="unique_user_trail_stats"
+                    )
+                ],
+            },
+        ),
+    ]
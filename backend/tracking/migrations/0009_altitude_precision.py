@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0008_hiker_stats"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="gpspoint",
+            name="altitude_feet",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=7, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="gpstrack",
+            name="last_altitude_feet",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=7, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,201 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:07
+
+from datetime import date, datetime, timezone
+
+from django.db import migrations, models, transaction
+
+# How many months after the current one get a partition up front; the
+# create_gps_point_partitions command keeps adding them
+MONTHS_AHEAD = 3
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _bound(month):
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def partition_gps_points(apps, schema_editor):
+    """
+    Turn gps_points into a table partitioned by recorded_at month without
+    copying the existing rows: the old table is attached as the
+    gps_points_legacy partition covering everything up to next month.
+    A CHECK constraint matching that range is validated first, and the
+    partition's indexes are built CONCURRENTLY, while reads and writes go
+    on, so ATTACH PARTITION neither scans the table nor builds an index
+    under the exclusive lock; it adopts the matching indexes instead.
+    PostgreSQL requires the partition key in every unique constraint, so
+    the primary key becomes (point_id, recorded_at) and the point order
+    constraint (track_id, point_order, recorded_at). A resent point still
+    hits it; store_points() skips any other repeated point order under the
+    track's row lock. Other databases keep (track_id, point_order).
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT max(recorded_at), coalesce(max(point_id), 0) FROM gps_points"
+        )
+        latest, last_id = cursor.fetchone()
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = 'gps_points'::regclass "
+            "AND contype IN ('p', 'u')"
+        )
+        unique_constraints = [row[0] for row in cursor.fetchall()]
+
+    now = datetime.now(timezone.utc)
+    newest = max(now, latest) if latest else now
+    boundary = _next_month(date(newest.year, newest.month, 1))
+
+    # The migration isn't atomic, so these commit before the lock is taken
+    schema_editor.execute(
+        "ALTER TABLE gps_points ADD CONSTRAINT gps_points_legacy_range "
+        f"CHECK (recorded_at < {_bound(boundary)}) NOT VALID"
+    )
+    schema_editor.execute(
+        "ALTER TABLE gps_points VALIDATE CONSTRAINT gps_points_legacy_range"
+    )
+    # Adopted by the parent's primary key, unique constraint and index
+    for sql in [
+        "CREATE UNIQUE INDEX CONCURRENTLY gps_points_legacy_pkey "
+        "ON gps_points (point_id, recorded_at)",
+        "CREATE UNIQUE INDEX CONCURRENTLY gps_points_legacy_point_order_key "
+        "ON gps_points (track_id, point_order, recorded_at)",
+        "CREATE INDEX CONCURRENTLY gps_points_legacy_track_order_idx "
+        "ON gps_points (track_id, point_order) "
+        "INCLUDE (latitude, longitude, altitude_feet, recorded_at)",
+    ]:
+        schema_editor.execute(sql)
+
+    statements = [
+        "LOCK TABLE gps_points IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE gps_points RENAME TO gps_points_legacy",
+    ]
+    statements += [
+        f'ALTER TABLE gps_points_legacy DROP CONSTRAINT "{name}"'
+        for name in unique_constraints
+    ]
+    statements += [
+        # ATTACH only adopts indexes that back a constraint of the partition
+        # for the parent's constraints; USING INDEX doesn't scan the table
+        "ALTER TABLE gps_points_legacy ADD CONSTRAINT gps_points_legacy_pkey "
+        "PRIMARY KEY USING INDEX gps_points_legacy_pkey",
+        "ALTER TABLE gps_points_legacy ADD CONSTRAINT gps_points_legacy_point_order_key "
+        "UNIQUE USING INDEX gps_points_legacy_point_order_key",
+        # point_id is an identity (Django >= 4.1) or serial column; the new
+        # parent table owns the sequence from now on
+        "ALTER TABLE gps_points_legacy ALTER COLUMN point_id DROP IDENTITY IF EXISTS",
+        "ALTER TABLE gps_points_legacy ALTER COLUMN point_id DROP DEFAULT",
+        "DROP SEQUENCE IF EXISTS gps_points_point_id_seq",
+        f"CREATE SEQUENCE gps_points_point_id_seq AS integer START {last_id + 1}",
+        """
+        CREATE TABLE gps_points (
+            point_id integer NOT NULL DEFAULT nextval('gps_points_point_id_seq'),
+            track_id integer NOT NULL,
+            latitude numeric(10, 7) NOT NULL,
+            longitude numeric(10, 7) NOT NULL,
+            altitude_feet numeric(7, 2) NULL,
+            accuracy_feet numeric(6, 2) NULL,
+            speed_mps numeric(6, 2) NULL,
+            recorded_at timestamp with time zone NOT NULL,
+            point_order integer NOT NULL,
+            CONSTRAINT gps_points_pkey PRIMARY KEY (point_id, recorded_at),
+            CONSTRAINT unique_track_point_order UNIQUE (track_id, point_order, recorded_at),
+            CONSTRAINT gps_points_track_id_fk_gps_tracks_track_id FOREIGN KEY (track_id)
+                REFERENCES gps_tracks (track_id) DEFERRABLE INITIALLY DEFERRED
+        ) PARTITION BY RANGE (recorded_at)
+        """,
+        "ALTER SEQUENCE gps_points_point_id_seq OWNED BY gps_points.point_id",
+        # GPSPoint.Meta.indexes, created here so ATTACH adopts the legacy copy
+        "CREATE INDEX gps_points_track_order_idx ON gps_points (track_id, point_order) "
+        "INCLUDE (latitude, longitude, altitude_feet, recorded_at)",
+        "ALTER TABLE gps_points ATTACH PARTITION gps_points_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ({_bound(boundary)})",
+    ]
+    month = boundary
+    for _ in range(MONTHS_AHEAD):
+        statements.append(
+            f"CREATE TABLE gps_points_y{month.year}m{month.month:02d} PARTITION OF gps_points "
+            f"FOR VALUES FROM ({_bound(month)}) TO ({_bound(_next_month(month))})"
+        )
+        month = _next_month(month)
+    statements += [
+        "CREATE TABLE gps_points_default PARTITION OF gps_points DEFAULT",
+        # Implied by the partition bound now
+        "ALTER TABLE gps_points_legacy DROP CONSTRAINT gps_points_legacy_range",
+    ]
+
+    with transaction.atomic(using=schema_editor.connection.alias):
+        for sql in statements:
+            schema_editor.execute(sql)
+
+
+def unpartition_gps_points(apps, schema_editor):
+    """Copy every partition back into one plain table"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with transaction.atomic(using=schema_editor.connection.alias):
+        for sql in [
+            "ALTER SEQUENCE gps_points_point_id_seq OWNED BY NONE",
+            "CREATE TABLE gps_points_plain (LIKE gps_points INCLUDING DEFAULTS)",
+            "INSERT INTO gps_points_plain SELECT * FROM gps_points",
+            "DROP TABLE gps_points CASCADE",
+            "ALTER TABLE gps_points_plain RENAME TO gps_points",
+            "ALTER TABLE gps_points ADD CONSTRAINT gps_points_pkey PRIMARY KEY (point_id)",
+            "ALTER TABLE gps_points ADD CONSTRAINT unique_track_point_order "
+            "UNIQUE (track_id, point_order)",
+            "ALTER TABLE gps_points ADD CONSTRAINT gps_points_track_id_fk_gps_tracks_track_id "
+            "FOREIGN KEY (track_id) REFERENCES gps_tracks (track_id) DEFERRABLE INITIALLY DEFERRED",
+            "CREATE INDEX gps_points_track_id_idx ON gps_points (track_id)",
+            "ALTER SEQUENCE gps_points_point_id_seq OWNED BY gps_points.point_id",
+        ]:
+            schema_editor.execute(sql)
+
+
+class ExceptOnPostgreSQL:
+    """
+    Operation whose database change partition_gps_points() (or, backwards,
+    unpartition_gps_points()) already makes on PostgreSQL
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class AddIndex(ExceptOnPostgreSQL, migrations.AddIndex):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    # VALIDATE CONSTRAINT and CREATE INDEX CONCURRENTLY have to commit
+    # before the table is locked
+    atomic = False
+
+    dependencies = [
+        ("tracking", "0009_altitude_precision"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_gps_points, unpartition_gps_points),
+        migrations.AlterModelOptions(
+            name="gpspoint",
+            options={"ordering": ["point_order"]},
+        ),
+        AddIndex(
+            model_name="gpspoint",
+            index=models.Index(
+                fields=["track", "point_order"],
+                include=("latitude", "longitude", "altitude_feet", "recorded_at"),
+                name="gps_points_track_order_idx",
+            ),
+        ),
+    ]
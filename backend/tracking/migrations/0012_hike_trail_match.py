@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0011_gpstrack_archived_at"),
+        ("trails", "0006_trail_location_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="hike",
+            name="matched_trail",
+            field=models.ForeignKey(
+                blank=True,
+                db_column="matched_trail_id",
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="matched_hikes",
+                to="trails.trail",
+            ),
+        ),
+        migrations.AddField(
+            model_name="hike",
+            name="percent_completed",
+            field=models.DecimalField(
+                blank=True, decimal_places=1, editable=False, max_digits=4, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="hike",
+            name="trail_match_score",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="hike",
+            name="trail_verified",
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+    ]
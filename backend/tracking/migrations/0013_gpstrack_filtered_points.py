@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0012_hike_trail_match"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gpstrack",
+            name="filtered_points",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="rejected_point_count",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
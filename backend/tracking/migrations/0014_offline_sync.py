@@ -0,0 +1,90 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0013_gpstrack_filtered_points"),
+        ("trails", "0006_trail_location_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncTombstone",
+            fields=[
+                (
+                    "tombstone_id",
+                    models.BigAutoField(primary_key=True, serialize=False),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("hike", "Hike"), ("track", "Track")], max_length=10
+                    ),
+                ),
+                ("object_id", models.IntegerField()),
+                ("client_id", models.UUIDField(blank=True, null=True)),
+                ("deleted_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "sync_tombstones",
+            },
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="client_id",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="gpstrack",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name="hike",
+            name="client_id",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="hike",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddConstraint(
+            model_name="gpstrack",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("client_id__isnull", False)),
+                fields=("user", "client_id"),
+                name="unique_track_client_id",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="hike",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("client_id__isnull", False)),
+                fields=("user", "client_id"),
+                name="unique_hike_client_id",
+            ),
+        ),
+        migrations.AddField(
+            model_name="synctombstone",
+            name="user",
+            field=models.ForeignKey(
+                db_column="user_id",
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="sync_tombstones",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="synctombstone",
+            index=models.Index(
+                fields=["user", "deleted_at"], name="sync_tombstones_user_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tracking", "0014_offline_sync"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gpstrack",
+            name="heatmap_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,6 +1,13 @@
+import math
+
 from django.db import models
 from django.conf import settings
 from decimal import Decimal
+from .encoding import COLUMNS, encode_points, decode_points
+from .analytics import (compute_track_stats, distance_between_m, point_arrays, 
+                        ELEVATION_HYSTERESIS_FT, METERS_PER_MILE)
+from .filtering import clean_track, is_outlier
+from .simplify import build_levels, level_coordinates, pick_level, simplify, tolerance_for_zoom
 
 
 class Hike(models.Model):
@@ -24,10 +31,26 @@ class Hike(models.Model):
     weather_conditions = models.CharField(max_length=100, null=True, blank=True)
     completed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Filled in from the GPS tracks on completion (see tracking/matching.py)
+    matched_trail = models.ForeignKey("trails.Trail", on_delete=models.SET_NULL, null=True,
+                                      blank=True, db_column="matched_trail_id", 
+                                      related_name="matched_hikes", editable=False)
+    trail_match_score = models.FloatField(null=True, blank=True, editable=False)
+    # Whether the tracks confirm trail; null when no trail matched
+    trail_verified = models.BooleanField(null=True, blank=True, editable=False)
+    percent_completed = models.DecimalField(max_digits=4, decimal_places=1, null=True,
+                                            blank=True, editable=False)
+    # ID generated by the phone for hikes recorded offline (see tracking/sync.py)
+    client_id = models.UUIDField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = "hikes"
         ordering = ["-start_time"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "client_id"], name="unique_hike_client_id",
+                                    condition=models.Q(client_id__isnull=False))
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.trail.name} on {self.start_time.date()}"
@@ -37,7 +60,7 @@ class Hike(models.Model):
         if self.end_time and self.start_time:
             hike_duration = self.end_time - self.start_time
             self.duration_min = int(hike_duration.total_seconds() / 60)
-            self.save(update_fields=["duration_min"])
+            self.save(update_fields=["duration_min", "updated_at"])
 
 
 class GPSTrack(models.Model):
@@ -53,19 +76,269 @@ class GPSTrack(models.Model):
     ended_at = models.DateTimeField(null=True, blank=True)
     total_distance_miles = models.DecimalField(max_digits=8, decimal_places=3, 
                                                null=True, blank=True)
+    elevation_gain_ft = models.IntegerField(null=True, blank=True)
+    elevation_loss_ft = models.IntegerField(null=True, blank=True)
+    moving_time_sec = models.IntegerField(null=True, blank=True)
+    stopped_time_sec = models.IntegerField(null=True, blank=True)
+    max_speed_mps = models.DecimalField(max_digits=6, decimal_places=2, 
+                                        null=True, blank=True)
+    # Seconds taken for each complete mile
+    pace_splits = models.JSONField(null=True, blank=True)
+    # Running aggregates, updated as points arrive (see add_running_stats)
+    point_count = models.IntegerField(default=0)
+    distance_m = models.FloatField(default=0)
+    last_point_order = models.IntegerField(null=True, blank=True)
+    last_latitude = models.DecimalField(max_digits=10, decimal_places=7, 
+                                        null=True, blank=True)
+    last_longitude = models.DecimalField(max_digits=10, decimal_places=7, 
+                                         null=True, blank=True)
+    last_altitude_feet = models.DecimalField(max_digits=7, decimal_places=2, 
+                                             null=True, blank=True)
+    last_recorded_at = models.DateTimeField(null=True, blank=True)
+    elevation_anchor_ft = models.FloatField(null=True, blank=True)
+    min_latitude = models.DecimalField(max_digits=10, decimal_places=7, 
+                                       null=True, blank=True)
+    max_latitude = models.DecimalField(max_digits=10, decimal_places=7, 
+                                       null=True, blank=True)
+    min_longitude = models.DecimalField(max_digits=10, decimal_places=7, 
+                                        null=True, blank=True)
+    max_longitude = models.DecimalField(max_digits=10, decimal_places=7, 
+                                        null=True, blank=True)
     text_gps_data = models.TextField(null=True, blank=True)
+    # All points packed into one compressed blob (see tracking/encoding.py)
+    packed_points = models.BinaryField(null=True, blank=True, editable=False)
+    # Points left after noise filtering, smoothed, packed like packed_points
+    # (see tracking/filtering.py). Set when the track is stopped
+    filtered_points = models.BinaryField(null=True, blank=True, editable=False)
+    rejected_point_count = models.IntegerField(null=True, blank=True)
+    # Set once the GPSPoint rows were replaced by packed_points (see tracking/archive.py)
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Set once the track was counted in the heatmap tiles (see tracking/heatmap.py)
+    heatmap_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # {"<tolerance in meters>": "<encoded polyline>"} (see tracking/simplify.py)
+    simplified_polylines = models.JSONField(null=True, blank=True, editable=False)
+    client_id = models.UUIDField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = "gps_tracks"
         ordering = ["-started_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "client_id"], name="unique_track_client_id",
+                                    condition=models.Q(client_id__isnull=False))
+        ]
+
+    RUNNING_STAT_FIELDS = ["point_count", "distance_m", "total_distance_miles", 
+                           "elevation_gain_ft", "elevation_loss_ft", "elevation_anchor_ft",
+                           "last_point_order", "last_latitude", "last_longitude", 
+                           "last_altitude_feet", "last_recorded_at", "min_latitude", 
+                           "max_latitude", "min_longitude", "max_longitude", "updated_at"]
+    # Packed points and polylines, only needed to read or rebuild the geometry
+    BLOB_FIELDS = ["packed_points", "filtered_points", "simplified_polylines"]
 
     def __str__(self):
         return f"Track for {self.hike}"
     
+    @property
+    def bounding_box(self):
+        """(min_lat, min_lon, max_lat, max_lon) of the points so far"""
+        if self.min_latitude is None:
+            return None
+        return (self.min_latitude, self.min_longitude, self.max_latitude, self.max_longitude)
+    
+    def add_running_stats(self, points):
+        """
+            Fold newly saved points into the running aggregates, O(1) per
+            point. Points older than the last one seen only update the count
+            and bounding box, outliers (see filtering.is_outlier) only the
+            count; stop() recomputes everything exactly.
+            Save with update_fields=GPSTrack.RUNNING_STAT_FIELDS.
+        """
+        for point in sorted(points, key=lambda p: p.point_order):
+            latitude = Decimal(point.latitude)
+            longitude = Decimal(point.longitude)
+            self.point_count += 1
+
+            in_order = self.last_point_order is None or point.point_order >= self.last_point_order
+            step_m = elapsed_sec = None
+            if in_order and self.last_latitude is not None:
+                step_m = distance_between_m(
+                    float(self.last_latitude), float(self.last_longitude), 
+                    float(latitude), float(longitude))
+                elapsed_sec = (point.recorded_at - self.last_recorded_at).total_seconds()
+            if is_outlier(point, elapsed_sec, step_m):
+                continue
+
+            if self.min_latitude is None:
+                self.min_latitude = self.max_latitude = latitude
+                self.min_longitude = self.max_longitude = longitude
+            else:
+                self.min_latitude = min(self.min_latitude, latitude)
+                self.max_latitude = max(self.max_latitude, latitude)
+                self.min_longitude = min(self.min_longitude, longitude)
+                self.max_longitude = max(self.max_longitude, longitude)
+
+            if not in_order:
+                continue
+
+            if step_m is not None:
+                self.distance_m += step_m
+
+            if point.altitude_feet is not None:
+                altitude = float(point.altitude_feet)
+                if self.elevation_anchor_ft is None:
+                    self.elevation_anchor_ft = altitude
+                # Same deadband idea as analytics.elevation_change
+                change = altitude - self.elevation_anchor_ft
+                if abs(change) >= ELEVATION_HYSTERESIS_FT:
+                    if change > 0:
+                        self.elevation_gain_ft = (self.elevation_gain_ft or 0) + round(change)
+                    else:
+                        self.elevation_loss_ft = (self.elevation_loss_ft or 0) - round(change)
+                    self.elevation_anchor_ft = altitude
+
+            self.last_point_order = point.point_order
+            self.last_latitude = latitude
+            self.last_longitude = longitude
+            self.last_altitude_feet = point.altitude_feet
+            self.last_recorded_at = point.recorded_at
+
+        self.total_distance_miles = Decimal(f"{self.distance_m / METERS_PER_MILE:.3f}")
+    
+    def rebuild_running_stats(self, save=True):
+        """Recompute the running aggregates from every point, e.g. after one was deleted"""
+        for name in self.RUNNING_STAT_FIELDS:
+            if name != "updated_at":
+                setattr(self, name, self._meta.get_field(name).get_default())
+        self.add_running_stats(list(self.get_points()))
+        if save:
+            self.save(update_fields=GPSTrack.RUNNING_STAT_FIELDS)
+    
     def get_gps_point_count(self):
         """Get number of GPS points saved on the hike"""
+        if self.archived_at:
+            return self.point_count
         return self.gps_points.count()
     
+    def get_points(self):
+        """
+            The track's points in order: the GPSPoint rows, or unsaved GPSPoints
+            rebuilt from the archive once the track is archived
+        """
+        if self.archived_at:
+            return self.unpack_points()
+        return self.gps_points.all()
+    
+    def point_values(self, *fields):
+        """Tuples of the given point fields in point order, archived or not"""
+        if self.archived_at:
+            return [tuple(row[name] for name in fields) 
+                    for row in decode_points(self.packed_points)]
+        return self.gps_points.order_by("point_order").values_list(*fields)
+    
+    def get_coordinates(self, cleaned=False):
+        """
+            (latitude, longitude) floats in point order, without building
+            GPSPoints. cleaned gives the filtered series once the track is
+            stopped.
+        """
+        if cleaned and self.filtered_points:
+            return [(float(row["latitude"]), float(row["longitude"])) 
+                    for row in decode_points(self.filtered_points)]
+        return [(float(latitude), float(longitude)) for latitude, longitude in 
+                self.point_values("latitude", "longitude")]
+    
+    def compute_stats(self, save=True):
+        """
+            Filter the points (see tracking/filtering.py), store the cleaned
+            series and compute distance, elevation, timing and speed stats
+            from it
+        """
+        rows = list(self.point_values("latitude", "longitude", "altitude_feet", "recorded_at",
+                                      "accuracy_feet", "speed_mps", "point_order"))
+        cleaned = clean_track(point_arrays(row[:6] for row in rows))
+        self.filtered_points = encode_points([
+            {"point_order": rows[i][6], "recorded_at": rows[i][3], 
+             "latitude": latitude, "longitude": longitude, 
+             "altitude_feet": None if math.isnan(altitude) else altitude,
+             "accuracy_feet": rows[i][4], "speed_mps": rows[i][5]}
+            for i, latitude, longitude, altitude in zip(
+                cleaned["kept"].tolist(), cleaned["latitude"].tolist(), 
+                cleaned["longitude"].tolist(), cleaned["altitude_feet"].tolist())])
+        self.rejected_point_count = cleaned["rejected"]
+
+        stats = compute_track_stats(cleaned)
+        self.point_count = len(rows)
+        self.distance_m = stats["distance_m"]
+        if stats["bounding_box"]:
+            (self.min_latitude, self.min_longitude, 
+             self.max_latitude, self.max_longitude) = [
+                Decimal(f"{value:.7f}") for value in stats["bounding_box"]]
+        self.total_distance_miles = Decimal(f"{stats['distance_miles']:.3f}")
+        self.elevation_gain_ft = stats["elevation_gain_ft"]
+        self.elevation_loss_ft = stats["elevation_loss_ft"]
+        self.moving_time_sec = stats["moving_time_sec"]
+        self.stopped_time_sec = stats["stopped_time_sec"]
+        self.max_speed_mps = Decimal(f"{stats['max_speed_mps']:.2f}")
+        self.pace_splits = stats["pace_splits"]
+        if save:
+            self.save(update_fields=["point_count", "filtered_points", "rejected_point_count",
+                                     "distance_m", "min_latitude", 
+                                     "max_latitude", "min_longitude", "max_longitude",
+                                     "total_distance_miles", "elevation_gain_ft", 
+                                     "elevation_loss_ft", "moving_time_sec", 
+                                     "stopped_time_sec", "max_speed_mps", "pace_splits",
+                                     "updated_at"])
+        return stats
+    
+    def simplify_points(self, save=True):
+        """Precompute simplified copies of the track for each zoom level"""
+        self.simplified_polylines = build_levels(self.get_coordinates(cleaned=True))
+        if save:
+            self.save(update_fields=["simplified_polylines", "updated_at"])
+    
+    def tolerance_for_zoom(self, zoom):
+        """Meters per map pixel at a zoom level, at the track's latitude"""
+        if self.archived_at:
+            latitude = self.last_latitude
+        else:
+            latitude = self.gps_points.order_by("point_order").values_list(
+                "latitude", flat=True).first()
+        return tolerance_for_zoom(zoom, float(latitude or 0))
+    
+    def get_simplified_coordinates(self, tolerance):
+        """
+            Returns (level, coordinates) for the coarsest simplified copy within
+            tolerance meters. Level 0 means every point. Like the stored
+            levels, these come from the filtered points once the track is
+            stopped.
+        """
+        level = pick_level(tolerance)
+        if level is None:
+            return 0, self.get_coordinates(cleaned=True)
+        if self.simplified_polylines and str(level) in self.simplified_polylines:
+            return level, level_coordinates(self.simplified_polylines, level)
+        # Still recording, or stopped before levels were stored
+        return level, simplify(self.get_coordinates(cleaned=True), level)
+    
+    def pack_points(self, save=True):
+        """Pack every GPSPoint row of the track into packed_points"""
+        if self.archived_at:
+            # The rows are gone, packed_points already holds every point
+            return self.point_count
+        fields = [name for name, _, _ in COLUMNS]
+        points = list(self.gps_points.order_by("point_order").values(*fields))
+        self.packed_points = encode_points(points)
+        if save:
+            self.save(update_fields=["packed_points", "updated_at"])
+        return len(points)
+    
+    def unpack_points(self):
+        """Unsaved GPSPoint objects rebuilt from packed_points"""
+        if not self.packed_points:
+            return []
+        return [GPSPoint(track=self, **row) for row in decode_points(self.packed_points)]
+    
 
 class GPSPoint(models.Model):
     """
@@ -77,7 +350,8 @@ class GPSPoint(models.Model):
                               db_column="track_id", related_name="gps_points")
     latitude = models.DecimalField(max_digits=10, decimal_places=7)
     longitude = models.DecimalField(max_digits=10, decimal_places=7)
-    altitude_feet = models.DecimalField(max_digits=6, decimal_places=2, 
+    # Up to 99,999.99 ft, high peaks are above 9,999 ft
+    altitude_feet = models.DecimalField(max_digits=7, decimal_places=2, 
                                         null=True, blank=True)
     accuracy_feet = models.DecimalField(max_digits=6, decimal_places=2, 
                                         null=True, blank=True)
@@ -88,8 +362,22 @@ class GPSPoint(models.Model):
 
     
     class Meta:
+        # On PostgreSQL the table is partitioned by recorded_at month, see
+        # tracking/partitions.py
         db_table = "gps_points"
-        ordering = ["track", "point_order"]
+        ordering = ["point_order"]
+        constraints = [
+            # On PostgreSQL it also includes recorded_at, which a partitioned
+            # table's unique constraints must, and store_points() skips any
+            # other repeated point_order under the track's row lock
+            models.UniqueConstraint(fields=["track", "point_order"], 
+                                    name="unique_track_point_order")
+        ]
+        indexes = [
+            # Covers track reads in point order without visiting the heap
+            models.Index(fields=["track", "point_order"], name="gps_points_track_order_idx",
+                         include=["latitude", "longitude", "altitude_feet", "recorded_at"])
+        ]
 
     def __str__(self):
         return f"Point {self.point_order} at ({self.latitude}, {self.longitude})"
@@ -99,4 +387,103 @@ class GPSPoint(models.Model):
         """Returns the coordinates as a tuple"""
         return (float(self.latitude), float(self.longitude))
     
-    
\ No newline at end of file
+    
+
+class HikerStats(models.Model):
+    """
+        Running totals and personal records of a user's completed hikes.
+        Updated when a hike is completed, so reading stats doesn't depend on
+        how many hikes the user has (see tracking/stats.py).
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, 
+                                primary_key=True, db_column="user_id", 
+                                related_name="hiker_stats")
+    total_hikes = models.IntegerField(default=0)
+    total_distance_miles = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_duration_min = models.IntegerField(default=0)
+    total_elevation_gain_ft = models.IntegerField(default=0)
+    longest_hike = models.ForeignKey(Hike, on_delete=models.SET_NULL, null=True, blank=True, 
+                                     related_name="+")
+    longest_distance_miles = models.DecimalField(max_digits=6, decimal_places=2, 
+                                                 null=True, blank=True)
+    fastest_hike = models.ForeignKey(Hike, on_delete=models.SET_NULL, null=True, blank=True, 
+                                     related_name="+")
+    fastest_pace_min_per_mile = models.FloatField(null=True, blank=True)
+    most_elevation_hike = models.ForeignKey(Hike, on_delete=models.SET_NULL, null=True, 
+                                            blank=True, related_name="+")
+    most_elevation_gain_ft = models.IntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "hiker_stats"
+
+    def __str__(self):
+        return f"Stats for {self.user.username}"
+
+
+class HikerMonthStats(models.Model):
+    """Completed hike totals of a user for one calendar month"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, 
+                             db_column="user_id", related_name="hiker_month_stats")
+    month = models.DateField()
+    hikes = models.IntegerField(default=0)
+    distance_miles = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    duration_min = models.IntegerField(default=0)
+    elevation_gain_ft = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "hiker_month_stats"
+        ordering = ["month"]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "month"], name="unique_user_month_stats")
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.month:%Y-%m}"
+
+
+class HikerTrailStats(models.Model):
+    """Completed hike totals of a user on one trail"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, 
+                             db_column="user_id", related_name="hiker_trail_stats")
+    trail = models.ForeignKey("trails.Trail", on_delete=models.CASCADE, 
+                              db_column="trail_id", related_name="hiker_stats")
+    hikes = models.IntegerField(default=0)
+    distance_miles = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    duration_min = models.IntegerField(default=0)
+    last_hiked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "hiker_trail_stats"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "trail"], name="unique_user_trail_stats")
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.trail.name}"
+
+
+class SyncTombstone(models.Model):
+    """
+        Records a deleted hike or track so offline clients learn about the
+        deletion on their next sync (see tracking/sync.py)
+    """
+    HIKE = "hike"
+    TRACK = "track"
+
+    tombstone_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, 
+                             db_column="user_id", related_name="sync_tombstones")
+    kind = models.CharField(max_length=10, choices=[(HIKE, "Hike"), (TRACK, "Track")])
+    object_id = models.IntegerField()
+    client_id = models.UUIDField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "sync_tombstones"
+        indexes = [
+            models.Index(fields=["user", "deleted_at"], name="sync_tombstones_user_idx")
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
@@ -0,0 +1,31 @@
+"""
+Request parsers for tracking. Offline sync batches can be a day of points,
+so clients may gzip them (Content-Encoding: gzip).
+"""
+import io
+import zlib
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+
+# Largest decompressed body accepted, against gzip bombs
+MAX_DECOMPRESSED_BYTES = 50 * 1024 * 1024
+
+
+class GzipJSONParser(JSONParser):
+    """JSON, optionally sent with Content-Encoding: gzip"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        encoding = request.META.get("HTTP_CONTENT_ENCODING", "") if request else ""
+        if encoding.lower() == "gzip" and stream is not None:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                body = decompressor.decompress(stream.read(), MAX_DECOMPRESSED_BYTES)
+            except zlib.error as e:
+                raise ParseError(f"Invalid gzip body: {e}")
+            if decompressor.unconsumed_tail:
+                raise ParseError("Request body is too large")
+            stream = io.BytesIO(body)
+        return super().parse(stream, media_type, parser_context)
@@ -0,0 +1,98 @@
+"""
+Monthly partitions of gps_points (PostgreSQL only). Since migration 0010 the
+table is partitioned by RANGE (recorded_at):
+    gps_points_legacy       every point recorded before partitioning
+    gps_points_y2025m06     one partition per calendar month (UTC)
+    gps_points_default      anything outside the existing partitions
+
+create_month_partitions() adds the partitions for the coming months and is
+run by the create_gps_point_partitions command. Old months can then be
+detached (ALTER TABLE gps_points DETACH PARTITION ... CONCURRENTLY), dumped
+or dropped without touching the rest of the table.
+"""
+
+import re
+from datetime import date
+
+from django.db import connection, transaction
+
+
+TABLE = "gps_points"
+LEGACY_PARTITION = "gps_points_legacy"
+DEFAULT_PARTITION = "gps_points_default"
+
+
+def is_partitioned():
+    """True when gps_points is a partitioned PostgreSQL table"""
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+                       [TABLE])
+        return cursor.fetchone() is not None
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_y{month.year}m{month.month:02d}"
+
+
+def existing_partitions():
+    """{partition name: bound expression}"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+                       "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                       "WHERE i.inhparent = %s::regclass", [TABLE])
+        return dict(cursor.fetchall())
+
+
+def legacy_end(partitions):
+    """First month not covered by gps_points_legacy"""
+    bound = partitions.get(LEGACY_PARTITION)
+    match = re.search(r"TO \('(\d{4})-(\d{2})-01", bound or "")
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def create_month_partition(month):
+    """
+        Create and attach the partition for one month. Points of that month
+        that already landed in the default partition are moved into it.
+    """
+    name = partition_name(month)
+    start, end = f"{month.isoformat()} 00:00:00+00", f"{next_month(month).isoformat()} 00:00:00+00"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE recorded_at >= %s AND recorded_at < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved", [start, end])
+        cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+                       f"FOR VALUES FROM (%s) TO (%s)", [start, end])
+
+
+def create_month_partitions(months_ahead=3, today=None):
+    """
+        Make sure the current month and the next months_ahead months have a
+        partition. Returns the names of the partitions created.
+    """
+    existing = existing_partitions()
+    month = month_start(today or date.today())
+    # Months before partitioning live in the legacy partition
+    end = legacy_end(existing)
+    if end and end > month:
+        months_ahead -= (end.year - month.year) * 12 + end.month - month.month
+        month = end
+    created = []
+    for _ in range(months_ahead + 1):
+        if partition_name(month) not in existing:
+            create_month_partition(month)
+            created.append(partition_name(month))
+        month = next_month(month)
+    return created
@@ -0,0 +1,99 @@
+"""
+Elevation profiles for charts: altitude against distance along the track,
+downsampled with Largest-Triangle-Three-Buckets (LTTB) to about as many
+points as the chart is pixels wide. LTTB keeps the points that change the
+shape of the line most, so peaks and saddles survive even on long tracks.
+
+Profiles of stopped tracks can't change, so they are kept in the Django
+cache per track and width.
+"""
+
+import math
+
+import numpy as np
+from django.core.cache import cache
+
+from .analytics import haversine_m, METERS_PER_MILE
+from .encoding import decode_points
+
+
+DEFAULT_WIDTH = 300
+MAX_WIDTH = 2000
+PROFILE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def lttb(x, y, threshold):
+    """Indexes of the threshold points LTTB keeps from the (x, y) series"""
+    count = len(x)
+    if threshold >= count or count <= 2:
+        return np.arange(count)
+    if threshold < 3:
+        return np.array([0, count - 1])
+
+    every = (count - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, count - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start = int(math.floor(bucket * every)) + 1
+        end = int(math.floor((bucket + 1) * every)) + 1
+        # Average of the next bucket (the last point for the last bucket)
+        next_end = min(int(math.floor((bucket + 2) * every)) + 1, count)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Twice the area of the triangle each candidate makes with the
+        # previously kept point and the next bucket's average
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected[bucket + 1] = a
+    return selected
+
+
+def elevation_series(track):
+    """
+        (distance in miles, altitude in feet) arrays for the points that have
+        an altitude. Uses the filtered points once the track is stopped.
+    """
+    if track.filtered_points:
+        rows = [(row["latitude"], row["longitude"], row["altitude_feet"])
+                for row in decode_points(track.filtered_points)]
+    else:
+        rows = list(track.point_values("latitude", "longitude", "altitude_feet"))
+    if not rows:
+        return np.array([]), np.array([])
+
+    latitudes, longitudes, altitudes = zip(*rows)
+    segment_m = haversine_m(np.array(latitudes, dtype=float), np.array(longitudes, dtype=float))
+    miles = np.concatenate(([0.0], np.cumsum(segment_m))) / METERS_PER_MILE
+    altitude = np.array([np.nan if a is None else a for a in altitudes], dtype=float)
+    present = ~np.isnan(altitude)
+    return miles[present], altitude[present]
+
+
+def build_profile(track, width):
+    """Downsampled profile data for a track and chart width"""
+    miles, altitude = elevation_series(track)
+    keep = lttb(miles, altitude, width)
+    return {
+        "track_id": track.track_id,
+        "width": width,
+        "source_point_count": len(miles),
+        "point_count": len(keep),
+        "distance_miles": round(float(miles[-1]), 3) if len(miles) else 0,
+        "min_altitude_feet": round(float(altitude.min()), 1) if len(altitude) else None,
+        "max_altitude_feet": round(float(altitude.max()), 1) if len(altitude) else None,
+        "profile": [[round(float(miles[i]), 3), round(float(altitude[i]), 1)] for i in keep],
+    }
+
+
+def get_profile(track, width):
+    """build_profile(), cached once the track is stopped"""
+    if not track.ended_at:
+        return build_profile(track, width)
+    key = f"tracking:profile:{track.track_id}:{width}"
+    profile = cache.get(key)
+    if profile is None:
+        profile = build_profile(track, width)
+        cache.set(key, profile, PROFILE_CACHE_TIMEOUT)
+    return profile
@@ -0,0 +1,16 @@
+"""
+Compact output formats for GPS tracks, selected with ?format=polyline or
+?format=geojson on GPSTrackViewSet.
+"""
+from rest_framework.renderers import JSONRenderer
+
+
+class PolylineRenderer(JSONRenderer):
+    """Track as JSON with its points in a Google encoded polyline string"""
+    format = "polyline"
+
+
+class GeoJSONRenderer(JSONRenderer):
+    """Track as a GeoJSON LineString feature"""
+    media_type = "application/geo+json"
+    format = "geojson"
@@ -0,0 +1,6 @@
+from django.urls import path
+from .consumers import LiveTrackConsumer
+
+websocket_urlpatterns = [
+    path("ws/tracking/tracks/<int:track_id>/", LiveTrackConsumer.as_asgi()),
+]
@@ -1,9 +1,17 @@
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import serializers
 from .models import Hike, GPSTrack, GPSPoint
+from .encoding import encode_polyline
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
+# About two days of one fix per second
+MAX_SYNC_POINTS = 200000
+
 
 class UserSerializer(serializers.ModelSerializer):
     """User infor"""
@@ -29,39 +37,117 @@ class GPSPointCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = GPSPoint
-        fields = ["latitude", "longitude", "altitude_miles", "accuracy_miles", 
+        fields = ["latitude", "longitude", "altitude_feet", "accuracy_feet", 
                   "speed_mps", "recorded_at", "point_order"]
 
+
+class BatchTrackPointsSerializer(serializers.Serializer):
+    """Serializer for adding many points to a track in one request"""
+    points = GPSPointCreateSerializer(many=True, allow_empty=False, 
+                                      max_length=5000)
+
 class GPSTrackSerializer(serializers.ModelSerializer):
     """All the points"""
     user = UserSerializer(read_only = True)
-    gps_points = GPSPointSerializer(many=True, read_only=True)
-    point_count = serializers.SerializerMethodField()
+    # Rebuilt from packed_points for archived tracks
+    gps_points = GPSPointSerializer(many=True, read_only=True, source="get_points")
+    bounding_box = serializers.ReadOnlyField()
 
     class Meta:
         model = GPSTrack
         fields = ["track_id", "hike", "user", "started_at", "ended_at", 
-                  "total_distance_miles", "text_gps_data", "gps_points", 
-                  "point_count"]
-        read_only_fields = ["track_id", "user", "started_at"]
+                  "total_distance_miles", "elevation_gain_ft", "elevation_loss_ft",
+                  "moving_time_sec", "stopped_time_sec", "max_speed_mps", 
+                  "pace_splits", "text_gps_data", "gps_points", "point_count",
+                  "last_latitude", "last_longitude", "last_altitude_feet", 
+                  "last_recorded_at", "bounding_box", "archived_at", 
+                  "rejected_point_count"]
+        read_only_fields = ["track_id", "user", "started_at", "total_distance_miles",
+                            "elevation_gain_ft", "elevation_loss_ft", "moving_time_sec", 
+                            "stopped_time_sec", "max_speed_mps", "pace_splits", 
+                            "point_count", "last_latitude", "last_longitude", 
+                            "last_altitude_feet", "last_recorded_at", 
+                            "rejected_point_count"]
     
+
+class GPSTrackPolylineSerializer(serializers.ModelSerializer):
+    """
+        Track with its points as a Google encoded polyline. Expects the
+        track's coordinates in context["coordinates"].
+    """
+    point_count = serializers.SerializerMethodField()
+    polyline = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GPSTrack
+        fields = ["track_id", "hike", "started_at", "ended_at", 
+                  "total_distance_miles", "point_count", "polyline"]
+
     def get_point_count(self, obj):
-        return obj.gps_points.count()
-    
+        return len(self.context["coordinates"])
+
+    def get_polyline(self, obj):
+        return encode_polyline(self.context["coordinates"])
+
+
+class GPSTrackSimplifiedSerializer(serializers.ModelSerializer):
+    """
+        Track with a simplified list of [latitude, longitude] pairs. Expects
+        context["coordinates"] and the tolerance used in context["tolerance"].
+    """
+    tolerance_m = serializers.SerializerMethodField()
+    point_count = serializers.SerializerMethodField()
+    coordinates = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GPSTrack
+        fields = ["track_id", "hike", "started_at", "ended_at", 
+                  "total_distance_miles", "tolerance_m", "point_count", 
+                  "coordinates"]
+
+    def get_tolerance_m(self, obj):
+        return self.context["tolerance"]
+
+    def get_point_count(self, obj):
+        return len(self.context["coordinates"])
+
+    def get_coordinates(self, obj):
+        return [[lat, lon] for lat, lon in self.context["coordinates"]]
+
+
+class GPSTrackGeoJSONSerializer(serializers.ModelSerializer):
+    """
+        Track as a GeoJSON Feature with a LineString geometry. Expects the
+        track's coordinates in context["coordinates"].
+    """
+
+    class Meta:
+        model = GPSTrack
+        fields = ["track_id", "hike", "started_at", "ended_at", 
+                  "total_distance_miles"]
+
+    def to_representation(self, instance):
+        coordinates = self.context["coordinates"]
+        properties = super().to_representation(instance)
+        properties["point_count"] = len(coordinates)
+        return {
+            "type": "Feature",
+            # GeoJSON positions are [longitude, latitude]
+            "geometry": {"type": "LineString", 
+                         "coordinates": [[lon, lat] for lat, lon in coordinates]},
+            "properties": properties,
+        }
+
 
 class GPSTrackListSerializer(serializers.ModelSerializer):
     """Track serializer for list views"""
     user = UserSerializer(read_only=True)
-    point_count = serializers.SerializerMethodField()
 
     class Meta:
         model = GPSTrack
         fields = ["track_id", "hike", "user", "started_at", "ended_at", 
-                  "total_distance_miles", "point_count"]
-        read_only_fields = ["track_id", "user"]
-
-    def get_point_count(self, obj):
-        return obj.gps_points.count()
+                  "total_distance_miles", "point_count", "last_recorded_at"]
+        read_only_fields = ["track_id", "user", "point_count", "last_recorded_at"]
     
 
 class HikeSerializer(serializers.ModelSerializer):
@@ -74,7 +160,9 @@ class HikeSerializer(serializers.ModelSerializer):
         model = Hike
         fields = ["hike_id", "user", "trail", "trail_name", "start_time", 
                   "end_time", "duration_min", "distance_miles", "notes", 
-                  "weather_conditions", "completed", "gps_tracks", "created_at"]
+                  "weather_conditions", "completed", "gps_tracks", "created_at",
+                  "matched_trail", "trail_match_score", "trail_verified", 
+                  "percent_completed"]
         read_only_fields = ["hike_id", "user", "duration_min", "created_at"]
 
 
@@ -82,18 +170,16 @@ class HikeListSerializer(serializers.ModelSerializer):
     """Serializer for the list of hikes done by user"""
     user = UserSerializer(read_only=True)
     trail_name = serializers.CharField(source="trail.name", read_only=True)
-    track_count = serializers.SerializerMethodField()
+    # Annotated by HikeViewSet.get_queryset so the list needs no query per hike
+    track_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Hike
         fields = ["hike_id", "user", "trail", "trail_name", "start_time", 
                   "end_time", "duration_min", "distance_miles", "completed", 
-                  "track_count", "created_at"]
+                  "track_count", "percent_completed", "trail_verified", "created_at"]
         read_only_fields = ["hike_id", "user", "created_at"]
 
-
-    def get_track_count(self, obj):
-        return obj.gps_tracks.count()
     
 class StartHikeSerializer(serializers.ModelSerializer):
     """Serializer for starting a new hike"""
@@ -104,14 +190,154 @@ class StartHikeSerializer(serializers.ModelSerializer):
 
 class CompleteHikeSerializer(serializers.ModelSerializer):
     """Serializer for completing a hike"""
+    # Replace the hike's trail with the one its tracks matched
+    use_matched_trail = serializers.BooleanField(write_only=True, required=False)
+
     class Meta:
         model = Hike
-        fields = ["distance_miles", "duration_min", "end_time", "notes"]
-        read_only_fields = ["duration_min"]
+        fields = ["distance_miles", "duration_min", "end_time", "notes", "trail",
+                  "matched_trail", "trail_match_score", "trail_verified", 
+                  "percent_completed", "use_matched_trail"]
+        read_only_fields = ["duration_min", "trail"]
 
     def update(self, instance, validated_data):
+        validated_data.pop("use_matched_trail", None)
         instance = super().update(instance, validated_data)
         # Calculate the time it took to complete hike
         if instance.completed and instance.end_time:
             instance.calculate_duration()
-        return instance
\ No newline at end of file
+        return instance
+
+class SyncHikeSerializer(serializers.ModelSerializer):
+    """A hike recorded on the phone, identified by its client_id"""
+    client_id = serializers.UUIDField()
+    # When the phone last changed the hike, used to resolve conflicts
+    modified_at = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = Hike
+        fields = ["client_id", "trail", "start_time", "end_time", "distance_miles", 
+                  "notes", "weather_conditions", "completed", "modified_at"]
+
+
+class SyncPointsField(serializers.Field):
+    """
+        List of points in the GPSPointCreateSerializer format, validated in
+        plain Python. A day of points is ~100k dicts, which takes seconds
+        through nested serializers and milliseconds here.
+    """
+    # name: (max_digits, decimal_places, required), as on GPSPoint
+    DECIMALS = {"latitude": (10, 7, True), "longitude": (10, 7, True),
+                "altitude_feet": (7, 2, False), "accuracy_feet": (6, 2, False), 
+                "speed_mps": (6, 2, False)}
+    MAX_ERRORS = 10
+
+    def _decimal(self, name, value):
+        digits, places, required = self.DECIMALS[name]
+        if value is None or value == "":
+            if required:
+                raise ValueError(f"{name} is required.")
+            return None
+        try:
+            number = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError(f"{name} must be a number.")
+        if not number.is_finite():
+            raise ValueError(f"{name} must be a number.")
+        sign, number_digits, exponent = number.as_tuple()
+        if -exponent > places:
+            raise ValueError(f"{name} has more than {places} decimal places.")
+        if len(number_digits) + min(exponent, 0) > digits - places:
+            raise ValueError(f"{name} is too large.")
+        return number
+
+    def _point(self, point):
+        if not isinstance(point, dict):
+            raise ValueError("Expected an object.")
+        data = {name: self._decimal(name, point.get(name)) for name in self.DECIMALS}
+        recorded_at = point.get("recorded_at")
+        recorded_at = parse_datetime(recorded_at) if isinstance(recorded_at, str) else None
+        if recorded_at is None:
+            raise ValueError("recorded_at must be an ISO 8601 datetime.")
+        if timezone.is_naive(recorded_at):
+            recorded_at = timezone.make_aware(recorded_at)
+        data["recorded_at"] = recorded_at
+        order = point.get("point_order")
+        if isinstance(order, bool) or not isinstance(order, (int, str)):
+            raise ValueError("point_order must be a whole number.")
+        try:
+            data["point_order"] = int(order)
+        except ValueError:
+            raise ValueError("point_order must be a whole number.")
+        return data
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError("Expected a list of points.")
+        if len(data) > MAX_SYNC_POINTS:
+            raise serializers.ValidationError(f"At most {MAX_SYNC_POINTS} points.")
+        points, errors = [], {}
+        for index, point in enumerate(data):
+            try:
+                points.append(self._point(point))
+            except ValueError as e:
+                errors[index] = str(e)
+                if len(errors) >= self.MAX_ERRORS:
+                    break
+        if errors:
+            raise serializers.ValidationError(errors)
+        return points
+
+    def to_representation(self, value):
+        return value
+
+
+class SyncTrackSerializer(serializers.Serializer):
+    """A track recorded on the phone with the points it has not synced yet"""
+    client_id = serializers.UUIDField()
+    # client_id of the hike, or hike_id for a hike the server already knows
+    hike = serializers.UUIDField(required=False)
+    hike_id = serializers.IntegerField(required=False)
+    started_at = serializers.DateTimeField()
+    ended_at = serializers.DateTimeField(required=False, allow_null=True)
+    points = SyncPointsField(required=False)
+
+    def validate(self, data):
+        if not data.get("hike") and not data.get("hike_id"):
+            raise serializers.ValidationError("hike or hike_id is required.")
+        return data
+
+
+class SyncSerializer(serializers.Serializer):
+    """Everything a phone queued while offline"""
+    sync_token = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    hikes = SyncHikeSerializer(many=True, required=False, max_length=500)
+    tracks = SyncTrackSerializer(many=True, required=False, max_length=500)
+
+    def validate_tracks(self, tracks):
+        if sum(len(track.get("points", [])) for track in tracks) > MAX_SYNC_POINTS:
+            raise serializers.ValidationError(
+                f"At most {MAX_SYNC_POINTS} points can be synced at once.")
+        return tracks
+
+
+class SyncHikeChangeSerializer(serializers.ModelSerializer):
+    """Hike as sent back to the phone in the sync delta"""
+
+    class Meta:
+        model = Hike
+        fields = ["hike_id", "client_id", "trail", "start_time", "end_time", 
+                  "duration_min", "distance_miles", "notes", "weather_conditions", 
+                  "completed", "matched_trail", "trail_verified", "percent_completed",
+                  "updated_at"]
+
+
+class SyncTrackChangeSerializer(serializers.ModelSerializer):
+    """Track as sent back to the phone in the sync delta, without points"""
+
+    class Meta:
+        model = GPSTrack
+        fields = ["track_id", "client_id", "hike", "started_at", "ended_at", 
+                  "total_distance_miles", "elevation_gain_ft", "elevation_loss_ft",
+                  "moving_time_sec", "stopped_time_sec", "point_count", 
+                  "rejected_point_count", "updated_at"]
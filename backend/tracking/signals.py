@@ -0,0 +1,26 @@
+"""
+Signals for tracking app. Deleted hikes and tracks leave a SyncTombstone so
+the offline sync endpoint can tell clients to drop them (tracking/sync.py).
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Hike, GPSTrack, SyncTombstone
+
+
+def _record_deletion(kind, instance, origin):
+    # Nobody is left to sync with when the user themselves is deleted
+    if isinstance(origin, get_user_model()):
+        return
+    SyncTombstone.objects.create(user_id=instance.user_id, kind=kind, 
+                                 object_id=instance.pk, client_id=instance.client_id)
+
+
+@receiver(post_delete, sender=Hike)
+def record_hike_deletion(sender, instance, origin=None, **kwargs):
+    _record_deletion(SyncTombstone.HIKE, instance, origin)
+
+
+@receiver(post_delete, sender=GPSTrack)
+def record_track_deletion(sender, instance, origin=None, **kwargs):
+    _record_deletion(SyncTombstone.TRACK, instance, origin)
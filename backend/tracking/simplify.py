@@ -0,0 +1,119 @@
+"""
+Track simplification for map display. Long tracks have far more points than
+a map can show at a given zoom, so simplified copies are precomputed at a few
+tolerances (in meters) and the right one is picked for the requested zoom.
+"""
+
+import math
+
+import numpy as np
+
+from .encoding import encode_polyline, decode_polyline
+
+
+# Tolerances in meters that are precomputed when a track is stopped
+LEVELS = [2, 10, 40, 150, 600]
+
+# Polylines for stored levels keep 6 decimals (~0.1 m)
+POLYLINE_PRECISION = 6
+
+EARTH_RADIUS_M = 6371008.8
+
+# Ground resolution of a web map tile pixel at zoom 0 on the equator
+METERS_PER_PIXEL_Z0 = 156543.03
+
+# Web map zoom levels accepted for ?zoom=
+MIN_ZOOM, MAX_ZOOM = 0, 22
+
+
+def project(coordinates):
+    """
+        (lat, lon) degrees -> (x, y) meters on a local equirectangular plane.
+        Accurate enough for the extent of a hike.
+    """
+    points = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    lat = np.radians(points[:, 0])
+    lon = np.radians(points[:, 1])
+    x = lon * math.cos(lat.mean()) * EARTH_RADIUS_M if len(points) else lon
+    y = lat * EARTH_RADIUS_M
+    return np.column_stack([x, y])
+
+
+def douglas_peucker(xy, tolerance):
+    """
+        Indices of the points kept by Douglas-Peucker. Recursion is replaced
+        by an explicit stack and each step measures all points of the span
+        against its segment in one NumPy operation.
+    """
+    count = len(xy)
+    if count < 3:
+        return np.arange(count)
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a = xy[start]
+        segment = xy[end] - a
+        offsets = xy[start + 1:end] - a
+        length_sq = segment @ segment
+        if length_sq == 0:
+            # Loop that comes back to where it started
+            nearest = offsets
+        else:
+            t = np.clip(offsets @ segment / length_sq, 0, 1)
+            nearest = offsets - np.outer(t, segment)
+        distances = np.hypot(nearest[:, 0], nearest[:, 1])
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return np.flatnonzero(keep)
+
+
+def simplify(coordinates, tolerance):
+    """Simplified list of (lat, lon) pairs for a tolerance in meters"""
+    if len(coordinates) < 3:
+        return list(coordinates)
+    indices = douglas_peucker(project(coordinates), tolerance)
+    return [coordinates[i] for i in indices]
+
+
+def build_levels(coordinates):
+    """
+        {tolerance: encoded polyline} for every level in LEVELS. Each level is
+        simplified from the previous, finer one, which is much smaller than
+        the full track; levels are 4x apart so the added error stays small.
+    """
+    xy = project(coordinates)
+    indices = np.arange(len(coordinates))
+    levels = {}
+    for tolerance in LEVELS:
+        indices = indices[douglas_peucker(xy[indices], tolerance)]
+        levels[str(tolerance)] = encode_polyline([coordinates[i] for i in indices],
+                                                 POLYLINE_PRECISION)
+    return levels
+
+
+def tolerance_for_zoom(zoom, latitude=0.0):
+    """Size of one map pixel in meters at a web map zoom level"""
+    return METERS_PER_PIXEL_Z0 * math.cos(math.radians(latitude)) / (2 ** zoom)
+
+
+def pick_level(tolerance):
+    """Coarsest stored level that is still within the tolerance, or None"""
+    fitting = [level for level in LEVELS if level <= tolerance]
+    return max(fitting) if fitting else None
+
+
+def level_coordinates(levels, level):
+    """Decoded (lat, lon) pairs of a stored level"""
+    return decode_polyline(levels[str(level)], POLYLINE_PRECISION)
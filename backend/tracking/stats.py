@@ -0,0 +1,217 @@
+"""
+Per-user hiking statistics. Totals, monthly totals, per-trail totals and
+personal records live in their own tables and are updated by
+record_completed_hike() each time a hike is completed, so the stats endpoint
+reads a handful of small rows instead of every hike the user has done.
+
+rebuild_hiker_stats() recomputes everything from the hikes with aggregate
+queries; it is used the first time a user's stats are needed, after a
+completed hike is edited or deleted, and by the rebuild_hiker_stats command.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DateField, F, FloatField, Max, Q, Sum
+from django.db.models.functions import Cast, TruncMonth
+from django.utils import timezone
+
+from .models import GPSTrack, Hike, HikerMonthStats, HikerStats, HikerTrailStats
+
+
+def hike_elevation_gain(hike):
+    """Elevation gain of a hike in feet, from its stopped tracks"""
+    gain = hike.gps_tracks.filter(ended_at__isnull=False).aggregate(
+        total=Sum("elevation_gain_ft"))["total"]
+    return gain or 0
+
+
+def hike_month(hike):
+    """First day of the month the hike started in (local time)"""
+    return timezone.localtime(hike.start_time).date().replace(day=1)
+
+
+def _pace(distance, duration):
+    """Minutes per mile, or None when it can't be measured"""
+    if not distance or not duration:
+        return None
+    return duration / float(distance)
+
+
+def _apply_records(stats, hike, distance, duration, elevation):
+    """Replace any personal record this hike beats"""
+    if distance and (stats.longest_distance_miles is None
+                     or distance > stats.longest_distance_miles):
+        stats.longest_hike = hike
+        stats.longest_distance_miles = distance
+
+    pace = _pace(distance, duration)
+    if pace is not None and (stats.fastest_pace_min_per_mile is None
+                             or pace < stats.fastest_pace_min_per_mile):
+        stats.fastest_hike = hike
+        stats.fastest_pace_min_per_mile = round(pace, 2)
+
+    if elevation and (stats.most_elevation_gain_ft is None
+                      or elevation > stats.most_elevation_gain_ft):
+        stats.most_elevation_hike = hike
+        stats.most_elevation_gain_ft = elevation
+
+
+def record_completed_hike(hike):
+    """Add a newly completed hike to its user's stats"""
+    distance = hike.distance_miles or Decimal("0")
+    duration = hike.duration_min or 0
+    elevation = hike_elevation_gain(hike)
+
+    with transaction.atomic():
+        # The stats row lock serialises completions of the same user
+        stats = HikerStats.objects.select_for_update().filter(user_id=hike.user_id).first()
+        if stats is None:
+            # First completion since stats existed, the rebuild includes this hike
+            rebuild_hiker_stats(hike.user_id)
+            return
+
+        stats.total_hikes += 1
+        stats.total_distance_miles += distance
+        stats.total_duration_min += duration
+        stats.total_elevation_gain_ft += elevation
+        _apply_records(stats, hike, distance, duration, elevation)
+        stats.save()
+
+        month, _ = HikerMonthStats.objects.get_or_create(user_id=hike.user_id,
+                                                         month=hike_month(hike))
+        HikerMonthStats.objects.filter(pk=month.pk).update(
+            hikes=F("hikes") + 1,
+            distance_miles=F("distance_miles") + distance,
+            duration_min=F("duration_min") + duration,
+            elevation_gain_ft=F("elevation_gain_ft") + elevation)
+
+        trail, _ = HikerTrailStats.objects.get_or_create(user_id=hike.user_id,
+                                                         trail_id=hike.trail_id)
+        trail.hikes += 1
+        trail.distance_miles += distance
+        trail.duration_min += duration
+        if trail.last_hiked_at is None or hike.start_time > trail.last_hiked_at:
+            trail.last_hiked_at = hike.start_time
+        trail.save()
+
+
+def rebuild_hiker_stats(user_id):
+    """Recompute all of a user's stats from their completed hikes"""
+    completed = Hike.objects.filter(user_id=user_id, completed=True).order_by()
+    stopped_tracks = GPSTrack.objects.filter(hike__user_id=user_id, hike__completed=True,
+                                             ended_at__isnull=False).order_by()
+
+    with transaction.atomic():
+        HikerStats.objects.get_or_create(user_id=user_id)
+        stats = HikerStats.objects.select_for_update().get(user_id=user_id)
+
+        totals = completed.aggregate(hikes=Count("pk"), distance=Sum("distance_miles"),
+                                     duration=Sum("duration_min"))
+        stats.total_hikes = totals["hikes"]
+        stats.total_distance_miles = totals["distance"] or 0
+        stats.total_duration_min = totals["duration"] or 0
+        stats.total_elevation_gain_ft = stopped_tracks.aggregate(
+            total=Sum("elevation_gain_ft"))["total"] or 0
+
+        longest = (completed.filter(distance_miles__gt=0)
+                   .order_by("-distance_miles", "start_time").first())
+        stats.longest_hike = longest
+        stats.longest_distance_miles = longest.distance_miles if longest else None
+
+        fastest = (completed.filter(distance_miles__gt=0, duration_min__gt=0)
+                   .annotate(pace=Cast("duration_min", FloatField())
+                             / Cast("distance_miles", FloatField()))
+                   .order_by("pace", "start_time").first())
+        stats.fastest_hike = fastest
+        stats.fastest_pace_min_per_mile = round(fastest.pace, 2) if fastest else None
+
+        climb = (completed.annotate(elevation=Sum("gps_tracks__elevation_gain_ft",
+                                                  filter=Q(gps_tracks__ended_at__isnull=False)))
+                 .filter(elevation__gt=0).order_by("-elevation", "start_time").first())
+        stats.most_elevation_hike = climb
+        stats.most_elevation_gain_ft = climb.elevation if climb else None
+        stats.save()
+
+        month_elevation = dict(
+            stopped_tracks.annotate(month=TruncMonth("hike__start_time", output_field=DateField()))
+            .values("month").annotate(total=Sum("elevation_gain_ft"))
+            .values_list("month", "total"))
+        months = (completed.annotate(month=TruncMonth("start_time", output_field=DateField()))
+                  .values("month")
+                  .annotate(hikes=Count("pk"), distance=Sum("distance_miles"),
+                            duration=Sum("duration_min")))
+        HikerMonthStats.objects.filter(user_id=user_id).delete()
+        HikerMonthStats.objects.bulk_create(
+            HikerMonthStats(user_id=user_id, month=row["month"], hikes=row["hikes"],
+                            distance_miles=row["distance"] or 0,
+                            duration_min=row["duration"] or 0,
+                            elevation_gain_ft=month_elevation.get(row["month"]) or 0)
+            for row in months)
+
+        trails = (completed.values("trail_id")
+                  .annotate(hikes=Count("pk"), distance=Sum("distance_miles"),
+                            duration=Sum("duration_min"), last=Max("start_time")))
+        HikerTrailStats.objects.filter(user_id=user_id).delete()
+        HikerTrailStats.objects.bulk_create(
+            HikerTrailStats(user_id=user_id, trail_id=row["trail_id"], hikes=row["hikes"],
+                            distance_miles=row["distance"] or 0,
+                            duration_min=row["duration"] or 0, last_hiked_at=row["last"])
+            for row in trails)
+
+    return stats
+
+
+def get_hiker_stats(user_id):
+    """The user's stats row, built from their hikes the first time"""
+    stats = HikerStats.objects.filter(user_id=user_id).first()
+    return stats or rebuild_hiker_stats(user_id)
+
+
+def _period(hikes, distance, duration, elevation):
+    return {"hikes": hikes,
+            "distance_miles": distance,
+            "duration_hours": round(duration / 60, 2),
+            "elevation_gain_ft": elevation}
+
+
+def build_stats_response(user_id):
+    """Stats endpoint payload: totals, records and breakdowns"""
+    stats = get_hiker_stats(user_id)
+
+    by_month, years = [], defaultdict(lambda: [0, Decimal("0"), 0, 0])
+    for row in HikerMonthStats.objects.filter(user_id=user_id):
+        by_month.append({"month": f"{row.month:%Y-%m}",
+                         **_period(row.hikes, row.distance_miles, row.duration_min,
+                                   row.elevation_gain_ft)})
+        year = years[row.month.year]
+        year[0] += row.hikes
+        year[1] += row.distance_miles
+        year[2] += row.duration_min
+        year[3] += row.elevation_gain_ft
+
+    by_trail = [{"trail": row.trail_id, "trail_name": row.trail.name, "hikes": row.hikes,
+                 "distance_miles": row.distance_miles,
+                 "duration_hours": round(row.duration_min / 60, 2),
+                 "last_hiked_at": row.last_hiked_at}
+                for row in (HikerTrailStats.objects.filter(user_id=user_id)
+                            .select_related("trail").order_by("-hikes", "trail__name"))]
+
+    return {
+        "total_hikes": stats.total_hikes,
+        "total_distance_miles": stats.total_distance_miles,
+        "total_duration_hours": round(stats.total_duration_min / 60, 2),
+        "total_elevation_gain_ft": stats.total_elevation_gain_ft,
+        "records": {
+            "longest": {"hike": stats.longest_hike_id,
+                        "distance_miles": stats.longest_distance_miles},
+            "fastest": {"hike": stats.fastest_hike_id,
+                        "pace_min_per_mile": stats.fastest_pace_min_per_mile},
+            "most_elevation": {"hike": stats.most_elevation_hike_id,
+                               "elevation_gain_ft": stats.most_elevation_gain_ft},
+        },
+        "by_year": [{"year": year, **_period(*values)} for year, values in sorted(years.items())],
+        "by_month": by_month,
+        "by_trail": by_trail,
+    }
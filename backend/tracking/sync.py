@@ -0,0 +1,205 @@
+"""
+Offline-first sync. A phone that lost signal keeps recording hikes, tracks
+and points with IDs it generates itself (client_id UUIDs), then uploads all
+of it in one request to POST /api/tracking/sync/ (optionally gzipped). The
+response maps its client IDs to server IDs and carries every hike and track
+the server changed since the phone's last sync token, plus deletions.
+
+Retries are safe: hikes and tracks are looked up by client_id, and points
+whose point_order is already stored are skipped (see ingest.store_points).
+
+Conflicts are resolved per field group:
+    hike fields     last writer wins, by the phone's modified_at against the
+                    server's updated_at
+    completion      final; a completed hike stays completed
+    track end       the first stop wins; points for a track the server has
+                    already stopped are rejected and reported
+"""
+
+from datetime import datetime, timedelta
+
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .ingest import store_points, TrackStoppedError
+from .lifecycle import complete_hike, stop_track
+from .models import Hike, GPSTrack, GPSPoint, SyncTombstone
+from .stats import rebuild_hiker_stats
+
+
+SYNC_TOKEN_SALT = "tracking.sync"
+# Rows written by transactions that were still open when a token was issued
+# can carry a slightly older updated_at; re-send that window every time
+SYNC_OVERLAP = timedelta(seconds=5)
+# Tombstones are kept this long; older tokens get a full snapshot instead
+TOMBSTONE_RETENTION = timedelta(days=90)
+
+# Hike fields the phone may change. trail and start_time only until the hike
+# is completed and counted in the stats
+HIKE_FIELDS = ["trail", "start_time", "end_time", "distance_miles", "notes",
+               "weather_conditions"]
+COMPLETED_HIKE_FIELDS = ["end_time", "distance_miles", "notes", "weather_conditions"]
+
+
+class SyncError(ValueError):
+    """Raised for a sync request that can't be applied"""
+
+
+def make_token(at):
+    return signing.dumps(at.isoformat(), salt=SYNC_TOKEN_SALT, compress=True)
+
+
+def read_token(token):
+    """Time of the sync a token was issued by, None for a first sync"""
+    if not token:
+        return None
+    try:
+        return datetime.fromisoformat(signing.loads(token, salt=SYNC_TOKEN_SALT))
+    except (signing.BadSignature, ValueError):
+        raise SyncError("Invalid sync_token, sync again without one")
+
+
+def _get_or_create(model, user, client_id, **fields):
+    """Row with this client_id, created if new (safe against a concurrent retry)"""
+    try:
+        with transaction.atomic():
+            return model.objects.create(user=user, client_id=client_id, **fields), True
+    except IntegrityError:
+        return model.objects.get(user=user, client_id=client_id), False
+
+
+def _sync_hikes(user, items, result):
+    """Create or update hikes, returns ({client_id: hike}, [completions])"""
+    existing = {hike.client_id: hike for hike in
+                Hike.objects.filter(user=user, client_id__in=[item["client_id"] for item in items])}
+    hikes, completions, edited_completed = {}, [], False
+
+    for item in items:
+        client_id = item["client_id"]
+        hike = existing.get(client_id)
+        if hike is None:
+            hike, created = _get_or_create(Hike, user, client_id, **{
+                field: item[field] for field in HIKE_FIELDS if field in item})
+        else:
+            created = False
+
+        if not created:
+            fields = COMPLETED_HIKE_FIELDS if hike.completed else HIKE_FIELDS
+            changed = [field for field in fields
+                       if field in item and getattr(hike, field) != item[field]]
+            phone_newer = item.get("modified_at") and item["modified_at"] > hike.updated_at
+            if changed and phone_newer:
+                for field in changed:
+                    setattr(hike, field, item[field])
+                hike.save()
+                edited_completed |= hike.completed
+            elif changed:
+                result["conflicts"].append({"type": "hike", "client_id": client_id,
+                                            "hike_id": hike.pk, "fields": changed,
+                                            "resolution": "server"})
+
+        if item.get("completed") and not hike.completed:
+            completions.append((hike.pk, {field: item[field] for field in COMPLETED_HIKE_FIELDS
+                                          if field in item}))
+        hikes[client_id] = hike
+        result["ids"]["hikes"][str(client_id)] = hike.pk
+
+    if edited_completed:
+        # Edits to counted hikes can change any total or record
+        rebuild_hiker_stats(user.pk)
+    return hikes, completions
+
+
+def _resolve_hikes(user, items, hikes):
+    """{client_id or hike_id: hike} for every hike the tracks refer to"""
+    resolved = dict(hikes)
+    missing = {item["hike"] for item in items if item.get("hike") and item["hike"] not in hikes}
+    resolved.update({hike.client_id: hike for hike in
+                     Hike.objects.filter(user=user, client_id__in=missing)})
+    hike_ids = {item["hike_id"] for item in items if not item.get("hike")}
+    resolved.update({hike.pk: hike for hike in Hike.objects.filter(user=user, pk__in=hike_ids)})
+    return resolved
+
+
+def _store_track_points(track, points, result):
+    try:
+        created = store_points(track.pk, points)
+    except TrackStoppedError:
+        # Stopped by another device, or this is a retry of a finished sync
+        orders = {point["point_order"] for point in points}
+        stored = (len(orders) if track.archived_at else
+                  GPSPoint.objects.filter(track=track, point_order__in=orders).count())
+        result["points"]["skipped"] += len(points)
+        if stored < len(orders):
+            result["conflicts"].append({"type": "track", "client_id": track.client_id,
+                                        "track_id": track.pk, "rejected_points": len(orders) - stored,
+                                        "resolution": "server"})
+        return
+    result["points"]["created"] += created
+    result["points"]["skipped"] += len(points) - created
+
+
+def _sync_tracks(user, items, hikes, result):
+    """Create tracks and store their points, returns [(track_id, ended_at)] to stop"""
+    hikes = _resolve_hikes(user, items, hikes)
+    existing = {track.client_id: track for track in
+                GPSTrack.objects.filter(user=user, client_id__in=[item["client_id"] for item in items])
+                .defer(*GPSTrack.BLOB_FIELDS)}
+    stops = []
+
+    for item in items:
+        client_id = item["client_id"]
+        track = existing.get(client_id)
+        if track is None:
+            hike = hikes.get(item.get("hike") or item.get("hike_id"))
+            if hike is None:
+                result["errors"].append({"type": "track", "client_id": client_id,
+                                         "error": "Unknown hike."})
+                continue
+            track, _ = _get_or_create(GPSTrack, user, client_id, hike=hike,
+                                      started_at=item["started_at"])
+        result["ids"]["tracks"][str(client_id)] = track.pk
+
+        if item.get("points"):
+            _store_track_points(track, item["points"], result)
+        if item.get("ended_at") and not track.ended_at:
+            stops.append((track.pk, item["ended_at"]))
+    return stops
+
+
+def changes_since(user, since):
+    """
+        (full, hikes, tracks, tombstones) changed since a sync token's time.
+        full means the phone should replace its copy with hikes and tracks.
+    """
+    full = since is None or since < timezone.now() - TOMBSTONE_RETENTION
+    hikes = Hike.objects.filter(user=user).order_by("updated_at")
+    tracks = GPSTrack.objects.filter(user=user).defer(*GPSTrack.BLOB_FIELDS).order_by("updated_at")
+    if full:
+        return True, hikes, tracks, SyncTombstone.objects.none()
+    cutoff = since - SYNC_OVERLAP
+    return (False, hikes.filter(updated_at__gt=cutoff), tracks.filter(updated_at__gt=cutoff),
+            SyncTombstone.objects.filter(user=user, deleted_at__gt=cutoff))
+
+
+def apply_sync(user, data):
+    """
+        Apply a validated SyncSerializer payload. Returns the results and the
+        (full, hikes, tracks, tombstones) delta for the phone.
+    """
+    since = read_token(data.get("sync_token"))
+    result = {"ids": {"hikes": {}, "tracks": {}}, "points": {"created": 0, "skipped": 0},
+              "conflicts": [], "errors": []}
+
+    with transaction.atomic():
+        hikes, completions = _sync_hikes(user, data.get("hikes", []), result)
+    stops = _sync_tracks(user, data.get("tracks", []), hikes, result)
+    # Tracks first, so completed hikes get their measured distance and match
+    for track_id, ended_at in stops:
+        stop_track(track_id, ended_at)
+    for hike_id, changes in completions:
+        complete_hike(hike_id, changes)
+
+    result["sync_token"] = make_token(timezone.now())
+    return result, changes_since(user, since)
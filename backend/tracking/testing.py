@@ -0,0 +1,52 @@
+"""
+Fixtures shared by the tracking and trails tests: a hiker, a park and a
+trail to hike on, and tracks on new hikes of it.
+"""
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from trails.models import Park, Trail
+from .models import Hike, GPSTrack
+
+
+def create_hiker(username="hiker"):
+    return get_user_model().objects.create_user(username=username,
+                                                email=f"{username}@example.com", password="pass")
+
+
+def create_park(code="test", name="Test Park"):
+    return Park.objects.create(nps_park_code=code, park_name=name, state="WA",
+                               region="Pacific West")
+
+
+def create_trail(park, name="Test Trail", miles=5, **fields):
+    return Trail.objects.create(park=park, name=name, location="Test",
+                                decimal_length_miles=miles, **fields)
+
+
+def create_track(user, trail, start=None, hike_fields=None, **fields):
+    """Track on a new hike of the trail, both starting at start (default now)"""
+    start = start or timezone.now()
+    hike = Hike.objects.create(user=user, trail=trail, start_time=start, **(hike_fields or {}))
+    return GPSTrack.objects.create(hike=hike, user=user, started_at=start, **fields)
+
+
+class HikerTestMixin:
+    """
+        cls.user ("hiker") with cls.park and cls.trail to hike on, and
+        self.client logged in as the user. For TestCase classes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = create_hiker()
+        cls.park = create_park()
+        cls.trail = create_trail(cls.park)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
@@ -1,3 +1,1173 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import struct
+import tempfile
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from trails.models import TrailFeature
+from .analytics import compute_track_stats, elevation_change, haversine_m, pace_splits
+from .archive import archive_due, archive_track, restore_track
+from .buffer import buffered_track_ids, flush_due
+from .encoding import (MAGIC, VERSION, TrackEncodingError, decode_points, decode_polyline,
+                       encode_points)
+from .heatmap import (MIN_USERS, read_tile, render_tile, track_pixels, update_tiles,
+                      world_pixels)
+from .ingest import store_points
+from .models import Hike, GPSTrack, GPSPoint
+from .partitions import create_month_partitions, next_month, partition_name
+from .routing import websocket_urlpatterns
+from .testing import HikerTestMixin, create_hiker, create_park, create_trail, create_track
+from .trackfiles import FIT_EPOCH, SEMICIRCLES_TO_DEGREES, export_gpx
+
+
+class ListQueryCountTests(HikerTestMixin, TestCase):
+    """
+        The list endpoints must run the same number of queries no matter how
+        many hikes, tracks and points there are.
+    """
+
+    def add_hikes(self, count, tracks_per_hike=2, points_per_track=20):
+        start = timezone.now()
+        for _ in range(count):
+            hike = Hike.objects.create(user=self.user, trail=self.trail, start_time=start)
+            for _ in range(tracks_per_hike):
+                track = GPSTrack.objects.create(hike=hike, user=self.user, started_at=start,
+                                                point_count=points_per_track)
+                GPSPoint.objects.bulk_create(
+                    GPSPoint(track=track, latitude=45 + i * 0.0001, longitude=-120,
+                             recorded_at=start + timedelta(seconds=i), point_order=i)
+                    for i in range(points_per_track))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_hike_list_queries_do_not_grow(self):
+        self.add_hikes(2)
+        small, _ = self.count_queries("/api/tracking/hikes/")
+        self.add_hikes(20)
+        large, response = self.count_queries("/api/tracking/hikes/")
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data), 22)
+        self.assertTrue(all(hike["track_count"] == 2 for hike in response.data))
+
+    def test_track_list_queries_do_not_grow(self):
+        self.add_hikes(2)
+        small, _ = self.count_queries("/api/tracking/tracks/")
+        self.add_hikes(20, points_per_track=200)
+        large, response = self.count_queries("/api/tracking/tracks/")
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data), 44)
+        self.assertEqual(sum(track["point_count"] == 200 for track in response.data), 40)
+
+    def test_track_list_does_not_load_points(self):
+        self.add_hikes(1)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get("/api/tracking/tracks/")
+        point_table = GPSPoint._meta.db_table
+        self.assertFalse(any(point_table in query["sql"] for query in context.captured_queries))
+
+    def test_lists_do_not_load_packed_points(self):
+        self.add_hikes(1)
+        hike = Hike.objects.latest("hike_id")
+        requests = [(self.client.get, "/api/tracking/tracks/"),
+                    (self.client.get, f"/api/tracking/hikes/{hike.pk}/"),
+                    (self.client.post, "/api/tracking/sync/")]
+        for send, url in requests:
+            with CaptureQueriesContext(connection) as context:
+                response = send(url, {}, format="json")
+            self.assertEqual(response.status_code, 200)
+            for name in GPSTrack.BLOB_FIELDS:
+                self.assertFalse(any(name in query["sql"] for query in context.captured_queries),
+                                 f"{url} selects {name}")
+
+    def test_hike_detail_queries_do_not_grow_with_tracks(self):
+        self.add_hikes(1, tracks_per_hike=2)
+        hike = Hike.objects.latest("hike_id")
+        small, _ = self.count_queries(f"/api/tracking/hikes/{hike.pk}/")
+        self.add_hikes(1, tracks_per_hike=10)
+        hike = Hike.objects.latest("hike_id")
+        large, response = self.count_queries(f"/api/tracking/hikes/{hike.pk}/")
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data["gps_tracks"]), 10)
+
+
+class BatchPointTests(HikerTestMixin, TestCase):
+    """A batch resent after a timeout doesn't store its points twice"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.track = create_track(cls.user, cls.trail)
+
+    def send(self, orders):
+        start = self.track.started_at
+        points = [{"latitude": f"{45 + i * 0.00001:.7f}", "longitude": "-120.0000000",
+                   "recorded_at": (start + timedelta(seconds=i)).isoformat(), "point_order": i}
+                  for i in orders]
+        response = self.client.post(f"/api/tracking/tracks/{self.track.pk}/add_track_points/",
+                                    {"points": points}, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def test_resent_batch_is_skipped(self):
+        self.assertEqual(self.send(range(10)), {"created": 10, "skipped": 0})
+        self.assertEqual(self.send(range(10)), {"created": 0, "skipped": 10})
+        # Overlapping batch, with a point_order repeated inside it
+        self.assertEqual(self.send([8, 9, 10, 11, 11]), {"created": 2, "skipped": 3})
+
+        self.assertEqual(GPSPoint.objects.filter(track=self.track).count(), 12)
+        self.track.refresh_from_db()
+        self.assertEqual((self.track.point_count, self.track.last_point_order), (12, 11))
+
+    def test_point_order_with_another_time_is_skipped(self):
+        point = {"latitude": Decimal("45.0000000"), "longitude": Decimal("-120.0000000"),
+                 "recorded_at": self.track.started_at, "point_order": 0}
+        self.assertEqual(store_points(self.track.pk, [point]), 1)
+        later = {**point, "recorded_at": point["recorded_at"] + timedelta(seconds=5)}
+        self.assertEqual(store_points(self.track.pk, [later]), 0)
+
+    @skipIf(connection.vendor == "postgresql", "The constraint includes recorded_at there")
+    def test_database_rejects_a_repeated_point_order(self):
+        point = {"latitude": Decimal("45.0000000"), "longitude": Decimal("-120.0000000"),
+                 "point_order": 0}
+        GPSPoint.objects.create(track=self.track, recorded_at=self.track.started_at, **point)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            GPSPoint.objects.create(track=self.track, 
+                                    recorded_at=self.track.started_at + timedelta(seconds=5),
+                                    **point)
+
+
+class EncodingTests(TestCase):
+    """Packed tracks decode to exactly what was stored, or fail cleanly"""
+
+    def setUp(self):
+        start = timezone.now().replace(microsecond=123456)
+        self.points = [{"point_order": i, "recorded_at": start + timedelta(seconds=i),
+                        "latitude": Decimal("45.1234567") + Decimal(i).scaleb(-7),
+                        "longitude": Decimal("-121.7654321"),
+                        "altitude_feet": None if i % 3 else Decimal("5123.45"),
+                        "accuracy_feet": Decimal("12.50"), "speed_mps": None}
+                       for i in range(50)]
+
+    def test_round_trip(self):
+        self.assertEqual(decode_points(encode_points(self.points)), self.points)
+        self.assertEqual(decode_points(encode_points([])), [])
+
+    def test_truncated_data(self):
+        data = zlib.decompress(encode_points(self.points))
+        for end in range(len(data)):
+            with self.assertRaises(TrackEncodingError):
+                decode_points(zlib.compress(data[:end]))
+        with self.assertRaises(TrackEncodingError):
+            decode_points(encode_points(self.points)[:-4])
+        with self.assertRaises(TrackEncodingError):
+            decode_points(zlib.compress(data + b"\x00"))
+
+    def test_point_count_larger_than_data(self):
+        with self.assertRaises(TrackEncodingError):
+            decode_points(zlib.compress(MAGIC + bytes([VERSION]) + b"\xff\xff\xff\x7f"))
+
+    def test_unknown_version(self):
+        data = zlib.decompress(encode_points(self.points))
+        with self.assertRaises(TrackEncodingError):
+            decode_points(zlib.compress(MAGIC + bytes([VERSION + 1]) + data[3:]))
+
+
+class TrackFormatTests(HikerTestMixin, TestCase):
+    """?format=polyline and ?format=geojson give the track geometry only"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.track = create_track(cls.user, cls.trail)
+        GPSPoint.objects.bulk_create(
+            GPSPoint(track=cls.track, latitude=45 + i * 0.001, longitude=-120 - i * 0.001,
+                     recorded_at=cls.track.started_at + timedelta(seconds=i), point_order=i)
+            for i in range(5))
+
+    def setUp(self):
+        super().setUp()
+        self.url = f"/api/tracking/tracks/{self.track.pk}/"
+
+    def test_polyline(self):
+        response = self.client.get(self.url, {"format": "polyline"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["point_count"], 5)
+        self.assertEqual(decode_polyline(response.data["polyline"])[-1], (45.004, -120.004))
+
+    def test_geojson(self):
+        response = self.client.get(self.url, {"format": "geojson"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/geo+json")
+        feature = json.loads(response.content)
+        self.assertEqual(feature["geometry"]["type"], "LineString")
+        self.assertEqual(feature["geometry"]["coordinates"][0], [-120.0, 45.0])
+
+    def test_zoom_and_tolerance_are_validated(self):
+        for params in ({"zoom": 2000}, {"zoom": -1}, {"zoom": "1.5"}, {"zoom": "far"},
+                       {"tolerance": -5}, {"tolerance": "nan"}, {"tolerance": "inf"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+        response = self.client.get(self.url, {"zoom": 22, "format": "polyline"})
+        self.assertEqual((response.status_code, response.data["point_count"]), (200, 5))
+
+    def test_other_actions_have_no_geometry_formats(self):
+        for url in ("/api/tracking/tracks/", f"{self.url}elevation_profile/"):
+            for fmt in ("polyline", "geojson"):
+                self.assertEqual(self.client.get(url, {"format": fmt}).status_code, 404)
+        self.assertEqual(self.client.get("/api/tracking/tracks/").status_code, 200)
+
+
+class AnalyticsTests(TestCase):
+    """Track statistics from point arrays"""
+
+    def line(self, count, step_deg=0.000009, stop_at=None, stop_sec=0):
+        """Due north at about 1 m/s, optionally standing still for stop_sec at a point"""
+        times = np.arange(count, dtype=float)
+        if stop_at is not None:
+            times[stop_at:] += stop_sec
+        return {"latitude": 45 + np.arange(count) * step_deg, "longitude": np.full(count, -120.0),
+                "altitude_feet": np.full(count, np.nan), "time": times}
+
+    def test_haversine(self):
+        distances = haversine_m(np.array([45.0, 46.0, 46.0]), np.array([-120.0, -120.0, -120.0]))
+        self.assertAlmostEqual(distances[0], 111195, delta=1)
+        self.assertEqual(distances[1], 0)
+
+    def test_elevation_change_ignores_jitter(self):
+        self.assertEqual(elevation_change(np.array([1000, 1004, 997, 1003, 1001.0])), (0, 0))
+        climb = np.array([1000, 1004, 997, np.nan, 1100, 1095, 1102, 1000.0])
+        self.assertEqual(elevation_change(climb), (102, 102))
+        self.assertEqual(elevation_change(np.array([np.nan, 1000.0])), (0, 0))
+
+    def test_pace_splits(self):
+        miles = np.array([0, 1, 2, 2.5])
+        self.assertEqual(pace_splits(miles, np.array([0, 900, 1900, 2400.0])), [900, 1000])
+        self.assertEqual(pace_splits(np.array([0, 0.5]), np.array([0, 600.0])), [])
+
+    def test_track_stats(self):
+        stats = compute_track_stats(self.line(1001, stop_at=500, stop_sec=120))
+        self.assertAlmostEqual(stats["distance_m"], 1000, delta=2)
+        self.assertEqual((stats["moving_time_sec"], stats["stopped_time_sec"]), (999, 121))
+        self.assertAlmostEqual(stats["max_speed_mps"], 1, delta=0.01)
+        self.assertEqual(stats["bounding_box"][::2], (45.0, 45.009))
+
+    def test_short_tracks(self):
+        self.assertEqual(compute_track_stats(self.line(0))["bounding_box"], None)
+        single = compute_track_stats(self.line(1))
+        self.assertEqual((single["point_count"], single["distance_m"]), (1, 0))
+        self.assertEqual(single["bounding_box"], (45.0, -120.0, 45.0, -120.0))
+
+
+class RunningStatsTests(HikerTestMixin, TestCase):
+    """Running stats match the final ones and follow deleted points"""
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(hours=1)
+        self.track = create_track(self.user, self.trail, start)
+        # 1 m/s due north, climbing 20 ft then dropping 30 ft
+        points = [{"latitude": f"{45 + i * 0.000009:.7f}", "longitude": "-120.0000000",
+                   "altitude_feet": f"{1000 + min(i, 80 - i) * 0.5:.2f}",
+                   "recorded_at": (start + timedelta(seconds=i)).isoformat(), "point_order": i}
+                  for i in range(101)]
+        response = self.client.post(f"/api/tracking/tracks/{self.track.pk}/add_track_points/",
+                                    {"points": points}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.track.refresh_from_db()
+
+    def test_running_stats_match_final_stats(self):
+        running = (self.track.point_count, self.track.distance_m,
+                   self.track.elevation_gain_ft, self.track.elevation_loss_ft)
+        stats = self.track.compute_stats(save=False)
+        self.assertEqual(running[0], stats["point_count"])
+        self.assertAlmostEqual(running[1], stats["distance_m"], delta=0.01)
+        self.assertEqual(running[2:], (20, 30))
+        # stop() smooths the altitudes first, which trims the peak a little
+        self.assertAlmostEqual(running[2], stats["elevation_gain_ft"], delta=2)
+        self.assertAlmostEqual(running[3], stats["elevation_loss_ft"], delta=2)
+
+    def delete_last_point(self):
+        point = self.track.gps_points.order_by("point_order").last()
+        response = self.client.delete(f"/api/tracking/points/{point.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.track.refresh_from_db()
+
+    def test_delete_point_while_recording(self):
+        self.delete_last_point()
+        self.assertEqual((self.track.point_count, self.track.last_point_order), (100, 99))
+        self.assertAlmostEqual(self.track.distance_m, 99 * 1.0008, delta=0.5)
+        self.assertEqual(self.track.max_latitude, Decimal("45.0008910"))
+
+    def test_delete_point_after_stop(self):
+        self.client.post(f"/api/tracking/tracks/{self.track.pk}/stop/")
+        self.delete_last_point()
+        self.assertEqual(self.track.point_count, 100)
+        self.assertAlmostEqual(self.track.distance_m, 99 * 1.0008, delta=0.5)
+        self.assertEqual(len(decode_points(self.track.filtered_points)), 100)
+
+
+class HikerStatsTests(HikerTestMixin, TestCase):
+    """Stats are recounted when a hike leaves or joins the completed set"""
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(days=1)
+        self.track = create_track(self.user, self.trail, start,
+                                  hike_fields={"end_time": start + timedelta(hours=2),
+                                               "duration_min": 120, "distance_miles": 5,
+                                               "completed": True},
+                                  ended_at=start + timedelta(hours=2), elevation_gain_ft=800)
+        self.hike = self.track.hike
+
+    def stats(self):
+        data = self.client.get("/api/tracking/hikes/stats/").data
+        return data["total_hikes"], data["total_elevation_gain_ft"]
+
+    def test_uncompleting_and_completing(self):
+        self.assertEqual(self.stats(), (1, 800))
+        url = f"/api/tracking/hikes/{self.hike.pk}/"
+        self.assertEqual(self.client.patch(url, {"completed": False}).status_code, 200)
+        self.assertEqual(self.stats(), (0, 0))
+        self.client.patch(url, {"completed": True})
+        self.assertEqual(self.stats(), (1, 800))
+
+    def test_deletes(self):
+        self.assertEqual(self.stats(), (1, 800))
+        self.client.delete(f"/api/tracking/tracks/{self.track.pk}/")
+        self.assertEqual(self.stats(), (1, 0))
+        self.client.delete(f"/api/tracking/hikes/{self.hike.pk}/")
+        self.assertEqual(self.stats(), (0, 0))
+
+
+class PointBufferTests(HikerTestMixin, TestCase):
+    """Spooled points are stored in batches and always before the track stops"""
+
+    def setUp(self):
+        super().setUp()
+        buffer_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(buffer_dir.cleanup)
+        settings_override = override_settings(GPS_POINT_BUFFER_DIR=buffer_dir.name,
+                                              GPS_POINT_BUFFER_FLUSH_BYTES=8000)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        start = timezone.now() - timedelta(hours=1)
+        self.track = create_track(self.user, self.trail, start)
+        self.url = f"/api/tracking/tracks/{self.track.pk}/"
+
+    def send(self, orders):
+        start = self.track.started_at
+        points = [{"latitude": f"{45 + i * 0.00001:.7f}", "longitude": "-120.0000000",
+                   "altitude_feet": "1000.00",
+                   "recorded_at": (start + timedelta(seconds=i)).isoformat(), "point_order": i}
+                  for i in orders]
+        return self.client.post(f"{self.url}add_track_points/", {"points": points}, format="json")
+
+    def stored(self):
+        return GPSPoint.objects.filter(track=self.track).count()
+
+    def later(self):
+        """Clock of the buffer a minute from now, when queued points are due"""
+        return mock.patch("tracking.buffer.time.time", return_value=time.time() + 60)
+
+    def test_points_are_queued_then_flushed(self):
+        response = self.send(range(10))
+        self.assertEqual((response.status_code, response.data), (202, {"queued": 10}))
+        # Only the track lookup, the points go to the spool
+        with self.assertNumQueries(1):
+            self.send(range(5, 20))
+        self.assertEqual(self.stored(), 0)
+        self.assertEqual(buffered_track_ids(), [self.track.pk])
+
+        # Not due yet, then due once the oldest points are old enough
+        self.assertEqual(flush_due(), 0)
+        with self.later():
+            self.assertEqual(flush_due(), 20)
+        self.assertEqual(self.stored(), 20)
+        self.assertEqual(buffered_track_ids(), [])
+        self.track.refresh_from_db()
+        self.assertEqual((self.track.point_count, self.track.last_point_order), (20, 19))
+
+    def test_flushed_once_enough_points_are_queued(self):
+        self.send(range(30))
+        self.assertEqual(self.stored(), 0)
+        self.send(range(30, 60))
+        self.assertEqual(self.stored(), 60)
+        self.assertEqual(buffered_track_ids(), [])
+
+    def test_failed_flush_still_accepts_the_points(self):
+        self.send(range(30))
+        with mock.patch("tracking.buffer.store_points", side_effect=DatabaseError("down")), \
+                self.assertLogs("tracking.buffer", "ERROR"):
+            response = self.send(range(30, 60))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.stored(), 0)
+
+        # The batch is picked up again
+        self.assertEqual(flush_due(), 60)
+
+    def test_stop_drains_the_buffer(self):
+        self.send(range(10))
+        response = self.client.post(f"{self.url}stop/")
+        self.assertEqual(response.data["point_count"], 10)
+        self.assertEqual(self.stored(), 10)
+
+        response = self.send(range(10, 20))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(buffered_track_ids(), [])
+
+    def test_deleted_track_drops_its_points(self):
+        self.send(range(10))
+        self.track.delete()
+        with self.assertLogs("tracking.buffer", "WARNING"):
+            self.assertEqual(flush_due(force=True), 0)
+        self.assertEqual(buffered_track_ids(), [])
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class LiveTrackTests(TransactionTestCase):
+    """Points are written per connection and acked once they are stored"""
+
+    def setUp(self):
+        self.user, self.stranger = create_hiker(), create_hiker("stranger")
+        trail = create_trail(create_park())
+        self.track = create_track(self.user, trail, timezone.now() - timedelta(hours=1))
+
+    def points(self, orders):
+        start = self.track.started_at
+        return [{"latitude": f"{45 + i * 0.00001:.7f}", "longitude": "-120.0000000",
+                 "recorded_at": (start + timedelta(seconds=i)).isoformat(), "point_order": i}
+                for i in orders]
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns),
+                                             f"/ws/tracking/tracks/{self.track.pk}/")
+        communicator.scope["user"] = user
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    def stop(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(f"/api/tracking/tracks/{self.track.pk}/stop/").data
+
+    def stored(self):
+        return GPSPoint.objects.filter(track=self.track).acount()
+
+    async def test_points_are_acked_once_written(self):
+        socket, connected, _ = await self.connect(self.user)
+        self.assertTrue(connected)
+        await socket.send_json_to({"type": "points", "points": self.points(range(10))})
+        await socket.send_json_to({"type": "points", "points": self.points(range(10, 15))})
+        self.assertTrue(await socket.receive_nothing())
+        self.assertEqual(await self.stored(), 0)
+
+        await socket.send_json_to({"type": "flush"})
+        self.assertEqual(await socket.receive_json_from(), {"type": "ack", "received": 15})
+        self.assertEqual(await socket.receive_json_from(), {"type": "flushed", "created": 15})
+        self.assertEqual(await self.stored(), 15)
+
+        # Stopped from another connection while the socket is still open
+        track = await sync_to_async(self.stop)()
+        self.assertEqual(track["point_count"], 15)
+        self.assertEqual(await socket.receive_json_from(),
+                         {"type": "stopped", "track": self.track.pk})
+        await socket.send_json_to({"type": "points", "points": self.points(range(15, 20))})
+        self.assertEqual((await socket.receive_json_from())["type"], "error")
+        await socket.disconnect()
+        self.assertEqual(await self.stored(), 15)
+
+    async def test_written_on_a_timer_and_on_close(self):
+        with mock.patch("tracking.consumers.FLUSH_INTERVAL_SEC", 0.1):
+            socket, _, _ = await self.connect(self.user)
+            await socket.send_json_to({"type": "points", "points": self.points(range(5))})
+            self.assertEqual(await socket.receive_json_from(), {"type": "ack", "received": 5})
+        self.assertEqual(await self.stored(), 5)
+
+        await socket.send_json_to({"type": "points", "points": self.points(range(5, 8))})
+        await socket.disconnect()
+        self.assertEqual(await self.stored(), 8)
+
+    async def test_failed_write_keeps_points(self):
+        socket, _, _ = await self.connect(self.user)
+        await socket.send_json_to({"type": "points", "points": self.points(range(5))})
+        with mock.patch("tracking.consumers.store_points", side_effect=DatabaseError("down")), \
+                self.assertLogs("tracking.consumers", "ERROR"):
+            await socket.send_json_to({"type": "flush"})
+            self.assertEqual((await socket.receive_json_from())["type"], "error")
+        self.assertEqual(await self.stored(), 0)
+
+        await socket.send_json_to({"type": "flush"})
+        self.assertEqual(await socket.receive_json_from(), {"type": "ack", "received": 5})
+        self.assertEqual(await socket.receive_json_from(), {"type": "flushed", "created": 5})
+        await socket.disconnect()
+
+    async def test_deleted_track_closes_the_socket(self):
+        socket, _, _ = await self.connect(self.user)
+        await socket.send_json_to({"type": "points", "points": self.points(range(5))})
+        await GPSTrack.objects.filter(pk=self.track.pk).adelete()
+        await socket.send_json_to({"type": "flush"})
+        self.assertEqual(await socket.receive_output(), {"type": "websocket.close", "code": 4404})
+
+    async def test_only_owner_and_followers_connect(self):
+        _, connected, code = await self.connect(self.stranger)
+        self.assertEqual((connected, code), (False, 4403))
+
+
+class TrackFileTests(HikerTestMixin, TestCase):
+    """GPX and FIT files import as whole hikes, or not at all"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.start = timezone.now().replace(microsecond=0) - timedelta(days=1)
+
+    def upload(self, content, name="track.gpx"):
+        return self.client.post("/api/tracking/hikes/import/", {
+            "trail": self.trail.pk, "file": SimpleUploadedFile(name, content)}, format="multipart")
+
+    def make_track(self, count=100):
+        track = create_track(self.user, self.trail, self.start)
+        GPSPoint.objects.bulk_create(
+            GPSPoint(track=track, latitude=Decimal("45.1234567") + Decimal(i).scaleb(-5),
+                     longitude=Decimal("-121.7654321"), altitude_feet=Decimal("3280.84"),
+                     recorded_at=self.start + timedelta(seconds=i), point_order=i)
+            for i in range(count))
+        return track
+
+    def gpx(self, tracks):
+        return "".join(export_gpx(tracks, "Test Trail")).encode()
+
+    def imported_points(self, hike_id):
+        track = GPSTrack.objects.get(hike_id=hike_id)
+        return list(track.point_values("latitude", "longitude", "altitude_feet", "recorded_at"))
+
+    def test_gpx_round_trip(self):
+        tracks = [self.make_track(), self.make_track(50)]
+        response = self.upload(self.gpx(tracks))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 2)
+        for track, hike in zip(tracks, response.data):
+            original = list(track.point_values("latitude", "longitude", "altitude_feet",
+                                               "recorded_at"))
+            self.assertEqual(self.imported_points(hike["hike_id"]), original)
+
+    def fit(self, count):
+        """Minimal FIT activity: one record definition and count records"""
+        fields = [(253, 4, 0x86), (0, 4, 0x85), (1, 4, 0x85), (2, 2, 0x84)]
+        data = bytearray([0x40, 0, 0]) + struct.pack("<HB", 20, len(fields))
+        for field in fields:
+            data += bytes(field)
+        timestamp = int((self.start - FIT_EPOCH).total_seconds())
+        for i in range(count):
+            latitude = round((45.1 + i * 0.00001) / SEMICIRCLES_TO_DEGREES)
+            longitude = round(-121.7 / SEMICIRCLES_TO_DEGREES)
+            # Altitude is stored as (meters + 500) * 5
+            data += b"\x00" + struct.pack("<IiiH", timestamp + i, latitude, longitude,
+                                           (1000 + 500) * 5)
+        header = struct.pack("<BBHI4sH", 14, 0x10, 2132, len(data), b".FIT", 0)
+        return header + bytes(data) + b"\x00\x00"
+
+    def test_fit_import(self):
+        response = self.upload(self.fit(30), "track.fit")
+        self.assertEqual(response.status_code, 201, response.data)
+        points = self.imported_points(response.data[0]["hike_id"])
+        self.assertEqual(len(points), 30)
+        self.assertEqual(points[0][2:], (Decimal("3280.84"), self.start))
+        self.assertAlmostEqual(float(points[-1][0]), 45.10029, places=6)
+        self.assertAlmostEqual(float(points[-1][1]), -121.7, places=6)
+
+    def assert_rejected(self, content, name="track.gpx"):
+        response = self.upload(content, name)
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertFalse(Hike.objects.filter(notes="Imported from file").exists())
+
+    def test_truncated_files_import_nothing(self):
+        gpx = self.gpx([self.make_track(), self.make_track()])
+        # Broken inside the second track: the first must not be kept either
+        self.assert_rejected(gpx[:int(len(gpx) * 0.75)])
+        self.assert_rejected(self.fit(30)[:-40], "track.fit")
+        self.assert_rejected(self.fit(30)[:20], "track.fit")
+
+    def test_malformed_files(self):
+        self.assert_rejected(b"not a track file")
+        self.assert_rejected(b'<gpx><trk><trkseg><trkpt lat="x" lon="1">'
+                             b"<time>2025-01-01T00:00:00Z</time></trkpt></trkseg></trk></gpx>")
+        self.assert_rejected(b'<?xml version="1.0"?><!DOCTYPE gpx [<!ENTITY a "aaaa">]>'
+                             b"<gpx><trk><name>&a;</name></trk></gpx>")
+        fit = bytearray(self.fit(5))
+        fit[0] = 3
+        self.assert_rejected(bytes(fit), "track.fit")
+
+    def gpx_point(self, lat="45.1", lon="-121.7", ele="1000", time="2025-06-01T08:00:00Z"):
+        return f'<trkpt lat="{lat}" lon="{lon}"><ele>{ele}</ele><time>{time}</time></trkpt>'
+
+    def test_out_of_range_values(self):
+        for point in (self.gpx_point(lat="91"), self.gpx_point(lon="-180.5"),
+                      self.gpx_point(ele="40000")):
+            self.assert_rejected(f"<gpx><trk><trkseg>{point}</trkseg></trk></gpx>".encode())
+
+    @mock.patch("tracking.trackfiles.IMPORT_BATCH_SIZE", 10)
+    def test_bad_point_after_committed_batches(self):
+        gpx = self.gpx([self.make_track(30)])
+        self.assert_rejected(gpx.replace(b"</trkseg>", self.gpx_point(lat="95").encode()
+                                         + b"</trkseg>"))
+
+    @override_settings(TIME_ZONE="America/Los_Angeles")
+    def test_gpx_times_without_offset(self):
+        points = self.gpx_point(time="2025-06-01T08:00:00") + self.gpx_point(
+            lat="45.1001", time="2025-06-01T08:00:10")
+        response = self.upload(f"<gpx><trk><trkseg>{points}</trkseg></trk></gpx>".encode())
+        self.assertEqual(response.status_code, 201, response.data)
+        recorded_at = self.imported_points(response.data[0]["hike_id"])[0][3]
+        self.assertEqual(recorded_at, datetime(2025, 6, 1, 15, tzinfo=dt_timezone.utc))
+
+
+def point_partition(point_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT tableoid::regclass::text FROM gps_points WHERE point_id = %s",
+                       [point_id])
+        return cursor.fetchone()[0]
+
+
+def point_order_constraint():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = 'gps_points'::regclass "
+                       "AND conname = 'unique_track_point_order'")
+        return cursor.fetchone()[0]
+
+
+@skipUnless(connection.vendor == "postgresql", "gps_points is only partitioned on PostgreSQL")
+class PartitionTests(HikerTestMixin, TestCase):
+    """Monthly partitions of gps_points"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.track = create_track(cls.user, cls.trail)
+
+    def points(self, start, count):
+        return [{"latitude": Decimal("45.0000000") + Decimal(i).scaleb(-5),
+                 "longitude": Decimal("-120.0000000"),
+                 "recorded_at": start + timedelta(seconds=i), "point_order": i}
+                for i in range(count)]
+
+    def test_constraints_include_the_partition_key(self):
+        self.assertEqual(point_order_constraint(), "UNIQUE (track_id, point_order, recorded_at)")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_constraint WHERE conname = 'gps_points_legacy_range'")
+            self.assertIsNone(cursor.fetchone())
+
+    def test_resent_points_are_skipped(self):
+        points = self.points(timezone.now(), 10)
+        self.assertEqual(store_points(self.track.pk, points), 10)
+        self.assertEqual(store_points(self.track.pk, points), 0)
+        self.assertEqual(GPSPoint.objects.filter(track=self.track).count(), 10)
+        # The database rejects a resent point too
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            GPSPoint.objects.create(track=self.track, **points[0])
+
+    def test_points_move_into_new_month_partitions(self):
+        today = timezone.now().date()
+        month = today.replace(day=1)
+        for _ in range(6):
+            month = next_month(month)
+        recorded_at = timezone.now().replace(year=month.year, month=month.month, day=15)
+        store_points(self.track.pk, self.points(recorded_at, 3))
+        point = GPSPoint.objects.filter(track=self.track).first()
+        self.assertEqual(point_partition(point.pk), "gps_points_default")
+
+        created = create_month_partitions(months_ahead=6, today=today)
+        self.assertIn(partition_name(month), created)
+        self.assertEqual(point_partition(point.pk), partition_name(month))
+        self.assertEqual(GPSPoint.objects.filter(track=self.track).count(), 3)
+
+
+@skipUnless(connection.vendor == "postgresql", "gps_points is only partitioned on PostgreSQL")
+class PartitionMigrationTests(TransactionTestCase):
+    """Migration 0010 keeps the existing points and can be reversed"""
+
+    before = [("tracking", "0009_altitude_precision")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_points_become_the_legacy_partition(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model(settings.AUTH_USER_MODEL).objects.create(
+            username="hiker", email="hiker@example.com", password="pass")
+        park = apps.get_model("trails", "Park").objects.create(
+            nps_park_code="test", park_name="Test Park", state="WA", region="Pacific West")
+        trail = apps.get_model("trails", "Trail").objects.create(
+            park=park, name="Test Trail", location="Test", decimal_length_miles=5)
+        start = timezone.now() - timedelta(days=400)
+        hike = apps.get_model("tracking", "Hike").objects.create(user=user, trail=trail,
+                                                                 start_time=start)
+        track = apps.get_model("tracking", "GPSTrack").objects.create(hike=hike, user=user,
+                                                                      started_at=start)
+        apps.get_model("tracking", "GPSPoint").objects.bulk_create(
+            apps.get_model("tracking", "GPSPoint")(
+                track=track, latitude=45, longitude=-120,
+                recorded_at=start + timedelta(seconds=i), point_order=i)
+            for i in range(20))
+
+        self.migrate([("tracking", "0010_partition_gps_points")])
+        old = list(GPSPoint.objects.filter(track_id=track.pk).values_list("point_id", flat=True))
+        self.assertEqual(len(old), 20)
+        self.assertEqual({point_partition(point_id) for point_id in old}, {"gps_points_legacy"})
+        self.assertEqual(point_order_constraint(), "UNIQUE (track_id, point_order, recorded_at)")
+        # The indexes built before the lock were adopted, none were built again
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'gps_points_legacy'")
+            self.assertEqual(sorted(row[0] for row in cursor.fetchall()), [
+                "gps_points_legacy_pkey", "gps_points_legacy_point_order_key",
+                "gps_points_legacy_track_order_idx", "gps_points_track_id_idx"])
+        # New ids carry on after the old ones
+        new = GPSPoint.objects.create(track_id=track.pk, latitude=45, longitude=-120,
+                                      recorded_at=timezone.now(), point_order=20)
+        self.assertGreater(new.pk, max(old))
+
+        self.migrate(self.before)
+        self.assertEqual(apps.get_model("tracking", "GPSPoint").objects.count(), 21)
+        self.assertEqual(point_order_constraint(), "UNIQUE (track_id, point_order)")
+
+
+class ArchiveTests(HikerTestMixin, TestCase):
+    """Archived tracks must read back exactly as they were stored"""
+
+    def add_track(self, ended_days_ago=60, completed=True, points=50):
+        start = timezone.now() - timedelta(days=ended_days_ago, hours=2)
+        track = create_track(self.user, self.trail, start, hike_fields={"completed": completed},
+                             ended_at=start + timedelta(hours=2))
+        GPSPoint.objects.bulk_create(
+            GPSPoint(track=track, latitude=f"{45 + i * 0.0001:.7f}", longitude="-120.0000000",
+                     altitude_feet=f"{1000 + i:.2f}" if i % 5 else None,
+                     recorded_at=start + timedelta(seconds=i), point_order=i)
+            for i in range(points))
+        track.compute_stats()
+        return track
+
+    def test_archived_track_reads_back_the_same(self):
+        track = self.add_track()
+        before = self.client.get(f"/api/tracking/tracks/{track.pk}/").data
+        gpx_before = b"".join(self.client.get(f"/api/tracking/tracks/{track.pk}/export/"))
+
+        self.assertEqual(archive_track(track.pk), 50)
+        self.assertFalse(GPSPoint.objects.filter(track=track).exists())
+
+        after = self.client.get(f"/api/tracking/tracks/{track.pk}/").data
+        self.assertIsNotNone(after["archived_at"])
+        strip = lambda points: [{key: value for key, value in point.items() if key != "point_id"}
+                                for point in points]
+        self.assertEqual(strip(after["gps_points"]), strip(before["gps_points"]))
+        self.assertEqual(after["point_count"], 50)
+        gpx_after = b"".join(self.client.get(f"/api/tracking/tracks/{track.pk}/export/"))
+        self.assertEqual(gpx_after, gpx_before)
+
+    def test_only_old_completed_tracks_are_archived(self):
+        self.add_track()
+        self.add_track(ended_days_ago=1)
+        self.add_track(completed=False)
+        self.assertEqual(archive_due(days=30), (1, 50))
+        self.assertEqual(archive_due(days=30), (0, 0))
+
+    def test_restore_puts_rows_back(self):
+        track = self.add_track()
+        archive_track(track.pk)
+        self.assertEqual(restore_track(track.pk), 50)
+        track.refresh_from_db()
+        self.assertIsNone(track.archived_at)
+        self.assertEqual(track.gps_points.count(), 50)
+
+
+class TrailMatchingTests(HikerTestMixin, TestCase):
+    """Completing a hike matches its tracks to the trail actually walked"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Runs 2 km north from the trailhead, features every 500 m
+        cls.walked = create_trail(cls.park, "Walked", "1.24", decimal_latitude=45,
+                                  decimal_longitude=-120)
+        for i in range(1, 5):
+            TrailFeature.objects.create(trail=cls.walked, feature_name=f"Marker {i}",
+                                        decimal_latitude=f"{45 + i * 0.0045:.7f}",
+                                        decimal_longitude=-120)
+        # Starts at the same trailhead but heads east
+        cls.other = create_trail(cls.park, "Other", "1.24", decimal_latitude=45,
+                                 decimal_longitude=-120)
+        TrailFeature.objects.create(trail=cls.other, feature_name="East lake",
+                                    decimal_latitude=45, decimal_longitude="-119.9800000")
+
+    def start_hike(self, trail, fraction=1.0):
+        """Hike with a stopped track going fraction of the way up the walked trail"""
+        start = timezone.now() - timedelta(hours=2)
+        track = create_track(self.user, trail, start, ended_at=start + timedelta(hours=1))
+        steps = int(200 * fraction)
+        GPSPoint.objects.bulk_create(
+            GPSPoint(track=track, latitude=f"{45 + i * 0.00009:.7f}",
+                     longitude=f"{-120 + (i % 2) * 0.00002:.7f}",
+                     recorded_at=start + timedelta(seconds=10 * i), point_order=i)
+            for i in range(steps + 1))
+        track.compute_stats(save=False)
+        track.simplify_points(save=False)
+        track.save()
+        return track.hike
+
+    def test_complete_verifies_trail(self):
+        hike = self.start_hike(self.walked)
+        response = self.client.post(f"/api/tracking/hikes/{hike.pk}/complete/", {}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["matched_trail"], self.walked.pk)
+        self.assertTrue(response.data["trail_verified"])
+        self.assertGreaterEqual(float(response.data["percent_completed"]), 95)
+
+    def test_complete_flags_and_replaces_wrong_trail(self):
+        hike = self.start_hike(self.other)
+        response = self.client.post(f"/api/tracking/hikes/{hike.pk}/complete/",
+                                    {"use_matched_trail": True}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["trail"], self.walked.pk)
+        self.assertTrue(response.data["trail_verified"])
+
+        hike = self.start_hike(self.other)
+        response = self.client.post(f"/api/tracking/hikes/{hike.pk}/complete/", {}, format="json")
+        self.assertEqual(response.data["trail"], self.other.pk)
+        self.assertEqual(response.data["matched_trail"], self.walked.pk)
+        self.assertFalse(response.data["trail_verified"])
+
+    def test_partial_hike_percent_completed(self):
+        hike = self.start_hike(self.walked, fraction=0.5)
+        self.client.post(f"/api/tracking/hikes/{hike.pk}/complete/", {}, format="json")
+        hike.refresh_from_db()
+        self.assertAlmostEqual(float(hike.percent_completed), 50, delta=10)
+
+
+class FilteringTests(HikerTestMixin, TestCase):
+    """GPS jumps must not add distance to a track"""
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(hours=1)
+        self.track = create_track(self.user, self.trail, start)
+        self.hike = self.track.hike
+        # 1 m/s due north for 1 km (0.000009 degrees is about 1 m), with a
+        # 500 m jump at point 300 and a very inaccurate fix at point 600
+        self.points = []
+        for i in range(1001):
+            point = {"latitude": f"{45 + i * 0.000009:.7f}", "longitude": "-120.0000000",
+                     "altitude_feet": "1000.00", "accuracy_feet": "16.00",
+                     "recorded_at": (start + timedelta(seconds=i)).isoformat(), "point_order": i}
+            if i == 300:
+                point["longitude"] = "-119.9936000"
+            if i == 600:
+                point["longitude"], point["accuracy_feet"] = "-119.9990000", "650.00"
+            self.points.append(point)
+
+    def test_outliers_are_dropped_from_stats(self):
+        url = f"/api/tracking/tracks/{self.track.pk}/"
+        response = self.client.post(f"{url}add_track_points/", {"points": self.points},
+                                    format="json")
+        self.assertEqual(response.status_code, 201)
+        self.track.refresh_from_db()
+        # Running stats already skip both
+        self.assertAlmostEqual(self.track.distance_m, 1000, delta=10)
+
+        response = self.client.post(f"{url}stop/")
+        self.assertEqual(response.data["point_count"], 1001)
+        self.assertEqual(response.data["rejected_point_count"], 2)
+        self.assertAlmostEqual(float(response.data["total_distance_miles"]), 0.621, delta=0.01)
+
+        cleaned = self.client.get(f"{url}?format=geojson&cleaned=true").data
+        self.assertEqual(cleaned["properties"]["point_count"], 999)
+        raw = self.client.get(f"{url}?format=geojson").data
+        self.assertEqual(raw["properties"]["point_count"], 1001)
+
+        # Simplified copies come from the same cleaned points, stored or not
+        stored = self.client.get(url, {"tolerance": 10}).data["coordinates"]
+        self.assertEqual(len(self.client.get(url, {"tolerance": 1}).data["coordinates"]), 999)
+        GPSTrack.objects.filter(pk=self.track.pk).update(simplified_polylines=None)
+        on_the_fly = self.client.get(url, {"tolerance": 10}).data["coordinates"]
+        self.assertEqual(len(on_the_fly), len(stored))
+        self.assertFalse(any(lon > -119.9995 for _, lon in on_the_fly))
+
+
+class ElevationProfileTests(HikerTestMixin, TestCase):
+    """Profiles are downsampled to the requested width and keep the summit"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = timezone.now() - timedelta(hours=2)
+        cls.track = create_track(cls.user, cls.trail, start)
+        # Up to a 3000 ft summit at point 2500, back down
+        GPSPoint.objects.bulk_create(
+            GPSPoint(track=cls.track, latitude=f"{45 + i * 0.00001:.7f}", longitude="-120.0000000",
+                     altitude_feet=f"{3000 - abs(i - 2500) * 0.8:.2f}",
+                     recorded_at=start + timedelta(seconds=i), point_order=i)
+            for i in range(5001))
+
+    def test_profile_is_downsampled(self):
+        response = self.client.get(f"/api/tracking/tracks/{self.track.pk}/elevation_profile/",
+                                   {"width": 200})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["source_point_count"], 5001)
+        self.assertEqual(len(response.data["profile"]), 200)
+        self.assertEqual(max(altitude for _, altitude in response.data["profile"]), 3000)
+        distances = [distance for distance, _ in response.data["profile"]]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_bad_width(self):
+        response = self.client.get(f"/api/tracking/tracks/{self.track.pk}/elevation_profile/",
+                                   {"width": "wide"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SyncTests(HikerTestMixin, TestCase):
+    """Offline batches apply once, however often the phone retries"""
+
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(hours=3)
+        self.hike_id, self.track_id = str(uuid.uuid4()), str(uuid.uuid4())
+        self.payload = {
+            "hikes": [{"client_id": self.hike_id, "trail": self.trail.pk, 
+                       "start_time": start.isoformat(), 
+                       "end_time": (start + timedelta(hours=1)).isoformat(),
+                       "completed": True, "modified_at": start.isoformat()}],
+            "tracks": [{"client_id": self.track_id, "hike": self.hike_id, 
+                        "started_at": start.isoformat(),
+                        "ended_at": (start + timedelta(hours=1)).isoformat(),
+                        "points": [{"latitude": f"{45 + i * 0.00001:.7f}", 
+                                    "longitude": "-120.0000000",
+                                    "recorded_at": (start + timedelta(seconds=i)).isoformat(),
+                                    "point_order": i} for i in range(500)]}],
+        }
+
+    def sync(self, payload):
+        response = self.client.post("/api/tracking/sync/", payload, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_sync_is_idempotent(self):
+        first = self.sync(self.payload)
+        self.assertEqual(first["points"], {"created": 500, "skipped": 0})
+        hike = Hike.objects.get(pk=first["ids"]["hikes"][self.hike_id])
+        self.assertTrue(hike.completed)
+        self.assertEqual(hike.gps_tracks.get().point_count, 500)
+        self.assertTrue(first["changes"]["full"])
+
+        again = self.sync(dict(self.payload, sync_token=first["sync_token"]))
+        self.assertEqual(again["ids"], first["ids"])
+        self.assertEqual(again["points"], {"created": 0, "skipped": 500})
+        self.assertEqual(again["conflicts"], [])
+        self.assertEqual(Hike.objects.count(), 1)
+        self.assertEqual(GPSPoint.objects.count(), 500)
+
+    def test_gzipped_batch(self):
+        body = gzip.compress(json.dumps(self.payload).encode())
+        response = self.client.post("/api/tracking/sync/", body, content_type="application/json",
+                                    HTTP_CONTENT_ENCODING="gzip", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(GPSPoint.objects.count(), 500)
+
+    def test_delta_and_conflicts(self):
+        token = self.sync(self.payload)["sync_token"]
+        hike = Hike.objects.get(client_id=self.hike_id)
+        # Edited on the server after the phone's change
+        hike.notes = "From the website"
+        hike.save()
+
+        stale = json.loads(json.dumps(self.payload))
+        stale["hikes"][0]["notes"] = "From the phone"
+        data = self.sync(dict(stale, sync_token=token))
+        self.assertEqual(data["conflicts"][0]["fields"], ["notes"])
+        hike.refresh_from_db()
+        self.assertEqual(hike.notes, "From the website")
+        self.assertFalse(data["changes"]["full"])
+        self.assertEqual([h["hike_id"] for h in data["changes"]["hikes"]], [hike.pk])
+
+        hike.delete()
+        data = self.sync({"sync_token": data["sync_token"]})
+        self.assertEqual(data["changes"]["deleted"]["hikes"][0]["client_id"], uuid.UUID(self.hike_id))
+        self.assertEqual(len(data["changes"]["deleted"]["tracks"]), 1)
+
+    def test_stat_updates_are_in_delta(self):
+        recording = json.loads(json.dumps(self.payload))
+        del recording["tracks"][0]["ended_at"]
+        token = self.sync(recording)["sync_token"]
+        track = GPSTrack.objects.get(client_id=self.track_id)
+        # Last changed well before the token
+        GPSTrack.objects.filter(pk=track.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        Hike.objects.filter(pk=track.hike_id).update(updated_at=timezone.now() - timedelta(hours=1))
+        data = self.sync({"sync_token": token})
+        self.assertEqual(data["changes"]["tracks"], [])
+
+        # Points from the live socket only save the running stats
+        start = timezone.now() - timedelta(hours=2)
+        store_points(track.pk, [{"latitude": Decimal("45.0050000"), "longitude": Decimal("-120.0000000"),
+                                 "recorded_at": start, "point_order": 500}])
+        data = self.sync({"sync_token": data["sync_token"]})
+        self.assertEqual([(t["track_id"], t["point_count"]) for t in data["changes"]["tracks"]],
+                         [(track.pk, 501)])
+
+    def test_invalid_token(self):
+        response = self.client.post("/api/tracking/sync/", {"sync_token": "nope"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class HeatmapTests(HikerTestMixin, TestCase):
+    """Stopped tracks are counted once per pixel and served as PNG tiles"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = timezone.now() - timedelta(hours=2)
+        cls.track = create_track(cls.user, cls.trail, start)
+        # About 1 km north, a point every 10 m
+        GPSPoint.objects.bulk_create(
+            GPSPoint(track=cls.track, latitude=f"{45 + i * 0.00009:.7f}", longitude="-120.0000000",
+                     recorded_at=start + timedelta(seconds=i * 5), point_order=i)
+            for i in range(100))
+
+    def setUp(self):
+        super().setUp()
+        tile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tile_dir.cleanup)
+        settings_override = override_settings(HEATMAP_TILE_DIR=tile_dir.name, HEATMAP_MAX_ZOOM=16)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stop_track(self):
+        response = self.client.post(f"/api/tracking/tracks/{self.track.pk}/stop/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_segments_are_filled(self):
+        x, y = world_pixels([45.0, 45.009], [-120.0, -120.0], 16)
+        pixels = track_pixels(x, y, [True])
+        # One pixel per row between the ends, no gaps
+        self.assertEqual(len(pixels), int(y[0]) - int(y[1]) + 1)
+        self.assertEqual(len(track_pixels(x, y, [False])), 2)
+
+    def test_tracks_counted_once(self):
+        self.assertEqual(update_tiles(), (0, 0))
+        self.stop_track()
+        tracks, tiles = update_tiles()
+        self.assertEqual(tracks, 1)
+        self.assertEqual(update_tiles(), (0, 0))
+
+        self.assertEqual(read_tile(0, 0, 0)[0].max(), 1)
+        # The middle is counted, the first and last 200 m aren't
+        self.assertEqual(self.pixel_values(), [(1, 1), (0, 0)])
+        self.assertGreater(tiles, 17)
+
+    def pixel_values(self):
+        """(tracks, hikers) at zoom 16 in the middle and at the start of the track"""
+        x, y = world_pixels([45.0045, 45.0], [-120.0, -120.0], 16)
+        values = []
+        for column, row in zip(x.astype(int), y.astype(int)):
+            counts, users = read_tile(16, column // 256, row // 256)
+            values.append((int(counts[row % 256, column % 256]),
+                           int((users[:, row % 256, column % 256] != 0).sum())))
+        return values
+
+    def copy_track(self, user):
+        track = create_track(user, self.trail, self.track.started_at,
+                             ended_at=timezone.now())
+        GPSPoint.objects.bulk_create(
+            GPSPoint(track=track, latitude=point.latitude, longitude=point.longitude,
+                     recorded_at=point.recorded_at, point_order=point.point_order)
+            for point in self.track.gps_points.all())
+        track.compute_stats()
+        return track
+
+    def test_hikers_counted_once_per_pixel(self):
+        self.stop_track()
+        self.copy_track(self.user)
+        update_tiles()
+        self.assertEqual(self.pixel_values()[0], (2, 1))
+
+        for name in ["second", "third", "fourth"]:
+            self.copy_track(create_hiker(name))
+        update_tiles()
+        # Only MIN_USERS hikers are kept per pixel
+        self.assertEqual(self.pixel_values()[0], (5, MIN_USERS))
+
+    def test_few_hikers_not_shown(self):
+        counts = np.full((256, 256), 10, dtype=np.uint32)
+        users = np.zeros((MIN_USERS, 256, 256), dtype=np.uint32)
+        users[:MIN_USERS - 1, 0, 1] = range(1, MIN_USERS)
+        users[:, 0, 2] = range(1, MIN_USERS + 1)
+        with Image.open(io.BytesIO(render_tile((counts, users)))) as image:
+            alpha = np.asarray(image)[0, :3, 3]
+        self.assertEqual(alpha.tolist()[:2], [0, 0])
+        self.assertGreater(alpha[2], 0)
+
+    def test_failure_before_marking_discards_the_batch(self):
+        self.stop_track()
+        with mock.patch("django.db.models.QuerySet.update", side_effect=DatabaseError("down")), \
+                self.assertRaises(DatabaseError):
+            update_tiles()
+        self.assertIsNone(read_tile(0, 0, 0))
+        self.assertEqual(update_tiles()[0], 1)
+        self.assertEqual(self.pixel_values()[0], (1, 1))
+
+    def test_failure_after_marking_finishes_the_batch(self):
+        self.stop_track()
+        with mock.patch("tracking.heatmap._apply_staged", side_effect=OSError("disk")), \
+                self.assertRaises(OSError):
+            update_tiles()
+        self.assertIsNone(read_tile(0, 0, 0))
+        # The tracks are in, the next run moves their tiles into place
+        self.assertEqual(update_tiles(), (0, 0))
+        self.assertEqual(self.pixel_values()[0], (1, 1))
+
+    def test_tile_endpoint(self):
+        self.stop_track()
+        update_tiles()
+        x, y = world_pixels([45.0], [-120.0], 12)
+        url = f"/api/tracking/heatmap/12/{int(x[0]) // 256}/{int(y[0]) // 256}.png"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.client.get("/api/tracking/heatmap/12/0/0.png").status_code, 200)
+        self.assertEqual(self.client.get("/api/tracking/heatmap/2/4/0.png").status_code, 404)
+        self.assertEqual(self.client.get("/api/tracking/heatmap/17/0/0.png").status_code, 404)
@@ -0,0 +1,404 @@
+"""
+GPX and FIT track files. Imports read the file as a stream and insert points
+in batches, so a file of any size is never held in memory; exports are
+generators of text chunks meant for a StreamingHttpResponse.
+
+GPX: every <trk> becomes a completed hike with one track (its segments are
+joined). FIT: the record messages of an activity become one hike. Points
+without a timestamp or position are skipped, and a position, elevation or
+speed outside what gps_points can hold rejects the file. Points are
+committed in batches so no transaction lasts as long as the file, and the
+hikes are only completed (and counted in the hiker's stats) once the whole
+file is read; a broken file deletes the hikes it started. GPX is parsed
+with defusedxml, which rejects DTDs and entity tricks. GPX times without an
+offset are read in the site time zone.
+"""
+
+import json
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import groupby
+from xml.sax.saxutils import escape
+
+from defusedxml import DefusedXmlException
+from defusedxml.ElementTree import iterparse, ParseError
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Hike, GPSTrack, GPSPoint
+from .stats import record_completed_hike
+
+
+FEET_PER_METER = 3.28084
+
+# Points inserted and committed together while importing
+IMPORT_BATCH_SIZE = 5000
+
+# Points per chunk of an export response
+EXPORT_CHUNK_SIZE = 1000
+
+COORDINATE_STEP = Decimal("0.0000001")
+HUNDREDTH = Decimal("0.01")
+
+
+class TrackFileError(ValueError):
+    """Raised when an uploaded track file can't be read"""
+
+
+def _coordinate(value):
+    return Decimal(value).quantize(COORDINATE_STEP)
+
+
+def _feet(meters):
+    return Decimal(meters * FEET_PER_METER).quantize(HUNDREDTH) if meters is not None else None
+
+
+def _check_point(point):
+    """Reject a point the REST endpoints would reject, before it fails the insert"""
+    when = point["recorded_at"].isoformat()
+    if abs(point["latitude"]) > 90 or abs(point["longitude"]) > 180:
+        raise TrackFileError(f"Position out of range at {when}")
+    for name in ("altitude_feet", "speed_mps"):
+        field = GPSPoint._meta.get_field(name)
+        if point.get(name) is not None and (
+                abs(point[name]) >= 10 ** (field.max_digits - field.decimal_places)):
+            raise TrackFileError(f"{name} out of range at {when}")
+    return point
+
+
+# GPX
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_gpx(fileobj):
+    """
+        Yields (track index, point) for every timed <trkpt>. Elements are
+        cleared as soon as they're read, so memory stays flat.
+    """
+    track_index = -1
+    segment = None
+    point = None
+    try:
+        for event, elem in iterparse(fileobj, events=("start", "end")):
+            name = _local_name(elem.tag)
+            if event == "start":
+                if name == "trk":
+                    track_index += 1
+                elif name == "trkseg":
+                    segment = elem
+                elif name == "trkpt":
+                    point = {"lat": elem.get("lat"), "lon": elem.get("lon")}
+                continue
+
+            if name in ("ele", "time") and point is not None:
+                point[name] = (elem.text or "").strip()
+            elif name == "trkpt":
+                recorded_at = parse_datetime(point.get("time") or "")
+                if recorded_at and timezone.is_naive(recorded_at):
+                    recorded_at = timezone.make_aware(recorded_at)
+                if recorded_at and point["lat"] and point["lon"]:
+                    elevation = float(point["ele"]) if point.get("ele") else None
+                    yield track_index, {
+                        "latitude": _coordinate(point["lat"]),
+                        "longitude": _coordinate(point["lon"]),
+                        "altitude_feet": _feet(elevation),
+                        "recorded_at": recorded_at,
+                    }
+                point = None
+                # Drop the finished point from the tree
+                if segment is not None:
+                    segment.clear()
+            elif name in ("trkseg", "trk"):
+                elem.clear()
+    except (ParseError, DefusedXmlException) as e:
+        raise TrackFileError(f"Invalid GPX file: {e}")
+    except (ArithmeticError, ValueError) as e:
+        raise TrackFileError(f"Invalid value in GPX file: {e}")
+
+
+# FIT
+
+FIT_EPOCH = datetime(1989, 12, 31, tzinfo=dt_timezone.utc)
+FIT_RECORD_MESSAGE = 20
+SEMICIRCLES_TO_DEGREES = 180 / 2 ** 31
+
+# FIT base type number -> (struct format, invalid value)
+FIT_BASE_TYPES = {
+    0x00: ("B", 0xFF), 0x01: ("b", 0x7F), 0x02: ("B", 0xFF),
+    0x83: ("h", 0x7FFF), 0x84: ("H", 0xFFFF), 0x85: ("i", 0x7FFFFFFF),
+    0x86: ("I", 0xFFFFFFFF), 0x8B: ("H", 0x0000), 0x8C: ("I", 0x00000000),
+}
+
+# Record message fields: field number -> name
+FIT_RECORD_FIELDS = {253: "timestamp", 0: "position_lat", 1: "position_long",
+                     2: "altitude", 78: "enhanced_altitude", 6: "speed",
+                     73: "enhanced_speed"}
+
+
+def _read_exactly(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise TrackFileError("Truncated FIT file")
+    return data
+
+
+def is_fit(header):
+    """True if the first 12+ bytes of a file are a FIT header"""
+    return len(header) >= 12 and header[8:12] == b".FIT"
+
+
+def parse_fit(fileobj):
+    """
+        Yields (0, point) for every record message with a position. Reads
+        the file message by message; only the message definitions are kept.
+    """
+    header_size = _read_exactly(fileobj, 1)[0]
+    if header_size not in (12, 14):
+        raise TrackFileError("Not a FIT file")
+    header = _read_exactly(fileobj, header_size - 1)
+    if header[7:11] != b".FIT":
+        raise TrackFileError("Not a FIT file")
+    data_size = struct.unpack("<I", header[3:7])[0]
+
+    definitions = {}
+    last_timestamp = None
+    position = 0
+    while position < data_size:
+        record_header = _read_exactly(fileobj, 1)[0]
+        position += 1
+
+        if record_header & 0x80:
+            # Compressed timestamp header: 5 bit offset from the last timestamp
+            local_type = (record_header >> 5) & 0x03
+            offset = record_header & 0x1F
+            if last_timestamp is None:
+                raise TrackFileError("Compressed timestamp before any timestamp")
+            last_timestamp += (offset - last_timestamp) & 0x1F
+            compressed_timestamp = last_timestamp
+        else:
+            local_type = record_header & 0x0F
+            compressed_timestamp = None
+
+        if not record_header & 0x80 and record_header & 0x40:
+            # Definition message
+            fixed = _read_exactly(fileobj, 5)
+            endian = ">" if fixed[1] == 1 else "<"
+            global_number = struct.unpack(endian + "H", fixed[2:4])[0]
+            fields = []
+            for i in range(fixed[4]):
+                number, size, base_type = _read_exactly(fileobj, 3)
+                fields.append((number, size, base_type))
+            position += 5 + 3 * fixed[4]
+            developer_size = 0
+            if record_header & 0x20:
+                count = _read_exactly(fileobj, 1)[0]
+                developer = _read_exactly(fileobj, 3 * count)
+                developer_size = sum(developer[i * 3 + 1] for i in range(count))
+                position += 1 + 3 * count
+            definitions[local_type] = (endian, global_number, fields, developer_size)
+            continue
+
+        if local_type not in definitions:
+            raise TrackFileError("FIT data message without a definition")
+        endian, global_number, fields, developer_size = definitions[local_type]
+        size = sum(field[1] for field in fields) + developer_size
+        data = _read_exactly(fileobj, size)
+        position += size
+
+        values = {}
+        offset = 0
+        for number, field_size, base_type in fields:
+            raw = data[offset:offset + field_size]
+            offset += field_size
+            name = FIT_RECORD_FIELDS.get(number) if global_number == FIT_RECORD_MESSAGE else None
+            if number == 253:
+                name = "timestamp"
+            type_info = FIT_BASE_TYPES.get(base_type)
+            if name is None or type_info is None:
+                continue
+            fmt, invalid = type_info
+            if struct.calcsize(fmt) != field_size:
+                continue
+            value = struct.unpack(endian + fmt, raw)[0]
+            if value != invalid:
+                values[name] = value
+
+        if "timestamp" in values:
+            last_timestamp = values["timestamp"]
+        elif compressed_timestamp is not None:
+            values["timestamp"] = compressed_timestamp
+
+        if global_number != FIT_RECORD_MESSAGE:
+            continue
+        if not {"timestamp", "position_lat", "position_long"} <= values.keys():
+            continue
+
+        altitude = values.get("enhanced_altitude", values.get("altitude"))
+        speed = values.get("enhanced_speed", values.get("speed"))
+        yield 0, {
+            "latitude": _coordinate(values["position_lat"] * SEMICIRCLES_TO_DEGREES),
+            "longitude": _coordinate(values["position_long"] * SEMICIRCLES_TO_DEGREES),
+            "altitude_feet": _feet(altitude / 5 - 500) if altitude is not None else None,
+            "speed_mps": (Decimal(speed / 1000).quantize(HUNDREDTH)
+                          if speed is not None else None),
+            "recorded_at": FIT_EPOCH + timedelta(seconds=values["timestamp"]),
+        }
+
+
+# Import
+
+def _import_track(user, trail, points, hikes):
+    """
+        Write an iterator of points as a new hike with one track, committing
+        every IMPORT_BATCH_SIZE points. The hike is added to hikes as soon
+        as it exists. Returns the track and its last point's time.
+    """
+    first = next(points)
+    started_at = first["recorded_at"]
+
+    with transaction.atomic():
+        hike = Hike.objects.create(user=user, trail=trail, start_time=started_at,
+                                   notes="Imported from file")
+        track = GPSTrack.objects.create(hike=hike, user=user, started_at=started_at)
+    hikes.append(hike)
+
+    batch, order, last = [], 0, first
+    for point in _prepend(first, points):
+        batch.append(GPSPoint(track=track, point_order=order, **_check_point(point)))
+        order += 1
+        last = point
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            _write_batch(track, batch)
+            batch = []
+    _write_batch(track, batch)
+    return track, last["recorded_at"]
+
+
+def _write_batch(track, batch):
+    with transaction.atomic():
+        GPSPoint.objects.bulk_create(batch)
+        track.add_running_stats(batch)
+        track.save(update_fields=GPSTrack.RUNNING_STAT_FIELDS)
+
+
+def _complete_import(track, ended_at):
+    """Stop an imported track and complete its hike"""
+    track.ended_at = ended_at
+    track.compute_stats(save=False)
+    track.simplify_points(save=False)
+    track.save()
+
+    hike = track.hike
+    hike.end_time = track.ended_at
+    hike.completed = True
+    if track.total_distance_miles is not None:
+        hike.distance_miles = round(track.total_distance_miles, 2)
+    hike.save()
+    hike.calculate_duration()
+    record_completed_hike(hike)
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def import_track_file(fileobj, user, trail):
+    """
+        Import a GPX or FIT file (detected from its header) as completed
+        hikes on a trail. Returns the created hikes.
+    """
+    header = fileobj.read(14)
+    fileobj.seek(0)
+    parser = parse_fit if is_fit(header) else parse_gpx
+
+    hikes, tracks = [], []
+    try:
+        for _, points in groupby(parser(fileobj), key=lambda item: item[0]):
+            tracks.append(_import_track(user, trail, (point for _, point in points), hikes))
+        if not hikes:
+            raise TrackFileError("No timed track points found in the file")
+        with transaction.atomic():
+            for track, ended_at in tracks:
+                _complete_import(track, ended_at)
+    except BaseException:
+        # All of the file or nothing, even when it breaks after the first track
+        Hike.objects.filter(pk__in=[hike.pk for hike in hikes]).delete()
+        raise
+    return hikes
+
+
+# Export
+
+def _point_rows(track):
+    rows = track.point_values("latitude", "longitude", "altitude_feet", "recorded_at")
+    if track.archived_at:
+        return rows
+    return rows.iterator(chunk_size=EXPORT_CHUNK_SIZE * 2)
+
+
+def _chunked(lines):
+    """Join lines into chunks of EXPORT_CHUNK_SIZE"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def _gpx_points(track):
+    for latitude, longitude, altitude, recorded_at in _point_rows(track):
+        elevation = (f"<ele>{float(altitude) / FEET_PER_METER:.2f}</ele>"
+                     if altitude is not None else "")
+        time = recorded_at.astimezone(dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        yield f'<trkpt lat="{latitude}" lon="{longitude}">{elevation}<time>{time}</time></trkpt>\n'
+
+
+def export_gpx(tracks, name):
+    """GPX 1.1 document with one <trk> per track, as text chunks"""
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="HikingApp" xmlns="http://www.topografix.com/GPX/1/1">\n'
+           f"<metadata><name>{escape(name)}</name></metadata>\n")
+    for track in tracks:
+        yield f"<trk><name>{escape(name)}</name><number>{track.track_id}</number><trkseg>\n"
+        yield from _chunked(_gpx_points(track))
+        yield "</trkseg></trk>\n"
+    yield "</gpx>\n"
+
+
+def export_geojson(tracks, name):
+    """
+        GeoJSON FeatureCollection with one LineString per track, as text
+        chunks. Point times go in the coordTimes property (same order as the
+        coordinates), as GPX converters do.
+    """
+    yield '{"type": "FeatureCollection", "features": ['
+    for index, track in enumerate(tracks):
+        properties = {"name": name, "track_id": track.track_id}
+        yield (("," if index else "")
+               + '{"type": "Feature", "properties": '
+               + json.dumps(properties)[:-1] + ', "coordTimes": [')
+        yield from _chunked(
+            ("," if i else "") + json.dumps(recorded_at.isoformat())
+            for i, (_, _, _, recorded_at) in enumerate(_point_rows(track)))
+        yield ']}, "geometry": {"type": "LineString", "coordinates": ['
+        yield from _chunked(
+            ("," if i else "") + (f"[{longitude},{latitude},{float(altitude) / FEET_PER_METER:.2f}]"
+                                  if altitude is not None else f"[{longitude},{latitude}]")
+            for i, (latitude, longitude, altitude, _) in enumerate(_point_rows(track)))
+        yield "]}}"
+    yield "]}\n"
+
+
+EXPORTERS = {
+    "gpx": (export_gpx, "application/gpx+xml", "gpx"),
+    "geojson": (export_geojson, "application/geo+json", "geojson"),
+}
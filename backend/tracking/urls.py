@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import HikeViewSet, GPSTrackViewSet, GPSPointViewSet
+from .views import HikeViewSet, GPSTrackViewSet, GPSPointViewSet, sync, heatmap_tile
 
 router = DefaultRouter()
 router.register(r"hikes", HikeViewSet, basename="hike")
@@ -8,5 +8,7 @@ router.register(r"tracks", GPSTrackViewSet, basename="track")
 router.register(r"points", GPSPointViewSet, basename="point")
 
 urlpatterns = [
+    path("sync/", sync, name="tracking-sync"),
+    path("heatmap/<int:z>/<int:x>/<int:y>.png", heatmap_tile, name="tracking-heatmap-tile"),
     path("", include(router.urls)),
 ]
\ No newline at end of file
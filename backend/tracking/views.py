@@ -1,10 +1,32 @@
+import math
+
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, parser_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import MultiPartParser, FormParser
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from django.db import transaction
+from django.db.models import Count, Prefetch
 from django.utils import timezone
+from trails.models import Trail
 from .models import Hike, GPSTrack, GPSPoint
+from . import buffer as point_buffer
+from .ingest import store_points, TrackStoppedError
+from .renderers import PolylineRenderer, GeoJSONRenderer
+from .trackfiles import import_track_file, EXPORTERS, TrackFileError
+from .stats import build_stats_response, rebuild_hiker_stats
+from .matching import match_hike
+from .lifecycle import complete_hike, stop_track
+from .parsers import GzipJSONParser
+from .sync import apply_sync, SyncError
+from .profile import get_profile, DEFAULT_WIDTH, MAX_WIDTH
+from .simplify import MIN_ZOOM, MAX_ZOOM
+from .heatmap import get_tile_png, is_valid_tile, tile_version, TILE_MAX_AGE
 from .serializers import (
     HikeSerializer,
     HikeListSerializer,
@@ -12,13 +34,62 @@ from .serializers import (
     CompleteHikeSerializer,
     GPSTrackSerializer,
     GPSTrackListSerializer,
+    GPSTrackPolylineSerializer,
+    GPSTrackGeoJSONSerializer,
+    GPSTrackSimplifiedSerializer,
     GPSPointSerializer,
-    GPSPointCreateSerializer
+    GPSPointCreateSerializer,
+    BatchTrackPointsSerializer,
+    SyncSerializer,
+    SyncHikeChangeSerializer,
+    SyncTrackChangeSerializer
 )
 
+
+def queue_points(track, points, data):
+    """
+        Hand points to the write-behind buffer and answer 202 with data. They
+        are stored within seconds, and always before the track is stopped;
+        duplicates are dropped then.
+    """
+    try:
+        point_buffer.append_points(track.pk, points)
+    except TrackStoppedError as e:
+        return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+def store_point_response(track, point, serializer):
+    """
+        Store one point through store_points(), which every writer uses so a
+        point_order is only stored once, and answer 201 with the point
+    """
+    try:
+        created = store_points(track.pk, [point])
+    except TrackStoppedError as e:
+        return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if not created:
+        return Response({"ERROR": "Point already recorded."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    serializer.instance = track.gps_points.get(point_order=point["point_order"])
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+def export_response(request, tracks, name, filename):
+    """Stream tracks as ?type=gpx (default) or ?type=geojson"""
+    file_type = request.query_params.get("type", "gpx")
+    if file_type not in EXPORTERS:
+        return Response({"ERROR": f"type must be one of {', '.join(EXPORTERS)}."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    exporter, content_type, extension = EXPORTERS[file_type]
+    response = StreamingHttpResponse(exporter(tracks, name), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{extension}"'
+    return response
+
+
 class HikeViewSet(viewsets.ModelViewSet):
     """API endpoint for managing hikes"""
-    queryset = Hike.objects.select_related("user", "trail").prefetch_related("gps_tracks")
+    queryset = Hike.objects.select_related("user", "trail")
     permission_classes = [IsAuthenticated]
 
     def get_serializer_class(self):
@@ -42,24 +113,89 @@ class HikeViewSet(viewsets.ModelViewSet):
         if trail_id:
             queryset = queryset.filter(trail_id=trail_id)
         
+        if self.action == "list":
+            # Count in the same query instead of once per hike
+            queryset = queryset.annotate(track_count=Count("gps_tracks"))
+        else:
+            queryset = queryset.prefetch_related(
+                Prefetch("gps_tracks", queryset=GPSTrack.objects.select_related("user")
+                         .defer(*GPSTrack.BLOB_FIELDS)))
         return queryset
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_update(self, serializer):
+        was_completed = serializer.instance.completed
+        hike = serializer.save()
+        if was_completed or hike.completed:
+            # Edits can change any total or record, so recount this user
+            rebuild_hiker_stats(hike.user_id)
+
+    def perform_destroy(self, instance):
+        completed, user_id = instance.completed, instance.user_id
+        instance.delete()
+        if completed:
+            rebuild_hiker_stats(user_id)
+
     @action(detail=True, methods=["post"])
     def complete(self, request, pk=None):
         hike = self.get_object()
 
-        if hike.completed:
+        serializer = CompleteHikeSerializer(hike, data=request.data, partial=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        changes = dict(serializer.validated_data)
+        use_match = changes.pop("use_matched_trail", False)
+        hike = complete_hike(hike.pk, changes, use_match=use_match)
+        if hike is None:
             return Response({"ERROR" : "Hike already completed."}, 
                             status=status.HTTP_400_BAD_REQUEST)
+        return Response(CompleteHikeSerializer(hike).data)
+    
+    @action(detail=True, methods=["post"])
+    def match_trail(self, request, pk=None):
+        """
+            Match the hike's tracks to trails again, e.g. after a late track
+            was stopped. Returns the hike and the best candidates.
+        """
+        hike = self.get_object()
+        matches = match_hike(hike)
+        data = HikeSerializer(hike).data
+        data["candidates"] = [match._asdict() for match in matches[:5]]
+        return Response(data)
+    
+    @action(detail=False, methods=["post"], url_path="import", 
+            parser_classes=[MultiPartParser, FormParser])
+    def import_file(self, request):
+        """
+            Import a GPX or FIT file as completed hikes on a trail. The file is
+            parsed as a stream, so large histories are fine.
+        """
+        upload = request.FILES.get("file")
+        trail_id = request.data.get("trail")
+        if not upload or not trail_id:
+            return Response({"ERROR": "file and trail are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        trail = get_object_or_404(Trail, trail_id=trail_id)
+
+        try:
+            hikes = import_track_file(upload, request.user, trail)
+        except TrackFileError as e:
+            return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = CompleteHikeSerializer(hike, data=request.data, partial=True)
-        if serializer.is_valid():
-            serializer.save(completed=True)
-            return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        hikes = self.get_queryset().filter(pk__in=[hike.pk for hike in hikes]).annotate(
+            track_count=Count("gps_tracks"))
+        serializer = HikeListSerializer(hikes, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=["get"])
+    def export(self, request, pk=None):
+        """Download all of the hike's tracks as one GPX or GeoJSON file"""
+        hike = self.get_object()
+        tracks = hike.gps_tracks.order_by("started_at")
+        return export_response(request, tracks, hike.trail.name, f"hike-{hike.pk}")
     
     @action(detail=False, methods=["get"])
     def activate(self, request):
@@ -69,21 +205,17 @@ class HikeViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=["get"])
     def stats(self, request):
-        queryset = self.get_queryset()
-        completed_hikes = queryset.filter(completed=True)
-
-        stats = {"total_hikes": completed_hikes.count(), 
-                 "total_distance_miles": sum(hike.distance_miles for hike in 
-                                             completed_hikes if hike.distance_miles), 
-                 "total_duration_hours": sum(hike.duration_min for 
-                                             hike in completed_hikes if hike.duration_min) / 60 if completed_hikes else 0, 
-                 "active_hikes": queryset.filter(completed=False).count()}
-        
+        """
+            Totals, personal records and per-year/month/trail breakdowns, read
+            from the user's precomputed stats rows (see tracking/stats.py)
+        """
+        stats = build_stats_response(request.user.pk)
+        stats["active_hikes"] = Hike.objects.filter(user=request.user, completed=False).count()
         return Response(stats)
     
 class GPSTrackViewSet(viewsets.ModelViewSet):
     """API endpoint for GPS tracks"""
-    queryset = GPSTrack.objects.select_related("user", "hike").prefetch_related("gps_points")
+    queryset = GPSTrack.objects.select_related("user", "hike")
     permission_classes = [IsAuthenticated]
 
     def get_serializer_class(self):
@@ -91,26 +223,118 @@ class GPSTrackViewSet(viewsets.ModelViewSet):
             return GPSTrackListSerializer
         return GPSTrackSerializer
     
+    def get_renderers(self):
+        # Only the track geometry has a polyline / GeoJSON form
+        renderers = super().get_renderers()
+        if self.action == "retrieve":
+            renderers += [PolylineRenderer(), GeoJSONRenderer()]
+        return renderers
+    
+    def wants_all_points(self):
+        """True when the response lists every point (plain retrieve)"""
+        params = self.request.query_params
+        return (self.action == "retrieve" 
+                and self.request.accepted_renderer.format not in ("polyline", "geojson")
+                and "zoom" not in params and "tolerance" not in params)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+            Full track, or a compact ?format=polyline / ?format=geojson version.
+            ?zoom= (web map zoom level) or ?tolerance= (meters) return a
+            simplified copy of the track instead of every point; simplified
+            copies of stopped tracks are made from the filtered points, and
+            ?cleaned=true returns all of those.
+        """
+        compact_serializers = {"polyline": GPSTrackPolylineSerializer, 
+                               "geojson": GPSTrackGeoJSONSerializer}
+        if self.wants_all_points():
+            return super().retrieve(request, *args, **kwargs)
+        
+        compact_serializer = compact_serializers.get(request.accepted_renderer.format)
+        zoom = request.query_params.get("zoom")
+        tolerance = request.query_params.get("tolerance")
+        
+        try:
+            zoom = int(zoom) if zoom is not None else None
+            tolerance = float(tolerance) if tolerance is not None else None
+        except ValueError:
+            return Response({"ERROR": "zoom must be a whole number and tolerance a number."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if zoom is not None and not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            return Response({"ERROR": f"zoom must be between {MIN_ZOOM} and {MAX_ZOOM}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if tolerance is not None and not (math.isfinite(tolerance) and tolerance >= 0):
+            return Response({"ERROR": "tolerance must be 0 or more meters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        track = self.get_object()
+        if zoom is not None:
+            tolerance = track.tolerance_for_zoom(zoom)
+        if tolerance is not None:
+            level, coordinates = track.get_simplified_coordinates(tolerance)
+        else:
+            cleaned = request.query_params.get("cleaned", "").lower() == "true"
+            level, coordinates = 0, track.get_coordinates(cleaned=cleaned)
+        
+        serializer_class = compact_serializer or GPSTrackSimplifiedSerializer
+        serializer = serializer_class(track, context={"coordinates": coordinates, 
+                                                      "tolerance": level})
+        return Response(serializer.data)
+    
     def get_queryset(self):
         queryset = super().get_queryset().filter(user=self.request.user)
 
         hike_id = self.request.query_params.get("hike")
         if hike_id:
             queryset = queryset.filter(hike_id=hike_id)
+        
+        # Only the full detail view needs the points; lists use point_count
+        if self.wants_all_points():
+            queryset = queryset.prefetch_related("gps_points")
+        elif self.action in ("list", "add_track_point", "add_track_points"):
+            queryset = queryset.defer(*GPSTrack.BLOB_FIELDS)
         return queryset
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user, started_at=timezone.now())
 
+    def perform_destroy(self, instance):
+        completed, user_id = instance.hike.completed, instance.user_id
+        instance.delete()
+        if completed:
+            # The track's elevation gain counted towards the totals
+            rebuild_hiker_stats(user_id)
+
+    @action(detail=True, methods=["get"])
+    def export(self, request, pk=None):
+        """Download the track as a GPX or GeoJSON file"""
+        track = self.get_object()
+        return export_response(request, [track], track.hike.trail.name, f"track-{track.pk}")
+    
+    @action(detail=True, methods=["get"])
+    def elevation_profile(self, request, pk=None):
+        """
+            Distance (miles) vs altitude (feet) pairs, downsampled to about
+            ?width= points (default 300) for charts
+        """
+        try:
+            width = int(request.query_params.get("width", DEFAULT_WIDTH))
+        except ValueError:
+            return Response({"ERROR": "width must be a whole number."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 2 <= width <= MAX_WIDTH:
+            return Response({"ERROR": f"width must be between 2 and {MAX_WIDTH}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        track = self.get_object()
+        return Response(get_profile(track, width))
+    
     @action(detail=True, methods=["post"])
     def stop(self, request, pk=None):
-        track = self.get_object()
-
-        if track.ended_at:
+        track = stop_track(self.get_object().pk)
+        if track is None:
             return Response({"ERROR": "Track already stopped."},
                             status=status.HTTP_400_BAD_REQUEST)
-        track.ended_at = timezone.now()
-        track.save()
 
         serializer = self.get_serializer(track)
         return Response(serializer.data)
@@ -119,15 +343,41 @@ class GPSTrackViewSet(viewsets.ModelViewSet):
     def add_track_point(self, request, pk=None):
         track = self.get_object()
 
-        if track.ended_at:
-            return Response({"ERROR": "Cannot add points to a stopped track"}, 
-                            status=status.HTTP_400_BAD_REQUEST)
-        
         serializer = GPSPointCreateSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(track=track)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        if point_buffer.is_enabled():
+            return queue_points(track, [serializer.validated_data], serializer.data)
+        
+        return store_point_response(track, serializer.validated_data, serializer)
+    
+    @action(detail=True, methods=["post"])
+    def add_track_points(self, request, pk=None):
+        """
+            Add a batch of points in one request and one transaction. Points
+            whose point_order is already stored are skipped, so a client can
+            safely resend a batch after a timeout.
+        """
+        track = self.get_object()
+
+        # Accept either {"points": [...]} or a bare list of points
+        data = {"points": request.data} if isinstance(request.data, list) else request.data
+        serializer = BatchTrackPointsSerializer(data=data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        received = serializer.validated_data["points"]
+        if point_buffer.is_enabled():
+            return queue_points(track, received, {"queued": len(received)})
+        
+        try:
+            created = store_points(track.pk, received)
+        except TrackStoppedError as e:
+            return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"created": created, "skipped": len(received) - created}, 
+                        status=status.HTTP_201_CREATED)
         
 
 class GPSPointViewSet(viewsets.ModelViewSet):
@@ -146,14 +396,83 @@ class GPSPointViewSet(viewsets.ModelViewSet):
     
     def create(self, request, *args, **kwargs):
         track_id = request.data.get("track")
-        track = get_object_or_404(GPSTrack, track_id=track_id, user=request.user)
+        track = get_object_or_404(GPSTrack.objects.defer(*GPSTrack.BLOB_FIELDS),
+                                  track_id=track_id, user=request.user)
 
-        if track.ended_at:
-            return Response({"ERROR": "Cannot add points to a stopped track."},
-                            status=status.HTTP_400_BAD_REQUEST)
-        
         serializer = self.get_serializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        if point_buffer.is_enabled():
+            points = [{key: value for key, value in serializer.validated_data.items() 
+                       if key != "track"}]
+            return queue_points(track, points, serializer.data)
+        
+        point = {key: value for key, value in serializer.validated_data.items() if key != "track"}
+        return store_point_response(track, point, serializer)
+    
+    def perform_destroy(self, instance):
+        """Recompute the track's stats without the point"""
+        with transaction.atomic():
+            track = (GPSTrack.objects.select_for_update().select_related("hike")
+                     .defer(*GPSTrack.BLOB_FIELDS).get(pk=instance.track_id))
+            instance.delete()
+            if not track.ended_at:
+                track.rebuild_running_stats()
+                return
+            track.compute_stats(save=False)
+            track.simplify_points(save=False)
+            track.save()
+            if track.hike.completed:
+                rebuild_hiker_stats(track.user_id)
+
+@gzip_page
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@parser_classes([GzipJSONParser])
+def sync(request):
+    """
+        Upload hikes, tracks and points recorded offline in one request and
+        get back everything that changed on the server since sync_token
+        (see tracking/sync.py)
+    """
+    serializer = SyncSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        result, (full, hikes, tracks, tombstones) = apply_sync(request.user, 
+                                                               serializer.validated_data)
+    except SyncError as e:
+        return Response({"ERROR": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    deleted = {"hikes": [], "tracks": []}
+    for kind, object_id, client_id in tombstones.values_list("kind", "object_id", "client_id"):
+        deleted[f"{kind}s"].append({"id": object_id, "client_id": client_id})
+    result["changes"] = {
+        "full": full,
+        "hikes": SyncHikeChangeSerializer(hikes, many=True).data,
+        "tracks": SyncTrackChangeSerializer(tracks, many=True).data,
+        "deleted": deleted,
+    }
+    return Response(result)
+
+
+def heatmap_etag(request, z, x, y):
+    return tile_version(z, x, y) if is_valid_tile(z, x, y) else None
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@condition(etag_func=heatmap_etag)
+def heatmap_tile(request, z, x, y):
+    """
+        Heatmap tile PNG of every stopped track (see tracking/heatmap.py).
+        Tiles nobody hiked through are blank.
+    """
+    if not is_valid_tile(z, x, y):
+        return Response({"ERROR": "No such tile."}, status=status.HTTP_404_NOT_FOUND)
+    response = HttpResponse(get_tile_png(z, x, y, heatmap_etag(request, z, x, y)),
+                            content_type="image/png")
+    patch_cache_control(response, private=True, max_age=TILE_MAX_AGE)
+    return response
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Park, Trail, SavedTrail, Review, TrailCondition, Photo, Tag, TrailTag, TrailFeature
+from .models import Park, ParkSummary, Trail, SavedTrail, Review, TrailCondition, Photo, Tag, TrailTag, TrailFeature
 
 
 @admin.register(Park)
@@ -9,6 +9,14 @@ class ParkAdmin(admin.ModelAdmin):
     list_filter = ["state", "region"]
 
 
+@admin.register(ParkSummary)
+class ParkSummaryAdmin(admin.ModelAdmin):
+    list_display = ["park", "trail_count", "total_miles", "max_elevation_gain_ft", "updated_at"]
+    search_fields = ["park__park_name"]
+    readonly_fields = ["trail_count", "total_miles", "miles_by_difficulty", 
+                       "max_elevation_gain_ft", "feature_counts", "updated_at"]
+
+
 @admin.register(Trail)
 class TrailAdmin(admin.ModelAdmin):
     list_display = ["name", "park", "difficulty", "decimal_length_miles", "is_active"]
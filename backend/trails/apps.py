@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TrailsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "trails"
+
+    def ready(self):
+        import trails.signals
@@ -0,0 +1,182 @@
+"""
+HTTP caching helpers for the read-mostly trail and park endpoints. Parks and
+trails only change when sync_parks_trails runs or an admin edits them, so
+clients can revalidate with ETag/Last-Modified and get a 304 instead of the
+whole list being serialized again.
+
+On top of that, the rendered JSON of trail and park list/detail responses is
+kept in the Django cache. Every cached response belongs to a scope such as
+"trail-list" or "trail:12". Each scope has a generation token that is part of
+the cache key, so invalidating a scope just replaces its token and the old
+entries are never read again (see trails/signals.py). The response cache is
+only used with a shared cache (TRAILS_RESPONSE_CACHE, on when REDIS_URL is
+set): with per-process memory, invalidations from one worker or from a
+management command would never reach the others.
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers, quote_etag)
+from django.utils.http import http_date, urlencode
+
+
+CACHE_PREFIX = "trails:response"
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Generation shared by every scope, replaced by invalidate_all_responses()
+GLOBAL_SCOPE = "all"
+
+
+def _generation_key(scope):
+    return f"{CACHE_PREFIX}:gen:{scope}"
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def get_generations(scopes):
+    """Current generation token for each scope, creating missing ones"""
+    keys = {scope: _generation_key(scope) for scope in scopes}
+    found = cache.get_many(keys.values())
+
+    tokens, missing = {}, {}
+    for scope, key in keys.items():
+        if key in found:
+            tokens[scope] = found[key]
+        else:
+            tokens[scope] = missing[key] = _new_token()
+    if missing:
+        cache.set_many(missing, timeout=None)
+    return [tokens[scope] for scope in scopes]
+
+
+def invalidate_responses(*scopes):
+    """Drop all cached responses for the given scopes"""
+    cache.set_many({_generation_key(scope): _new_token() for scope in scopes},
+                   timeout=None)
+
+
+def invalidate_all_responses():
+    """Drop every cached trail and park response (used after bulk changes)"""
+    invalidate_responses(GLOBAL_SCOPE)
+
+
+def response_cache_enabled():
+    return settings.TRAILS_RESPONSE_CACHE
+
+
+def build_etag(request, *parts):
+    """ETag from the request path, the negotiated format and validator parts"""
+    raw = "|".join([request.get_full_path(), request.accepted_renderer.format]
+                   + [str(part) for part in parts])
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def build_cache_key(request, tokens):
+    """Cache key for a response, independent of query parameter order"""
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = "|".join([request.path, query, request.accepted_renderer.format])
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f"{CACHE_PREFIX}:{':'.join(tokens)}:{digest}"
+
+
+class ConditionalGetMixin:
+    """
+        Adds conditional GET support to list and retrieve on a ModelViewSet.
+        Validators come from an aggregate over the queryset: the row count
+        (catches deletes) and the newest of last_modified_fields (catches
+        creates and edits).
+
+        Setting response_cache_scope also caches the rendered JSON together
+        with its validators, so a hit needs no database query at all.
+    """
+    last_modified_fields = ["updated_at"]
+    cache_max_age = 300
+    response_cache_scope = None
+
+    def get_validators(self, queryset):
+        """Return (row count, latest modification time) for the queryset"""
+        aggregates = queryset.order_by().aggregate(
+            count=Count("pk"),
+            **{f"latest_{i}": Max(field) for i, field in enumerate(self.last_modified_fields)}
+        )
+        stamps = [value for key, value in aggregates.items()
+                  if key.startswith("latest_") and value is not None]
+        return aggregates["count"], max(stamps) if stamps else None
+
+    def add_cache_headers(self, response, etag, timestamp):
+        response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        patch_cache_control(response, max_age=self.cache_max_age)
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    def conditional_get(self, request, queryset, build_response, scope=None):
+        """
+            Answer with 304 Not Modified when the client's validators still
+            match, otherwise call build_response() and attach validators.
+            With a scope, JSON responses are served from and saved to the
+            response cache, when it is enabled.
+        """
+        tokens, cache_key = [], None
+        if scope and response_cache_enabled() and request.accepted_renderer.format == "json":
+            # Read generations before the queryset runs, so a save that
+            # happens mid-request can only leave behind an unreachable entry
+            tokens = get_generations([GLOBAL_SCOPE, scope])
+            cache_key = build_cache_key(request, tokens)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                etag, timestamp, content, content_type = cached
+                response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+                if response is None:
+                    response = HttpResponse(content, content_type=content_type)
+                return self.add_cache_headers(response, etag, timestamp)
+
+        count, last_modified = self.get_validators(queryset)
+        etag = build_etag(request, count, last_modified.isoformat() if last_modified else "",
+                          *tokens)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = build_response()
+            if response.status_code != 200:
+                return response
+            if cache_key:
+                response.add_post_render_callback(
+                    lambda rendered: cache.set(
+                        cache_key,
+                        (etag, timestamp, rendered.content, rendered["Content-Type"]),
+                        RESPONSE_CACHE_TIMEOUT))
+
+        return self.add_cache_headers(response, etag, timestamp)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        scope = f"{self.response_cache_scope}-list" if self.response_cache_scope else None
+        return self.conditional_get(
+            request, queryset, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+            scope)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        build_response = lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        try:
+            queryset = self.filter_queryset(self.get_queryset())
+            # Normalise the id ("007" -> 7) so it matches the invalidated scope
+            pk = queryset.model._meta.pk.to_python(kwargs[lookup_url_kwarg])
+            queryset = queryset.filter(pk=pk)
+        except (TypeError, ValueError, ValidationError):
+            # Malformed id, let get_object() answer with a 404
+            return build_response()
+        scope = f"{self.response_cache_scope}:{pk}" if self.response_cache_scope else None
+        return self.conditional_get(request, queryset, build_response, scope)
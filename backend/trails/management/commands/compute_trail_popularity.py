@@ -0,0 +1,17 @@
+"""
+Management command to recompute trail popularity scores
+Usage: python manage.py compute_trail_popularity
+Meant to be run periodically (e.g. hourly cron job on Railway)
+"""
+
+from django.core.management.base import BaseCommand
+from trails.popularity import refresh_popularity_scores
+
+
+class Command(BaseCommand):
+    help = "Recompute popularity_score for all trails from recent activity"
+
+    def handle(self, *args, **options):
+        self.stdout.write("Computing trail popularity scores...")
+        scored = refresh_popularity_scores()
+        self.stdout.write(self.style.SUCCESS(f"Updated popularity for {scored} trails"))
@@ -5,6 +5,8 @@ Usage: python manage.py sync_parks_trails
 
 from django.core.management.base import BaseCommand
 from trails.models import Park, Trail
+from trails.caching import invalidate_all_responses
+from trails.summaries import defer_park_summaries, refresh_all_park_summaries
 from users.nps_service import NPS
 from users.recreation_trails_service import RecreationTrailService, CombinedParkTrailService
 from django.utils import timezone
@@ -33,30 +35,38 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.SUCCESS("Starting park and trail sync..."))
         
-        if test_mode:
-            self.stdout.write(self.style.WARNING("TEST MODE: Syncing only 2 parks from MN"))
-            self.sync_state("MN", combined_service, limit=2)
-        elif state:
-            # Sync specific state
-            self.sync_state(state.upper(), combined_service, limit)
-        else:
-            # Sync all states
-            states = [
-                "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA",
-                "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD",
-                "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ",
-                "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC",
-                "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"
-            ]
+        # Every summary is rebuilt below, not once per synced trail
+        with defer_park_summaries():
+            if test_mode:
+                self.stdout.write(self.style.WARNING("TEST MODE: Syncing only 2 parks from MN"))
+                self.sync_state("MN", combined_service, limit=2)
+            elif state:
+                # Sync specific state
+                self.sync_state(state.upper(), combined_service, limit)
+            else:
+                # Sync all states
+                states = [
+                    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA",
+                    "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD",
+                    "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ",
+                    "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC",
+                    "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"
+                ]
             
-            for state_code in states:
-                self.stdout.write(f"\nProcessing state: {state_code}")
-                try:
-                    self.sync_state(state_code, combined_service, limit)
-                    time.sleep(2)  # Rate limiting between states
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error with {state_code}: {str(e)}"))
-                    continue
+                for state_code in states:
+                    self.stdout.write(f"\nProcessing state: {state_code}")
+                    try:
+                        self.sync_state(state_code, combined_service, limit)
+                        time.sleep(2)  # Rate limiting between states
+                    except Exception as e:
+                        self.stdout.write(self.style.ERROR(f"Error with {state_code}: {str(e)}"))
+                        continue
+        
+        # Drop every cached park/trail response in one step after bulk changes
+        invalidate_all_responses()
+        
+        # Catches trails that moved between parks during the sync
+        self.stdout.write(f"Refreshed summaries for {refresh_all_park_summaries()} parks")
         
         self.stdout.write(self.style.SUCCESS("\n=== Sync completed! ==="))
         try:
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trails", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trail",
+            name="popularity_score",
+            field=models.FloatField(db_index=True, default=0),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trails", "0004_tag_trailfeature_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ParkSummary",
+            fields=[
+                (
+                    "park",
+                    models.OneToOneField(
+                        db_column="park_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="trails.park",
+                    ),
+                ),
+                ("trail_count", models.IntegerField(default=0)),
+                (
+                    "total_miles",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=8),
+                ),
+                ("miles_by_difficulty", models.JSONField(default=dict)),
+                ("max_elevation_gain_ft", models.IntegerField(blank=True, null=True)),
+                ("feature_counts", models.JSONField(default=dict)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "park_summaries",
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trails", "0005_park_summary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trail",
+            index=models.Index(
+                fields=["decimal_latitude", "decimal_longitude"],
+                name="trails_lat_lon_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trailfeature",
+            index=models.Index(
+                fields=["decimal_latitude", "decimal_longitude"],
+                name="trail_features_lat_lon_idx",
+            ),
+        ),
+    ]
@@ -50,16 +50,55 @@ class Trail(models.Model):
     is_active = models.BooleanField(default=True)
     nps_data = models.JSONField(null=True, blank=True)
     last_synced = models.DateTimeField(null=True, blank=True)
+    popularity_score = models.FloatField(default=0, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = "trails"
         ordering = ["name"]
+        indexes = [
+            # Bounding box lookups when matching hikes to trails
+            models.Index(fields=["decimal_latitude", "decimal_longitude"], 
+                         name="trails_lat_lon_idx"),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.difficulty})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Moving the trail to another park changes the old park's summary too
+        # (trails/signals.py); remembered here so saves don't query for it
+        instance._loaded_park_id = instance.__dict__.get("park_id")
+        return instance
+
+
+class ParkSummary(models.Model):
+    """Precomputed rollup of a park's active trails, refreshed on trail changes"""
+    park = models.OneToOneField(
+        Park,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        db_column="park_id",
+        related_name="summary"
+    )
+    trail_count = models.IntegerField(default=0)
+    total_miles = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    # {"easy": "3.10", "moderate": "12.40", ...}
+    miles_by_difficulty = models.JSONField(default=dict)
+    max_elevation_gain_ft = models.IntegerField(null=True, blank=True)
+    # {"waterfall": 2, "viewpoint": 5, ...}
+    feature_counts = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = "park_summaries"
+    
+    def __str__(self):
+        return f"Summary for {self.park.park_name}"
+
 
 class SavedTrail(models.Model):
     """User's saved/bookmarked trails (was UserTrail)"""
@@ -189,6 +228,7 @@ class Tag(models.Model):
     """Tags for categorizing trails"""
     tag_id = models.AutoField(primary_key=True)
     tag_name = models.CharField(max_length=100, unique=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = "tags"
@@ -235,9 +275,14 @@ class TrailFeature(models.Model):
     decimal_latitude = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True)
     decimal_longitude = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True)
     description = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = "trail_features"
+        indexes = [
+            models.Index(fields=["decimal_latitude", "decimal_longitude"], 
+                         name="trail_features_lat_lon_idx"),
+        ]
     
     def __str__(self):
         return f"{self.feature_name} on {self.trail.name}"
\ No newline at end of file
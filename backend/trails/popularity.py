@@ -0,0 +1,94 @@
+"""
+Trail popularity scoring. Combines completed hikes, saves, reviews and photo
+uploads into one score per trail, with older activity decaying away.
+"""
+
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from tracking.models import Hike
+from .caching import invalidate_all_responses
+from .models import Trail, SavedTrail, Review, Photo
+
+
+# Activity older than this is ignored completely
+WINDOW_DAYS = 365
+
+# Activity loses half of its weight every HALF_LIFE_DAYS
+HALF_LIFE_DAYS = 30
+
+# How much one event of each kind is worth before decay
+WEIGHTS = {
+    "hikes": 3.0,
+    "saves": 2.0,
+    "reviews": 2.0,
+    "photos": 1.0,
+}
+
+BATCH_SIZE = 1000
+
+
+def _activity_sources(since):
+    """Querysets of (trail, date) activity and the timestamp field to bucket on"""
+    return {
+        "hikes": (Hike.objects.filter(completed=True, start_time__gte=since), "start_time"),
+        "saves": (SavedTrail.objects.filter(saved_at__gte=since), "saved_at"),
+        "reviews": (Review.objects.filter(created_at__gte=since), "created_at"),
+        "photos": (Photo.objects.filter(trail__isnull=False, uploaded_at__gte=since),
+                   "uploaded_at"),
+    }
+
+
+def compute_popularity_scores(now=None):
+    """
+        Returns {trail_id: score}. Every source is grouped by trail and day in
+        the database, so each query returns at most one row per trail per day
+        no matter how much activity there was.
+    """
+    now = now or timezone.now()
+    today = now.date()
+    since = now - timedelta(days=WINDOW_DAYS)
+    decay = math.log(2) / HALF_LIFE_DAYS
+
+    scores = defaultdict(float)
+    for source, (queryset, field) in _activity_sources(since).items():
+        buckets = (queryset.annotate(day=TruncDate(field))
+                   .values("trail_id", "day")
+                   .annotate(events=Count("pk"))
+                   .order_by())
+        weight = WEIGHTS[source]
+        for row in buckets:
+            age_days = max((today - row["day"]).days, 0)
+            scores[row["trail_id"]] += weight * row["events"] * math.exp(-decay * age_days)
+    return scores
+
+
+def refresh_popularity_scores(now=None):
+    """
+        Recompute and store popularity_score for every trail. Trails with no
+        recent activity are reset to 0. Returns the number of scored trails.
+    """
+    scores = {trail_id: round(score, 4)
+              for trail_id, score in compute_popularity_scores(now).items()}
+
+    with transaction.atomic():
+        current = dict(Trail.objects.exclude(popularity_score=0).values_list(
+            "trail_id", "popularity_score"))
+        # updated_at is the trail validators' Last-Modified, and bulk_update
+        # doesn't set auto_now fields, so only changed trails get a new one
+        changed_at = timezone.now()
+        trails = [Trail(trail_id=trail_id, popularity_score=score, updated_at=changed_at)
+                  for trail_id, score in {**dict.fromkeys(current, 0), **scores}.items()
+                  if current.get(trail_id, 0) != score]
+        Trail.objects.bulk_update(trails, ["popularity_score", "updated_at"],
+                                  batch_size=BATCH_SIZE)
+        # bulk_update skips signals, so cached trail responses are dropped here
+        transaction.on_commit(invalidate_all_responses)
+
+    return len(scores)
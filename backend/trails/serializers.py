@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Park, Trail, SavedTrail, Review, TrailCondition, Photo, Tag, TrailTag, TrailFeature
+from .models import Park, ParkSummary, Trail, SavedTrail, Review, TrailCondition, Photo, Tag, TrailTag, TrailFeature
 
 
 class ParkSerializer(serializers.ModelSerializer):
@@ -8,12 +8,24 @@ class ParkSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ParkSummarySerializer(serializers.ModelSerializer):
+    park_name = serializers.CharField(source="park.park_name", read_only=True)
+    
+    class Meta:
+        model = ParkSummary
+        fields = ["park", "park_name", "trail_count", "total_miles", 
+                  "miles_by_difficulty", "max_elevation_gain_ft", 
+                  "feature_counts", "updated_at"]
+        read_only_fields = fields
+
+
 class TrailSerializer(serializers.ModelSerializer):
     park_name = serializers.CharField(source="park.park_name", read_only=True)
     
     class Meta:
         model = Trail
         fields = "__all__"
+        read_only_fields = ["popularity_score"]
 
 
 class SavedTrailSerializer(serializers.ModelSerializer):
@@ -0,0 +1,53 @@
+"""
+Signals for trails app. Keeps the cached trail and park responses
+(trails/caching.py) in step with the database.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Park, Trail, TrailFeature
+from .caching import invalidate_all_responses, invalidate_responses
+from .summaries import refresh_park_summary, summaries_deferred
+
+
+def _invalidate_on_commit(*scopes):
+    """Invalidate once the write is visible, so no reader can re-cache old rows"""
+    transaction.on_commit(lambda: invalidate_responses(*scopes))
+
+
+@receiver([post_save, post_delete], sender=Trail)
+def invalidate_trail_responses(sender, instance, **kwargs):
+    """A trail changed: its detail and every trail list are stale"""
+    _invalidate_on_commit("trail-list", f"trail:{instance.pk}")
+
+
+@receiver([post_save, post_delete], sender=Trail)
+def refresh_summary_for_trail(sender, instance, **kwargs):
+    """Keep the park rollup current when one of its trails changes"""
+    if summaries_deferred():
+        return
+    # Trail.from_db() remembers the park the trail was loaded with
+    park_ids = {instance.park_id, getattr(instance, "_loaded_park_id", None)} - {None}
+    instance._loaded_park_id = instance.park_id
+    for park_id in park_ids:
+        transaction.on_commit(lambda park_id=park_id: refresh_park_summary(park_id))
+
+
+@receiver([post_save, post_delete], sender=TrailFeature)
+def refresh_summary_for_feature(sender, instance, **kwargs):
+    """Feature counts are part of the park rollup"""
+    if summaries_deferred():
+        return
+    park_id = Trail.objects.filter(trail_id=instance.trail_id).values_list(
+        "park_id", flat=True).first()
+    if park_id:
+        transaction.on_commit(lambda: refresh_park_summary(park_id))
+
+
+@receiver([post_save, post_delete], sender=Park)
+def invalidate_park_responses(sender, instance, **kwargs):
+    """
+        A park changed: park_name is embedded in each of its trails too, so
+        every cached response goes rather than looking up the park's trails
+    """
+    transaction.on_commit(invalidate_all_responses)
@@ -0,0 +1,77 @@
+"""
+Per-park trail rollups. Park cards need counts, mileage and difficulty mix,
+which used to be computed client-side from the full trail list.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db.models import Count, Max, Q, Sum
+
+from .models import Park, ParkSummary, Trail, TrailFeature
+
+
+DIFFICULTIES = [choice for choice, _ in Trail._meta.get_field("difficulty").choices]
+
+# Set while a bulk job rebuilds every summary at the end anyway
+_deferred = ContextVar("park_summaries_deferred", default=False)
+
+
+@contextmanager
+def defer_park_summaries():
+    """Skip the per-trail summary refreshes (trails/signals.py) inside the block"""
+    token = _deferred.set(True)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+
+
+def summaries_deferred():
+    return _deferred.get()
+
+
+def refresh_park_summary(park_id):
+    """Recompute the rollup row for one park with two aggregate queries"""
+    if not Park.objects.filter(park_id=park_id).exists():
+        # Park was deleted along with its trails
+        return None
+    
+    trails = Trail.objects.filter(park_id=park_id, is_active=True)
+    totals = trails.aggregate(
+        trail_count=Count("trail_id"),
+        total_miles=Sum("decimal_length_miles"),
+        max_elevation_gain_ft=Max("elevation_gain_ft"),
+        **{difficulty: Sum("decimal_length_miles", filter=Q(difficulty=difficulty))
+           for difficulty in DIFFICULTIES}
+    )
+    feature_counts = (TrailFeature.objects
+                      .filter(trail__park_id=park_id, trail__is_active=True)
+                      .exclude(feature_type="")
+                      .values("feature_type")
+                      .annotate(count=Count("feature_id"))
+                      .order_by())
+
+    summary, _ = ParkSummary.objects.update_or_create(
+        park_id=park_id,
+        defaults={
+            "trail_count": totals["trail_count"],
+            "total_miles": totals["total_miles"] or 0,
+            "miles_by_difficulty": {
+                difficulty: str(Decimal(totals[difficulty] or 0).quantize(Decimal("0.01")))
+                for difficulty in DIFFICULTIES
+            },
+            "max_elevation_gain_ft": totals["max_elevation_gain_ft"],
+            "feature_counts": {row["feature_type"]: row["count"] for row in feature_counts},
+        }
+    )
+    return summary
+
+
+def refresh_all_park_summaries():
+    """Rebuild every park's rollup, e.g. after a bulk sync"""
+    park_ids = list(Park.objects.values_list("park_id", flat=True))
+    for park_id in park_ids:
+        refresh_park_summary(park_id)
+    return len(park_ids)
@@ -1,3 +1,220 @@
-from django.test import TestCase
+import io
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from tracking.models import Hike
+from tracking.testing import HikerTestMixin, create_park, create_trail
+from .models import Park, ParkSummary, Trail, SavedTrail
+from .popularity import refresh_popularity_scores
+
+
+class PopularityTests(HikerTestMixin, TestCase):
+    """Scores come from recent activity and the popular endpoint reads them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.busy, cls.quiet, cls.idle = [create_trail(cls.park, name)
+                                         for name in ("Busy", "Quiet", "Idle")]
+
+    def test_refresh_scores(self):
+        now = timezone.now()
+        for _ in range(3):
+            Hike.objects.create(user=self.user, trail=self.busy, start_time=now, completed=True)
+        # Not completed, doesn't count
+        Hike.objects.create(user=self.user, trail=self.quiet, start_time=now)
+        # A month old: about half the weight
+        Hike.objects.create(user=self.user, trail=self.quiet, completed=True,
+                            start_time=now - timedelta(days=30))
+        SavedTrail.objects.create(user=self.user, trail=self.quiet)
+        Trail.objects.filter(pk=self.idle.pk).update(popularity_score=5)
+
+        self.assertEqual(refresh_popularity_scores(now), 2)
+        scores = dict(Trail.objects.values_list("name", "popularity_score"))
+        self.assertAlmostEqual(scores["Busy"], 9.0)
+        self.assertAlmostEqual(scores["Quiet"], 1.5 + 2.0, places=3)
+        self.assertEqual(scores["Idle"], 0)
+
+    def test_popular_endpoint(self):
+        Trail.objects.filter(pk=self.busy.pk).update(popularity_score=9)
+        Trail.objects.filter(pk=self.quiet.pk).update(popularity_score=3)
+
+        response = self.client.get("/api/trails/trails/popular/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([trail["name"] for trail in response.data], ["Busy", "Quiet"])
+
+        response = self.client.get("/api/trails/trails/popular/", {"limit": 1})
+        self.assertEqual([trail["name"] for trail in response.data], ["Busy"])
+        # Clamped to at least one trail
+        for limit in ("-1", "0"):
+            response = self.client.get("/api/trails/trails/popular/", {"limit": limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), 1)
+        response = self.client.get("/api/trails/trails/popular/", {"limit": "lots"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(HikerTestMixin, TestCase):
+    """Park and trail detail answer 304 while nothing changed"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def assert_conditional(self, url, max_age):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertIn("Last-Modified", response)
+        self.assertIn(f"max-age={max_age}", response["Cache-Control"])
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        cached = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+        return response
+
+    def test_trail_detail(self):
+        url = f"/api/trails/trails/{self.trail.pk}/"
+        response = self.assert_conditional(url, 300)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trail.name = "High Ridge"
+            self.trail.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data["name"], "High Ridge")
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_park_detail(self):
+        url = f"/api/trails/parks/{self.park.pk}/"
+        response = self.assert_conditional(url, 3600)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.park.park_name = "Renamed Park"
+            self.park.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    @override_settings(TRAILS_RESPONSE_CACHE=False)
+    def test_popularity_refresh_changes_validators(self):
+        url = f"/api/trails/trails/{self.trail.pk}/"
+        response = self.client.get(url)
+        Hike.objects.create(user=self.user, trail=self.trail, start_time=timezone.now(), completed=True)
+
+        refresh_popularity_scores()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertGreater(changed.data["popularity_score"], 0)
+        # Unchanged scores leave the validators alone
+        refresh_popularity_scores()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=changed["ETag"]).status_code, 304)
+
+
+@override_settings(TRAILS_RESPONSE_CACHE=True)
+class ResponseCacheTests(HikerTestMixin, TestCase):
+    """Cached trail responses are dropped by writes and by the bulk commands"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.url = f"/api/trails/trails/{self.trail.pk}/"
+
+    def get_cached(self):
+        """Detail response, asserting it came from the cache"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+        return response
+
+    def test_write_invalidates(self):
+        self.client.get(self.url)
+        self.assertEqual(json.loads(self.get_cached().content)["name"], "Test Trail")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trail.name = "High Ridge"
+            self.trail.save()
+        self.assertEqual(self.client.get(self.url).data["name"], "High Ridge")
+        self.assertEqual(json.loads(self.get_cached().content)["name"], "High Ridge")
+
+    def test_park_write_invalidates(self):
+        self.client.get(self.url)
+        self.get_cached()
+        park = Park.objects.get(pk=self.park.pk)
+        # Neither save looks anything up to invalidate
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            park.park_name = "Renamed Park"
+            park.save()
+        self.assertEqual(self.client.get(self.url).data["park_name"], "Renamed Park")
+
+        trail = Trail.objects.get(pk=self.trail.pk)
+        with self.assertNumQueries(1):
+            trail.name = "High Ridge"
+            trail.save()
+
+    def test_popularity_command_invalidates(self):
+        self.client.get(self.url)
+        self.get_cached()
+        Hike.objects.create(user=self.user, trail=self.trail, start_time=timezone.now(),
+                            completed=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("compute_trail_popularity", stdout=io.StringIO())
+        self.assertGreater(self.client.get(self.url).data["popularity_score"], 0)
+
+    @override_settings(TRAILS_RESPONSE_CACHE=False)
+    def test_disabled_without_shared_cache(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(queries), 0)
+
+
+class ParkSummaryTests(TestCase):
+    """Summaries follow trail changes, including moves between parks"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.north, cls.south = [create_park(code, code) for code in ("north", "south")]
+
+    def summary(self, park):
+        return ParkSummary.objects.get(park=park)
+
+    def test_trail_move_refreshes_both_parks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            trail = create_trail(self.north, "Lake", 4)
+            create_trail(self.north, "Ridge", 2)
+        self.assertEqual(self.summary(self.north).trail_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            trail.park = self.south
+            trail.save()
+        self.assertEqual((self.summary(self.north).trail_count, self.summary(self.north).total_miles),
+                         (1, 2))
+        self.assertEqual(self.summary(self.south).trail_count, 1)
+
+    def test_sync_rebuilds_summaries_once(self):
+        parks = [{"park": {"code": "north", "name": "North", "state": "WA"},
+                  "trails": [{"id": f"north-{i}", "name": f"Trail {i}", "length": 2}
+                             for i in range(5)]}]
+        command = "trails.management.commands.sync_parks_trails"
+        with mock.patch(f"{command}.NPS"), mock.patch(f"{command}.RecreationTrailService"), \
+                mock.patch(f"{command}.CombinedParkTrailService") as combined, \
+                mock.patch("trails.signals.refresh_park_summary") as per_trail, \
+                self.captureOnCommitCallbacks(execute=True):
+            combined.return_value.get_parks_with_trails_by_state.return_value = parks
+            call_command("sync_parks_trails", state="WA", stdout=io.StringIO())
+        per_trail.assert_not_called()
+        self.assertEqual(self.summary(self.north).trail_count, 5)
@@ -2,25 +2,47 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import Park, Trail, SavedTrail, Review, TrailCondition, Photo, Tag, TrailFeature
-from .serializers import (ParkSerializer, TrailSerializer, SavedTrailSerializer, 
+from .models import Park, ParkSummary, Trail, SavedTrail, Review, TrailCondition, Photo, Tag, TrailFeature
+from .serializers import (ParkSerializer, ParkSummarySerializer, TrailSerializer, SavedTrailSerializer, 
                           ReviewSerializer, TrailConditionSerializer, PhotoSerializer,
                           TagSerializer, TrailFeatureSerializer, TrailPhotoUploadSerializer)
+from .caching import ConditionalGetMixin
+from .summaries import refresh_park_summary
+from django.utils.cache import patch_cache_control
 import cloudinary.uploader
 
 
-class ParkViewSet(viewsets.ModelViewSet):
+class ParkViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """API endpoint for parks"""
     queryset = Park.objects.all()
     serializer_class = ParkSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    last_modified_fields = ["last_synced"]
+    cache_max_age = 3600
+    response_cache_scope = "park"
+    
+    @action(detail=True, methods=["get"])
+    def summary(self, request, pk=None):
+        """Get the precomputed trail rollup for a park"""
+        park = self.get_object()
+        try:
+            summary = ParkSummary.objects.select_related("park").get(park=park)
+        except ParkSummary.DoesNotExist:
+            # Parks without trail activity since the rollups were added
+            summary = refresh_park_summary(park.park_id)
+        serializer = ParkSummarySerializer(summary)
+        return Response(serializer.data)
 
 
-class TrailViewSet(viewsets.ModelViewSet):
+class TrailViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """API endpoint for trails"""
-    queryset = Trail.objects.all()
+    queryset = Trail.objects.select_related("park")
     serializer_class = TrailSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # park_name is part of every trail, so park edits invalidate too
+    last_modified_fields = ["updated_at", "park__last_synced"]
+    cache_max_age = 300
+    response_cache_scope = "trail"
     
     @action(detail=False, methods=["get"])
     def by_park(self, request):
@@ -28,9 +50,29 @@ class TrailViewSet(viewsets.ModelViewSet):
         park_id = request.query_params.get("park_id")
         if park_id:
             trails = self.queryset.filter(park_id=park_id)
-            serializer = self.get_serializer(trails, many=True)
-            return Response(serializer.data)
+            
+            def build_response():
+                serializer = self.get_serializer(trails, many=True)
+                return Response(serializer.data)
+            return self.conditional_get(request, trails, build_response, scope="trail-list")
         return Response({"error": "park_id required"}, status=400)
+    
+    @action(detail=False, methods=["get"])
+    def popular(self, request):
+        """Get the most popular trails using the precomputed popularity_score"""
+        try:
+            limit = max(1, min(int(request.query_params.get("limit", 20)), 100))
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=400)
+        
+        trails = (self.queryset
+                  .filter(is_active=True, popularity_score__gt=0)
+                  .order_by("-popularity_score")[:limit])
+        serializer = self.get_serializer(trails, many=True)
+        response = Response(serializer.data)
+        # Scores only change when compute_trail_popularity runs
+        patch_cache_control(response, max_age=600)
+        return response
 
 
 class SavedTrailViewSet(viewsets.ModelViewSet):
@@ -174,15 +216,17 @@ class PhotoViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """API endpoint for tags"""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cache_max_age = 3600
 
 
-class TrailFeatureViewSet(viewsets.ModelViewSet):
+class TrailFeatureViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """API endpoint for trail features"""
     queryset = TrailFeature.objects.all()
     serializer_class = TrailFeatureSerializer
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cache_max_age = 3600
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Authentication for WebSocket connections. Browsers can't set an
+Authorization header on a WebSocket, so the DRF token is passed in the query
+string instead: ws://.../ws/tracking/tracks/5/?token={token}
+"""
+
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.authtoken.models import Token
+
+
+@database_sync_to_async
+def get_token_user(key):
+    try:
+        return Token.objects.select_related("user").get(key=key).user
+    except Token.DoesNotExist:
+        return AnonymousUser()
+
+
+class TokenAuthMiddleware:
+    """Sets scope["user"] from a ?token= query parameter when one is given"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        if "token" in query:
+            scope = dict(scope, user=await get_token_user(query["token"][0]))
+        return await self.inner(scope, receive, send)
+
+
+def TokenAuthMiddlewareStack(inner):
+    """Token auth, falling back to the Django session like the REST API"""
+    return AuthMiddlewareStack(TokenAuthMiddleware(inner))
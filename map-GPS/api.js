@@ -78,6 +78,17 @@ const GPSAPI = {
       return res.data;
     } catch (e) { handleError(e); }
   },
+  
+  // Live track WebSocket. The track's owner can send
+  // { type: 'points', points: [...] }; followers only receive messages
+  openLiveTrack(trackId, onMessage) {
+    const origin = new URL(API_URL).origin.replace(/^http/, 'ws');
+    const token = localStorage.getItem('token');
+    const socket = new WebSocket(`${origin}/ws/tracking/tracks/${trackId}/?token=${token}`);
+    socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+    socket.onerror = (event) => console.error('Live track socket error', event);
+    return socket;
+  },
 };
 
 window.GPSAPI = GPSAPI;